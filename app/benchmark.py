@@ -0,0 +1,896 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from client import Client
+from compression import compress_blocks
+from digests import SUPPORTED_DIGESTS, segment_digest
+from message import FrameReader, Message, WIRE_FORMAT_BINARY, WIRE_FORMATS
+from server import ClientConnection, Server
+
+
+def _legacy_frames(sock):
+    # Ancienne boucle de réception : concaténation et redécoupage du buffer
+    buffer = b""
+    while True:
+        data = sock.recv(2048)
+        if not data:
+            return
+        buffer += data
+        while len(buffer) >= 4:
+            message_length = int.from_bytes(buffer[:4], byteorder="big")
+            if len(buffer) - 4 >= message_length:
+                yield buffer[4 : 4 + message_length]
+                buffer = buffer[4 + message_length :]
+            else:
+                break
+
+
+def _frame_reader_frames(sock):
+    return FrameReader(sock)
+
+
+def _measure_receive(read_frames, burst):
+    sender, receiver = socket.socketpair()
+
+    def send_burst():
+        sender.sendall(burst)
+        sender.close()
+
+    thread = threading.Thread(target=send_burst)
+    start = time.perf_counter()
+    thread.start()
+    frames = 0
+    for frame in read_frames(receiver):
+        Message.deserialize(frame)
+        frames += 1
+    elapsed = time.perf_counter() - start
+    thread.join()
+    receiver.close()
+    return frames, elapsed
+
+
+def benchmark_frames(args):
+    payload = bytes(args.segment_size)
+    frame = Message("DATA", 0, payload, bytes(32)).serialize(WIRE_FORMAT_BINARY)
+    print(f"{'frames':>8} {'legacy MB/s':>12} {'FrameReader MB/s':>17}")
+    for frame_count in args.frame_counts:
+        burst = frame * frame_count
+        results = []
+        for read_frames in (_legacy_frames, _frame_reader_frames):
+            frames, elapsed = _measure_receive(read_frames, burst)
+            assert frames == frame_count
+            results.append(len(burst) / elapsed / 1e6)
+        print(f"{frame_count:>8} {results[0]:>12.1f} {results[1]:>17.1f}")
+
+
+def _start_server(files_directory, drop_probability=0, **options):
+    # Serveur asyncio dans un thread, sur un port libre de la boucle locale ;
+    # avec drop_probability, il perd des segments comme avec --drop-test
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = Server(
+        "127.0.0.1",
+        port,
+        None,
+        files_directory,
+        drop_probability > 0,
+        drop_probability,
+        **options,
+    )
+    threading.Thread(target=server.start, daemon=True).start()
+    _wait_for_port(port)
+    return server
+
+
+def _wait_for_disconnections(server, timeout=10):
+    # Le serveur a fermé toutes ses connexions, et suspendu ou terminé leurs
+    # uploads : le répertoire temporaire peut être supprimé
+    deadline = time.monotonic() + timeout
+    while server.metrics.snapshot()["gauges"]["connections"]:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Server did not close its connections")
+        time.sleep(0.01)
+
+
+@contextlib.contextmanager
+def _local_server(files_directory, drop_probability=0, **options):
+    # Serveur de _start_server dont les traces, comme celles des clients du
+    # bloc, noieraient le résultat. Donne son port.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        server = _start_server(files_directory, drop_probability, **options)
+        try:
+            yield server.port
+        finally:
+            _wait_for_disconnections(server)
+
+
+@contextlib.contextmanager
+def _local_client(files_directory, drop_probability=0, **options):
+    # Client connecté à un _local_server, fermé à la sortie du bloc
+    with _local_server(files_directory, drop_probability, **options) as port:
+        client = Client("127.0.0.1", port, None, 0)
+        try:
+            yield client
+        finally:
+            client.close()
+
+
+async def _upload_session(port, index, payload, args, all_connected):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, ("127.0.0.1", port))
+        # Toutes les sessions sont ouvertes avant le début des envois
+        await all_connected.wait()
+
+        frames = FrameReader(sock).frames(loop)
+        wire_data = zlib.compress(payload) if args.compressed else payload
+        segments = [
+            wire_data[i : i + args.segment_size]
+            for i in range(0, len(wire_data), args.segment_size)
+        ]
+        upload = Message(
+            "UPLOAD",
+            content={
+                "file_name": f"session-{os.getpid()}-{index}.bin",
+                "file_hash": hashlib.sha256(payload).hexdigest(),
+                "file_size": len(payload),
+                "file_compressed": args.compressed,
+                "wire_formats": WIRE_FORMATS,
+                "window_size": len(segments),
+                "cumulative_ack": True,
+            },
+        )
+        await loop.sock_sendall(sock, upload.serialize())
+        await anext(frames)  # UPLOAD_ACK
+
+        data = b"".join(
+            Message(
+                "DATA", sequence_num, segment, hashlib.sha256(segment).digest()
+            ).serialize(WIRE_FORMAT_BINARY)
+            for sequence_num, segment in enumerate(segments)
+        )
+        await loop.sock_sendall(sock, data + Message("EOF").serialize(WIRE_FORMAT_BINARY))
+        async for frame in frames:
+            if Message.deserialize(frame).type == "EOF_ACK":
+                return True
+        return False
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def _payload(size):
+    # Données moyennement compressibles, pour que le serveur décompresse
+    return os.urandom(size // 2).hex().encode()[:size]
+
+
+async def _run_sessions(port, args, sessions):
+    payload = _payload(args.file_size)
+    all_connected = asyncio.Event()
+    tasks = [
+        asyncio.create_task(_upload_session(port, index, payload, args, all_connected))
+        for index in range(sessions)
+    ]
+    await asyncio.sleep(args.connect_delay)
+    start = time.perf_counter()
+    all_connected.set()
+    results = await asyncio.gather(*tasks)
+    return sum(results), time.perf_counter() - start
+
+
+def benchmark_sessions(args):
+    with tempfile.TemporaryDirectory() as files_directory:
+        with _local_server(files_directory) as port:
+            succeeded, elapsed = asyncio.run(_run_sessions(port, args, args.sessions))
+    total_bytes = succeeded * args.file_size
+    print(
+        f"{succeeded}/{args.sessions} concurrent sessions completed in {elapsed:.2f}s "
+        f"({total_bytes / elapsed / 1e6:.1f} MB/s, {succeeded / elapsed:.0f} uploads/s)"
+    )
+
+
+def _client_process(port, args, sessions):
+    return asyncio.run(_run_sessions(port, args, sessions))
+
+
+def _wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def benchmark_workers(args):
+    # Le générateur de charge est lui aussi réparti sur plusieurs processus
+    # pour ne pas devenir le goulot d'étranglement
+    print(f"{'workers':>8} {'uploads':>8} {'MB/s':>8}")
+    for workers in args.worker_counts:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        with tempfile.TemporaryDirectory() as files_directory:
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+                    "--host",
+                    "127.0.0.1",
+                    "--port",
+                    str(port),
+                    "--mac-address",
+                    "00:00:00:00:00:00",
+                    "--files-directory",
+                    files_directory,
+                    "--workers",
+                    str(workers),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                _wait_for_port(port)
+                sessions = args.sessions // args.client_processes
+                with multiprocessing.Pool(args.client_processes) as pool:
+                    results = pool.starmap(
+                        _client_process,
+                        [(port, args, sessions)] * args.client_processes,
+                    )
+            finally:
+                server.terminate()
+                server.wait()
+        succeeded = sum(result[0] for result in results)
+        elapsed = max(result[1] for result in results)
+        print(
+            f"{workers:>8} {succeeded:>8} {succeeded * args.file_size / elapsed / 1e6:>8.1f}"
+        )
+
+
+def _edit(data, edits, edit_size):
+    # Petites modifications réparties dans le fichier : remplacements,
+    # insertions et suppressions, qui décalent la suite du fichier
+    data = bytearray(data)
+    for _ in range(edits):
+        position = random.randrange(len(data))
+        kind = random.choice(["replace", "insert", "delete"])
+        if kind == "replace":
+            data[position : position + edit_size] = os.urandom(edit_size)
+        elif kind == "insert":
+            data[position:position] = os.urandom(edit_size)
+        else:
+            del data[position : position + edit_size]
+    return bytes(data)
+
+
+def _bytes_on_wire(client, file_path, args):
+    protocol = Client.FileTransmissionProtocol(
+        client, args.window_size, args.segment_size, 1.0, args.compressed, "WIFI"
+    )
+    start = time.perf_counter()
+    status = protocol.send_file(file_path)
+    assert status == "SUCCESS", status
+    return protocol.metrics.counter("bytes_sent_total"), time.perf_counter() - start
+
+
+def benchmark_delta(args):
+    # Octets envoyés pour une nouvelle version d'un fichier déjà présent sur
+    # le serveur, comparés à ceux du premier envoi
+    random.seed(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as files_directory, tempfile.TemporaryDirectory() as local_directory:
+        with _local_client(files_directory) as client:
+            for edits in args.edit_counts:
+                file_path = os.path.join(local_directory, f"firmware-{edits}.bin")
+                # Contenu aléatoire : le serveur n'a pas déjà ce fichier
+                original = os.urandom(args.file_size)
+                with open(file_path, "wb") as file:
+                    file.write(original)
+                full_bytes, _ = _bytes_on_wire(client, file_path, args)
+                with open(file_path, "wb") as file:
+                    file.write(_edit(original, edits, args.edit_size))
+                delta_bytes, elapsed = _bytes_on_wire(client, file_path, args)
+                results.append((edits, full_bytes, delta_bytes, elapsed))
+
+    print(f"{'edits':>6} {'full bytes':>12} {'delta bytes':>12} {'ratio':>8} {'delta s':>8}")
+    for edits, full_bytes, delta_bytes, elapsed in results:
+        print(
+            f"{edits:>6} {full_bytes:>12} {delta_bytes:>12} "
+            f"{full_bytes / delta_bytes:>7.0f}x {elapsed:>8.2f}"
+        )
+
+
+def _read_chunks(file_path, chunk_size=64 * 1024):
+    with open(file_path, "rb") as file:
+        yield from iter(lambda: file.read(chunk_size), b"")
+
+
+def benchmark_compression(args):
+    # Taux et débit de compression par blocs selon le codec, le niveau et le
+    # nombre de processus
+    file_size = os.path.getsize(args.file)
+    print(f"{'codec':>8} {'level':>6} {'workers':>8} {'ratio':>7} {'MB/s':>8}")
+    for codec_level in args.codecs:
+        codec, _, level = codec_level.partition(":")
+        level = int(level) if level else None
+        for workers in args.worker_counts:
+            executor = (
+                concurrent.futures.ProcessPoolExecutor(
+                    workers, mp_context=multiprocessing.get_context("forkserver")
+                )
+                if workers > 1
+                else None
+            )
+            try:
+                if executor is not None:
+                    # Démarrage des processus hors de la mesure
+                    list(executor.map(abs, range(workers)))
+                start = time.perf_counter()
+                encoded = sum(
+                    len(block)
+                    for block in compress_blocks(
+                        _read_chunks(args.file), codec, level, executor, 2 * workers
+                    )
+                )
+                elapsed = time.perf_counter() - start
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            print(
+                f"{codec:>8} {level if level is not None else '-':>6} {workers:>8} "
+                f"{file_size / encoded:>7.2f} {file_size / elapsed / 1e6:>8.1f}"
+            )
+
+
+def benchmark_digests(args):
+    # Coût de l'empreinte des segments seule, puis d'un upload complet en
+    # local (client et serveur dans ce processus) selon l'empreinte négociée
+    segments = [os.urandom(args.segment_size) for _ in range(1024)]
+    results = []
+    with tempfile.TemporaryDirectory() as files_directory, tempfile.TemporaryDirectory() as local_directory:
+        with _local_client(files_directory) as client:
+            for digest in args.digests:
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    for segment in segments:
+                        segment_digest(digest, segment)
+                digest_rate = (
+                    args.rounds * len(segments) * args.segment_size
+                    / (time.perf_counter() - start)
+                )
+                file_path = os.path.join(local_directory, f"{digest}.bin")
+                with open(file_path, "wb") as file:
+                    file.write(os.urandom(args.file_size))
+                protocol = Client.FileTransmissionProtocol(
+                    client,
+                    args.window_size,
+                    args.segment_size,
+                    1.0,
+                    False,
+                    "WIFI",
+                    digest=digest,
+                )
+                start = time.perf_counter()
+                status = protocol.send_file(file_path)
+                elapsed = time.perf_counter() - start
+                assert status == "SUCCESS", status
+                results.append((digest, digest_rate, elapsed))
+
+    print(f"{'digest':>8} {'digest MB/s':>12} {'upload s':>9} {'upload MB/s':>12}")
+    for digest, digest_rate, elapsed in results:
+        print(
+            f"{digest:>8} {digest_rate / 1e6:>12.0f} {elapsed:>9.2f} "
+            f"{args.file_size / elapsed / 1e6:>12.1f}"
+        )
+
+
+class _DelayProxy:
+    # Relais TCP local qui retarde chaque sens de delay secondes sans en
+    # limiter le débit : un lien à forte latence, où la fenêtre d'un seul
+    # flux ne suffit pas à remplir le tuyau
+    def __init__(self, target_port, delay):
+        self._target_port = target_port
+        self._delay = delay
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client_socket, _ = self._listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self._target_port))
+            self._relay(client_socket, upstream)
+            self._relay(upstream, client_socket)
+
+    def _relay(self, source, destination):
+        pending = queue.Queue()
+
+        def read():
+            while True:
+                try:
+                    data = source.recv(64 * 1024)
+                except OSError:
+                    data = b""
+                pending.put((time.monotonic() + self._delay, data))
+                if not data:
+                    return
+
+        def write():
+            while True:
+                due, data = pending.get()
+                time.sleep(max(0.0, due - time.monotonic()))
+                try:
+                    if not data:
+                        destination.shutdown(socket.SHUT_WR)
+                        return
+                    destination.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+    def close(self):
+        # close seul ne débloque pas accept
+        with contextlib.suppress(OSError):
+            self._listener.shutdown(socket.SHUT_RDWR)
+        self._listener.close()
+
+
+def benchmark_stripes(args):
+    # Débit d'un upload selon le nombre de plages envoyées en parallèle, à
+    # travers un relais qui ajoute de la latence
+    results = []
+    with tempfile.TemporaryDirectory() as files_directory, tempfile.TemporaryDirectory() as local_directory:
+        with _local_server(files_directory) as port:
+            proxy = _DelayProxy(port, args.delay)
+            for stripes in args.stripe_counts:
+                file_path = os.path.join(local_directory, f"stripes-{stripes}.bin")
+                with open(file_path, "wb") as file:
+                    file.write(os.urandom(args.file_size))
+                client = Client("127.0.0.1", proxy.port, None, 0)
+                start = time.perf_counter()
+                status = client.send_file(
+                    file_path,
+                    args.window_size,
+                    args.segment_size,
+                    1.0,
+                    False,
+                    "WIFI",
+                    stripes=stripes,
+                )
+                elapsed = time.perf_counter() - start
+                client.close()
+                assert status == "SUCCESS", status
+                results.append((stripes, elapsed))
+            proxy.close()
+
+    print(f"{'stripes':>8} {'seconds':>8} {'MB/s':>8}")
+    for stripes, elapsed in results:
+        print(f"{stripes:>8} {elapsed:>8.2f} {args.file_size / elapsed / 1e6:>8.2f}")
+
+
+def benchmark_execute(args):
+    # Latence d'une exécution selon qu'elle lance un processus ou rejoue le
+    # cache, puis durée de jobs exécutions différentes lancées en même temps
+    with tempfile.TemporaryDirectory() as files_directory:
+        with open(os.path.join(files_directory, "job.py"), "w") as script:
+            script.write(
+                "import sys, time\n"
+                f"time.sleep({args.duration})\n"
+                "print('job', *sys.argv[1:])\n"
+            )
+        with _local_client(files_directory, execute_workers=args.workers) as client:
+            latencies = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                assert client.execute_file("job.py", "WIFI", ["cached"]) == 0
+                latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+                exit_codes = list(
+                    executor.map(
+                        lambda job: client.execute_file("job.py", "WIFI", [str(job)]),
+                        range(args.jobs),
+                    )
+                )
+            parallel_elapsed = time.perf_counter() - start
+            assert exit_codes == [0] * args.jobs, exit_codes
+
+    cached = latencies[1:] or [float("nan")]
+    print(f"first run: {latencies[0] * 1000:.1f} ms")
+    print(f"cached runs: {sum(cached) / len(cached) * 1000:.1f} ms on average")
+    print(
+        f"{args.jobs} different jobs on {args.workers} workers: {parallel_elapsed:.2f}s "
+        f"(at least {-(-args.jobs // args.workers) * args.duration:.2f}s)"
+    )
+
+
+def _sample_threads(samples, stop):
+    while not stop.is_set():
+        samples.append(threading.active_count())
+        time.sleep(0.005)
+
+
+def benchmark_threads(args):
+    # Threads du processus (client et serveur) pendant des uploads de tailles
+    # croissantes avec pertes simulées. Les retransmissions passent par une
+    # roue de timers, un seul thread par transfert : le maximum ne doit pas
+    # augmenter avec le nombre de segments envoyés ou en vol. Un timer par
+    # segment ajouterait au moins un thread par segment de la fenêtre.
+    results = []
+    with tempfile.TemporaryDirectory() as files_directory, tempfile.TemporaryDirectory() as local_directory:
+        with _local_client(files_directory, args.drop_probability) as client:
+            # Premier upload hors mesure : connexion et threads de l'executor
+            # du serveur déjà démarrés
+            sizes = [min(args.file_sizes)] + args.file_sizes
+            for index, file_size in enumerate(sizes):
+                file_path = os.path.join(local_directory, f"threads-{index}.bin")
+                with open(file_path, "wb") as file:
+                    file.write(os.urandom(file_size))
+                protocol = Client.FileTransmissionProtocol(
+                    client, args.window_size, args.segment_size, 1.0, False, "WIFI"
+                )
+                baseline = threading.active_count()
+                samples, stop = [], threading.Event()
+                sampler = threading.Thread(target=_sample_threads, args=(samples, stop))
+                sampler.start()
+                status = protocol.send_file(file_path)
+                stop.set()
+                sampler.join()
+                assert status == "SUCCESS", status
+                if index:
+                    results.append(
+                        (
+                            file_size,
+                            protocol.metrics.counter("segments_sent_total"),
+                            protocol.metrics.counter("segments_retransmitted_total"),
+                            max(samples) - baseline,
+                        )
+                    )
+
+    # Le thread d'échantillonnage est compté dans chaque mesure
+    print(f"{'file size':>10} {'segments':>9} {'retransmitted':>14} {'extra threads':>14}")
+    for file_size, segments, retransmitted, extra_threads in results:
+        print(f"{file_size:>10} {segments:>9} {retransmitted:>14} {extra_threads:>14}")
+    worst = max(extra_threads for _, _, _, extra_threads in results)
+    growth = results[-1][3] - results[0][3]
+    if worst > args.max_threads or growth > args.tolerance:
+        sys.exit(
+            f"Thread count grows with the number of segments: up to +{worst} threads "
+            f"during an upload, +{growth} from {results[0][1]} to {results[-1][1]} segments"
+        )
+
+
+async def _copy_send_file_range(self, header, file, offset, count):
+    # Envoi sans os.sendfile : le contenu est lu dans Python puis écrit
+    async with self.send_lock:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, os.pread, file.fileno(), count, offset)
+        await loop.sock_sendall(self.socket, header + data)
+
+
+def benchmark_download(args):
+    # Débit et temps CPU d'un download brut, avec os.sendfile ou en copiant
+    # le contenu dans Python. Serveur et client sont dans ce processus : le
+    # temps CPU compte les deux côtés.
+    results = []
+    with tempfile.TemporaryDirectory() as files_directory, tempfile.TemporaryDirectory() as local_directory:
+        with open(os.path.join(files_directory, "download.bin"), "wb") as file:
+            file.write(os.urandom(args.file_size))
+        sendfile_range = ClientConnection.send_file_range
+        with _local_client(files_directory) as client:
+            # Premier download hors mesure : le hash du fichier est ensuite en cache
+            warmup_path = os.path.join(local_directory, "warmup")
+            assert client.download_file("download.bin", warmup_path, "WIFI") == "SUCCESS"
+            os.remove(warmup_path)
+            for label, send_file_range in (
+                ("copy", _copy_send_file_range),
+                ("sendfile", sendfile_range),
+            ):
+                ClientConnection.send_file_range = send_file_range
+                local_path = os.path.join(local_directory, label)
+                start, cpu_start = time.perf_counter(), time.process_time()
+                for _ in range(args.runs):
+                    status = client.download_file("download.bin", local_path, "WIFI")
+                    assert status == "SUCCESS", status
+                    os.remove(local_path)
+                elapsed = time.perf_counter() - start
+                cpu = time.process_time() - cpu_start
+                results.append((label, elapsed, cpu))
+            ClientConnection.send_file_range = sendfile_range
+
+    print(f"{'send':>8} {'MB/s':>8} {'CPU s':>8}")
+    for label, elapsed, cpu in results:
+        print(f"{label:>8} {args.runs * args.file_size / elapsed / 1e6:>8.1f} {cpu:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks du protocole.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    frames_parser = subparsers.add_parser(
+        "frames", help="Débit de réception des trames selon leur nombre"
+    )
+    frames_parser.add_argument(
+        "--frame-counts",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 50000],
+        help="Nombres de trames envoyées en rafale",
+    )
+    frames_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    frames_parser.set_defaults(func=benchmark_frames)
+
+    sessions_parser = subparsers.add_parser(
+        "sessions", help="Test de charge : nombreuses sessions simultanées"
+    )
+    sessions_parser.add_argument(
+        "--sessions", type=int, default=2000, help="Nombre de sessions simultanées"
+    )
+    sessions_parser.add_argument(
+        "--file-size", type=int, default=16384, help="Taille du fichier par session"
+    )
+    sessions_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    sessions_parser.add_argument(
+        "--connect-delay",
+        type=float,
+        default=2.0,
+        help="Temps laissé à l'ouverture de toutes les connexions, en secondes",
+    )
+    sessions_parser.add_argument(
+        "--compressed",
+        action="store_true",
+        help="Envoyer des données compressées",
+    )
+    sessions_parser.set_defaults(func=benchmark_sessions)
+
+    workers_parser = subparsers.add_parser(
+        "workers", help="Débit agrégé selon le nombre de workers du serveur"
+    )
+    workers_parser.add_argument(
+        "--worker-counts",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Nombres de workers à comparer",
+    )
+    workers_parser.add_argument(
+        "--client-processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Nombre de processus générant la charge",
+    )
+    workers_parser.add_argument(
+        "--sessions", type=int, default=200, help="Nombre total de sessions"
+    )
+    workers_parser.add_argument(
+        "--file-size", type=int, default=1 << 20, help="Taille du fichier par session"
+    )
+    workers_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    workers_parser.add_argument(
+        "--connect-delay",
+        type=float,
+        default=1.0,
+        help="Temps laissé à l'ouverture de toutes les connexions, en secondes",
+    )
+    workers_parser.set_defaults(func=benchmark_workers, compressed=True)
+
+    delta_parser = subparsers.add_parser(
+        "delta", help="Octets envoyés pour de petites modifications d'un gros fichier"
+    )
+    delta_parser.add_argument(
+        "--file-size", type=int, default=32 << 20, help="Taille du fichier"
+    )
+    delta_parser.add_argument(
+        "--edit-counts",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Nombres de modifications à comparer",
+    )
+    delta_parser.add_argument(
+        "--edit-size", type=int, default=64, help="Taille de chaque modification"
+    )
+    delta_parser.add_argument(
+        "--window-size", type=int, default=64, help="Taille de la fenêtre d'envoi"
+    )
+    delta_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    delta_parser.add_argument(
+        "--compressed",
+        action="store_true",
+        help="Envoyer des données compressées",
+    )
+    delta_parser.add_argument(
+        "--seed", type=int, default=0, help="Graine des modifications aléatoires"
+    )
+    delta_parser.set_defaults(func=benchmark_delta)
+
+    compression_parser = subparsers.add_parser(
+        "compression", help="Taux et débit de compression par blocs"
+    )
+    compression_parser.add_argument("--file", required=True, help="Fichier à compresser")
+    compression_parser.add_argument(
+        "--codecs",
+        nargs="+",
+        default=["zlib:1", "zlib:6", "lzma:1", "bz2:9"],
+        help="Codecs à comparer, avec leur niveau (codec:niveau)",
+    )
+    compression_parser.add_argument(
+        "--worker-counts",
+        type=int,
+        nargs="+",
+        default=[1, os.cpu_count() or 1],
+        help="Nombres de processus à comparer",
+    )
+    compression_parser.set_defaults(func=benchmark_compression)
+
+    digests_parser = subparsers.add_parser(
+        "digests", help="Coût de l'empreinte des segments DATA"
+    )
+    digests_parser.add_argument(
+        "--digests",
+        nargs="+",
+        choices=SUPPORTED_DIGESTS,
+        default=SUPPORTED_DIGESTS,
+        help="Empreintes à comparer",
+    )
+    digests_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    digests_parser.add_argument(
+        "--rounds", type=int, default=50, help="Passes sur 1024 segments"
+    )
+    digests_parser.add_argument(
+        "--file-size", type=int, default=16 << 20, help="Taille du fichier envoyé"
+    )
+    digests_parser.add_argument(
+        "--window-size", type=int, default=64, help="Taille de la fenêtre d'envoi"
+    )
+    digests_parser.set_defaults(func=benchmark_digests)
+
+    stripes_parser = subparsers.add_parser(
+        "stripes", help="Débit d'un upload découpé en plages parallèles"
+    )
+    stripes_parser.add_argument(
+        "--stripe-counts",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="Nombres de plages à comparer",
+    )
+    stripes_parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.02,
+        help="Latence ajoutée dans chaque sens, en secondes",
+    )
+    stripes_parser.add_argument(
+        "--file-size", type=int, default=8 << 20, help="Taille du fichier envoyé"
+    )
+    stripes_parser.add_argument(
+        "--window-size", type=int, default=32, help="Taille de la fenêtre d'envoi"
+    )
+    stripes_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    stripes_parser.set_defaults(func=benchmark_stripes)
+
+    execute_parser = subparsers.add_parser(
+        "execute", help="Latence des exécutions, avec et sans cache"
+    )
+    execute_parser.add_argument(
+        "--duration", type=float, default=0.2, help="Durée d'une exécution, en secondes"
+    )
+    execute_parser.add_argument(
+        "--runs", type=int, default=10, help="Exécutions successives du même fichier"
+    )
+    execute_parser.add_argument(
+        "--jobs", type=int, default=8, help="Exécutions différentes lancées en même temps"
+    )
+    execute_parser.add_argument(
+        "--workers", type=int, default=4, help="Exécutions simultanées du serveur"
+    )
+    execute_parser.set_defaults(func=benchmark_execute)
+
+    threads_parser = subparsers.add_parser(
+        "threads", help="Threads pendant des uploads avec pertes simulées"
+    )
+    threads_parser.add_argument(
+        "--file-sizes",
+        type=int,
+        nargs="+",
+        default=[1 << 20, 8 << 20],
+        help="Tailles des fichiers envoyés, par ordre croissant",
+    )
+    threads_parser.add_argument(
+        "--drop-probability",
+        type=float,
+        default=0.01,
+        help="Probabilité de perte d'un segment par le serveur",
+    )
+    threads_parser.add_argument(
+        "--window-size", type=int, default=64, help="Taille de la fenêtre d'envoi"
+    )
+    threads_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=2048,
+        help="Taille des segments de données",
+    )
+    threads_parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=8,
+        help="Threads supplémentaires admis pendant un upload",
+    )
+    threads_parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=2,
+        help="Threads supplémentaires admis entre le plus petit et le plus gros upload",
+    )
+    threads_parser.set_defaults(func=benchmark_threads)
+
+    download_parser = subparsers.add_parser(
+        "download", help="Download brut avec et sans os.sendfile"
+    )
+    download_parser.add_argument(
+        "--file-size", type=int, default=64 << 20, help="Taille du fichier téléchargé"
+    )
+    download_parser.add_argument(
+        "--runs", type=int, default=5, help="Downloads successifs par mode"
+    )
+    download_parser.set_defaults(func=benchmark_download)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import secrets
+
+from partials import valid_file_hash
+
+HASH_CHUNK_SIZE = 1024 * 1024
+FILE_HASH_CACHE_SIZE = 1024
+
+
+class BlobStore:
+    # Contenus reçus indexés par leur hash SHA-256 : <hash[:2]>/<hash>. Les
+    # fichiers du répertoire de destination sont des liens physiques vers ces
+    # blobs, un contenu déjà présent n'est donc ni renvoyé ni réécrit. Un blob
+    # dont le seul lien restant est le sien n'est plus référencé par aucun
+    # fichier et est supprimé par collect.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def blob_path(self, file_hash):
+        return os.path.join(self.directory, file_hash[:2], file_hash)
+
+    def has(self, file_hash):
+        return valid_file_hash(file_hash) and os.path.isfile(self.blob_path(file_hash))
+
+    def link(self, file_hash, file_path):
+        # Fait de file_path une référence vers le blob ; False si le blob
+        # n'existe pas (ou plus) ou si le lien est impossible
+        directory = os.path.dirname(file_path)
+        blob_path = self.blob_path(file_hash)
+        try:
+            if os.path.exists(file_path) and os.path.samefile(blob_path, file_path):
+                return True  # Déjà une référence : rename ne ferait rien
+            os.makedirs(directory, exist_ok=True)
+            # Lien créé à côté sous un nom aléatoire puis renommé : le fichier
+            # remplacé reste lisible jusqu'au dernier moment. os.link échoue
+            # si le nom existe déjà, on en tire alors un autre.
+            while True:
+                temp_path = os.path.join(
+                    directory,
+                    f".{os.path.basename(file_path)}.{secrets.token_hex(8)}.link",
+                )
+                try:
+                    os.link(blob_path, temp_path)
+                    break
+                except FileExistsError:
+                    continue
+        except OSError:
+            return False
+        try:
+            os.replace(temp_path, file_path)
+        except OSError:
+            os.remove(temp_path)
+            return False
+        return True
+
+    def add(self, file_hash, file_path):
+        # Enregistre un fichier dont le hash vient d'être vérifié. Si le blob
+        # existe déjà, le fichier devient une référence vers lui et son inode
+        # est libéré.
+        if not valid_file_hash(file_hash):
+            return False
+        if self.link(file_hash, file_path):
+            return True
+        blob_path = self.blob_path(file_hash)
+        try:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.link(file_path, blob_path)
+        except FileExistsError:
+            # Ajouté entre-temps par un autre upload ou un autre worker
+            return self.link(file_hash, file_path)
+        except OSError:
+            return False  # Liens physiques non supportés : pas de déduplication
+        return True
+
+    def collect(self):
+        # Supprime les blobs qui ne sont plus référencés par aucun fichier
+        removed = 0
+        for prefix in os.listdir(self.directory):
+            prefix_path = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for entry in os.listdir(prefix_path):
+                blob_path = os.path.join(prefix_path, entry)
+                try:
+                    if os.stat(blob_path).st_nlink == 1:
+                        os.remove(blob_path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class FileHashCache:
+    # Hash SHA-256 des fichiers déjà lus, selon leur inode, leur taille et
+    # leur date : un fichier remplacé par un upload change d'inode et sera
+    # relu. Le fichier est lu avec pread, sans toucher à sa position.
+    def __init__(self, size=FILE_HASH_CACHE_SIZE):
+        self._size = size
+        self._hashes = {}
+
+    def file_hash(self, file):
+        stat = os.fstat(file.fileno())
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key not in self._hashes:
+            file_hash = hashlib.sha256()
+            offset = 0
+            while True:
+                chunk = os.pread(file.fileno(), HASH_CHUNK_SIZE, offset)
+                if not chunk:
+                    break
+                file_hash.update(chunk)
+                offset += len(chunk)
+            if len(self._hashes) >= self._size:
+                self._hashes.pop(next(iter(self._hashes)))
+            self._hashes[key] = file_hash.hexdigest()
+        return self._hashes[key]
@@ -1,14 +1,355 @@
 import socket
+import base64
+import codecs
 import os
 import hashlib
+import queue
+import random
+import shlex
+import sys
 import threading
 import time
-from message import Message
+from message import (
+    ARQ_GO_BACK_N,
+    ARQ_MODES,
+    ARQ_SELECTIVE_REPEAT,
+    MAX_PAYLOAD_SIZE,
+    FrameReader,
+    Message,
+    WIRE_FORMATS,
+    WIRE_FORMAT_JSON,
+    send_buffers,
+)
 import argparse
-import zlib
+import concurrent.futures
+import multiprocessing
+import tarfile
+import tempfile
+from compression import (
+    CODEC_NONE,
+    CODEC_ZLIB,
+    CODECS,
+    BlockDecoder,
+    compress_blocks,
+    file_looks_incompressible,
+    zlib_stream,
+)
+from congestion import CLOCK_GRANULARITY, CongestionWindow, RttEstimator
+from delta import DELTA_COPY, compute_delta, delta_stream
+from digests import (
+    DIGEST_CRC32,
+    DIGEST_SHA256,
+    DIGESTS,
+    SUPPORTED_DIGESTS,
+    segment_digest,
+)
+from metrics import Metrics, summarize
+from multipath import MULTIPATH_MODES, Path, choose_path
+from scheduler import RetransmissionScheduler
+from stripes import MAX_STRIPES, STRIPE_MIN_SIZE
+
+# Taille des blocs lus sur le disque par le pipeline d'envoi
+READ_CHUNK_SIZE = 64 * 1024
+# Reconnexion après une coupure : délai doublé à chaque tentative
+RECONNECT_ATTEMPTS = 8
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+# Attente de la réponse au HELLO ; au-delà, le serveur est une ancienne version
+HELLO_TIMEOUT = 2.0
+# Nombre maximal de canaux d'une connexion (identifiant sur 16 bits)
+MAX_CHANNELS = 0xFFFF
+# Mode batch : les fichiers plus petits que le seuil sont regroupés dans des
+# archives tar d'au plus BATCH_PACK_SIZE octets
+BATCH_PACK_THRESHOLD = 64 * 1024
+BATCH_PACK_SIZE = 4 * 1024 * 1024
+# Attente de la réponse à un DOWNLOAD ; au-delà, le serveur ne le connaît pas
+DOWNLOAD_ACK_TIMEOUT = 10.0
+# Trames d'un download reçues et pas encore écrites : quand la file est
+# pleine, la lecture du socket s'arrête et le serveur ralentit
+DOWNLOAD_QUEUE_SIZE = 16
+# Attente de la réponse à un STATS
+STATS_TIMEOUT = 5.0
+# Attente des signatures d'un upload delta, que le serveur calcule en lisant
+# toute sa version du fichier ; au-delà, le fichier est envoyé en entier
+SIGNATURES_TIMEOUT = 60.0
+ARCHIVE_TAR = "tar"
+
+
+def _batch_entries(source):
+    # (chemin local, chemin relatif sur le serveur) des fichiers d'un
+    # répertoire, ou d'un manifeste listant un chemin par ligne (relatif au
+    # manifeste ; lignes vides et commentaires # ignorés)
+    if os.path.isdir(source):
+        entries = []
+        for directory, subdirectories, file_names in os.walk(source):
+            subdirectories.sort()
+            for file_name in sorted(file_names):
+                local_path = os.path.join(directory, file_name)
+                remote_name = os.path.relpath(local_path, source)
+                entries.append((local_path, remote_name.replace(os.sep, "/")))
+        return entries
+
+    base_directory = os.path.dirname(os.path.abspath(source))
+    entries = []
+    with open(source) as manifest:
+        for line in manifest:
+            path = line.strip()
+            if not path or path.startswith("#"):
+                continue
+            if os.path.isabs(path):
+                entries.append((path, os.path.basename(path)))
+            else:
+                remote_name = os.path.normpath(path).replace(os.sep, "/")
+                entries.append((os.path.join(base_directory, path), remote_name))
+    return entries
+
+
+def _pack_small_files(entries, pack_threshold, pack_size, pack_directory):
+    # Regroupe les petits fichiers dans des archives tar : un seul upload, et
+    # donc un seul aller-retour, pour des dizaines de fichiers.
+    # Retourne les uploads (chemin local, chemin sur le serveur, archive).
+    items = []
+    packs = [[]]
+    pack_bytes = 0
+    for local_path, remote_name in entries:
+        size = os.path.getsize(local_path)
+        if size >= pack_threshold:
+            items.append((local_path, remote_name, None))
+            continue
+        if packs[-1] and pack_bytes + size > pack_size:
+            packs.append([])
+            pack_bytes = 0
+        packs[-1].append((local_path, remote_name))
+        pack_bytes += size
+
+    for pack in packs:
+        if len(pack) == 1:
+            # Une archive d'un seul fichier n'économise rien
+            items.append((*pack[0], None))
+        elif pack:
+            archive_path = os.path.join(pack_directory, f"pack-{len(items)}.tar")
+            with tarfile.open(archive_path, "w") as archive:
+                for local_path, remote_name in pack:
+                    archive.add(local_path, arcname=remote_name)
+            # Nom unique : plusieurs clients peuvent envoyer des archives en même temps
+            items.append((archive_path, f".pack-{os.urandom(8).hex()}.tar", ARCHIVE_TAR))
+    return items
 
 
 class Client:
+    class Connection:
+        # Connexion persistante vers le serveur, réutilisée par les commandes
+        # successives. Chaque commande ouvre un canal : un thread lit les trames
+        # et les transmet au gestionnaire du canal indiqué, qui reçoit None si
+        # la connexion est perdue. Des PING gardent la connexion ouverte et
+        # détectent un serveur devenu muet.
+        def __init__(self, client, connection_mode, keepalive):
+            self.client = client
+            self._connection_mode = connection_mode  # BLUETOOTH or WIFI
+            self._keepalive = keepalive
+            self._socket = None
+            self.generation = 0  # incrémenté à chaque connexion
+            self.wire_format = WIRE_FORMAT_JSON
+            self._multiplexed = False
+            self._hello_acknowledged = threading.Event()
+            self._last_received = 0.0
+            self._send_lock = threading.Lock()  # les trames ne s'entrelacent pas
+            self._channels_lock = threading.Lock()
+            self._reconnect_lock = threading.Lock()
+            # Ancien serveur sans canaux : une seule commande à la fois
+            self._legacy_lock = threading.Lock()
+            self._channels = {}  # canal -> gestionnaire
+            self._next_channel = 1
+
+        @property
+        def connected(self):
+            return self._socket is not None
+
+        def _open(self):
+            # Une seule tentative ; False si le serveur est injoignable
+            if self._connection_mode == "BLUETOOTH":
+                sock = socket.socket(
+                    socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM
+                )
+                address = (self.client.mac_address, 1)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                address = (self.client.server_address, self.client.server_port)
+            try:
+                sock.connect(address)
+            except socket.error:
+                sock.close()
+                return False
+
+            self._socket = sock
+            self.generation += 1
+            self._last_received = time.monotonic()
+            self._hello_acknowledged.clear()
+            threading.Thread(
+                target=self._read_loop, args=(sock, self.generation), daemon=True
+            ).start()
+            try:
+                Message("HELLO", content={"wire_formats": WIRE_FORMATS}).send(sock)
+            except socket.error:
+                self.close()
+                return False
+            # Sans réponse, chaque commande négocie seule, sur le canal 0
+            self._multiplexed = self._hello_acknowledged.wait(HELLO_TIMEOUT)
+            if not self._multiplexed:
+                print(
+                    "[Connection] No HELLO_ACK received, one command at a time on this connection."
+                )
+            elif self._keepalive:
+                threading.Thread(
+                    target=self._keepalive_loop, args=(sock, self.generation), daemon=True
+                ).start()
+            return True
+
+        def connect(self, attempts=5):
+            # Plusieurs commandes lancées en même temps partagent la connexion
+            with self._reconnect_lock:
+                return self._connect(attempts)
+
+        def _connect(self, attempts):
+            if self.connected:
+                return True
+            try:
+                for attempt in range(attempts):
+                    if self._open():
+                        print("[Connection] Connecté avec succès au serveur.")
+                        return True
+                    print(
+                        f"[Connection] Échec de la connexion au serveur, tentative {attempt + 1}/{attempts}"
+                    )
+                    if attempt < attempts - 1:
+                        time.sleep(2)
+                print("[Connection] Impossible de se connecter au serveur.")
+                return False
+            except Exception as e:
+                print(f"Error connecting to server: {e}")
+                return False
+
+        def reconnect(self, generation):
+            # Connexion perdue en cours de commande : nouvelles tentatives
+            # espacées exponentiellement, avec une part aléatoire pour que des
+            # clients coupés en même temps ne reviennent pas ensemble. Plusieurs
+            # canaux peuvent le demander : un seul reconnecte.
+            with self._reconnect_lock:
+                if self.connected and self.generation != generation:
+                    return True
+                self.close()
+                delay = RECONNECT_INITIAL_DELAY
+                for attempt in range(RECONNECT_ATTEMPTS):
+                    wait = delay * random.uniform(0.5, 1.0)
+                    print(
+                        f"[Connection] Connexion perdue, reconnexion dans {wait:.1f}s "
+                        f"(tentative {attempt + 1}/{RECONNECT_ATTEMPTS})"
+                    )
+                    time.sleep(wait)
+                    try:
+                        if self._open():
+                            print("[Connection] Reconnecté au serveur.")
+                            return True
+                    except Exception as e:
+                        print(f"Error reconnecting to server: {e}")
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                return False
+
+        def close(self):
+            sock, self._socket = self._socket, None
+            if sock is None:
+                return
+            try:
+                # Réveille le thread de lecture bloqué dans recv
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+        def open_channel(self, handler):
+            if not self._multiplexed:
+                self._legacy_lock.acquire()
+                channel = 0
+            else:
+                with self._channels_lock:
+                    if len(self._channels) >= MAX_CHANNELS:
+                        raise RuntimeError("Too many commands in progress")
+                    while self._next_channel in self._channels:
+                        self._next_channel = self._next_channel % MAX_CHANNELS + 1
+                    channel = self._next_channel
+                    self._next_channel = self._next_channel % MAX_CHANNELS + 1
+            with self._channels_lock:
+                self._channels[channel] = handler
+            return channel
+
+        def close_channel(self, channel):
+            with self._channels_lock:
+                self._channels.pop(channel, None)
+            if channel == 0:
+                self._legacy_lock.release()
+
+        def send(self, message, wire_format=WIRE_FORMAT_JSON):
+            sock = self._socket
+            if sock is None:
+                raise ConnectionError("Not connected")
+            data = message.serialize(wire_format)
+            with self._send_lock:
+                sock.sendall(data)
+
+        def send_buffers(self, buffers):
+            sock = self._socket
+            if sock is None:
+                raise ConnectionError("Not connected")
+            with self._send_lock:
+                return send_buffers(sock, buffers)
+
+        def _read_loop(self, sock, generation):
+            try:
+                for frame in FrameReader(sock):
+                    message = Message.deserialize(frame)
+                    self._last_received = time.monotonic()
+                    if message.type == "HELLO_ACK":
+                        self.wire_format = message.content["wire_format"]
+                        self._hello_acknowledged.set()
+                    elif message.type == "PONG":
+                        pass
+                    else:
+                        with self._channels_lock:
+                            handler = self._channels.get(message.channel)
+                        if handler is not None:
+                            handler(message)
+            except Exception as e:
+                print(f"[Connection] Error listening for messages: {e}")
+            if generation != self.generation:
+                return  # Ancienne connexion, déjà remplacée
+            self.close()
+            # Les commandes en cours décident de se reconnecter ou d'échouer
+            with self._channels_lock:
+                handlers = list(self._channels.values())
+            for handler in handlers:
+                handler(None)
+
+        def _keepalive_loop(self, sock, generation):
+            # Un serveur muet depuis trois intervalles est considéré comme perdu
+            sequence_num = 0
+            while generation == self.generation and self._socket is sock:
+                time.sleep(self._keepalive)
+                if generation != self.generation or self._socket is not sock:
+                    return
+                if time.monotonic() - self._last_received > 3 * self._keepalive:
+                    print("[Connection] Server stopped answering, closing the connection.")
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    return
+                sequence_num += 1
+                try:
+                    self.send(Message("PING", sequence_num), self.wire_format)
+                except OSError:
+                    return
+
     class FileTransmissionProtocol:
         def __init__(
             self,
@@ -18,176 +359,625 @@ class Client:
             timeout,
             compression,
             connection_mode,
+            arq_mode=ARQ_GO_BACK_N,
+            connection_index=0,
+            compression_level=None,
+            digest=DIGEST_CRC32,
         ):
             self.client = client
+            # Fenêtre demandée ; celle de l'envoi en cours est au plus celle
+            # que le serveur accorde dans l'UPLOAD_ACK
+            self._requested_window_size = window_size
             self._window_size = window_size
-            self._segment_size = segment_size
+            # Un segment plus grand dépasserait la taille maximale d'une trame
+            self._segment_size = min(segment_size, MAX_PAYLOAD_SIZE)
             self._timeout = timeout
-            self._compression = compression
+            # Codec demandé ; les booléens des anciens appelants valent zlib ou rien
+            if isinstance(compression, bool):
+                compression = CODEC_ZLIB if compression else CODEC_NONE
+            self._compression = compression or CODEC_NONE
+            self._compression_level = compression_level
+            self._offered_codec = self._compression
+            self._codec = None  # codec retenu par le serveur, None s'il ne connaît pas les codecs
+            # Empreinte des segments demandée, et celle retenue par le serveur
+            self._offered_digest = digest
+            self._digest = DIGEST_SHA256
 
-            self._socket = None
+            # MULTIPATH : le Wi-Fi et le Bluetooth portent ensemble le même
+            # upload, identifié par un numéro de transfert
+            modes = MULTIPATH_MODES if connection_mode == "MULTIPATH" else [connection_mode]
+            self._connections = {
+                mode: client.connection(mode, connection_index) for mode in modes
+            }
+            self._connection = self._connections[modes[0]]  # porte l'UPLOAD
+            self._channel = 0
+            self._generation = 0  # connexion utilisée par l'envoi en cours
+            self._paths = []  # chemins de l'envoi en cours, le premier est self._connection
+            self._segment_paths = {}  # numéro de séquence -> chemin qui le porte
+            self._transfer_id = None
+            # Identifiant de l'envoi, renvoyé à chaque reconnexion : le serveur
+            # y reconnaît la reprise de cet envoi et non un autre client
+            self._upload_id = None
+            self._multipath = False  # le serveur accepte d'autres chemins
+            if len(modes) > 1:
+                # Les segments des deux chemins arrivent dans le désordre
+                arq_mode = ARQ_SELECTIVE_REPEAT
             self._current_base = None
-            self._segments_to_send = None
+            self._next_sequence_num = 0
+            # Segments envoyés mais pas encore acquittés, gardés avec leur
+            # empreinte pour la retransmission
+            self._segments_in_flight = {}
+            self._acknowledged = set()  # ACK individuels reçus en Selective Repeat
+            # Instants du premier envoi, retirés à la retransmission (règle de Karn)
+            self._send_times = {}
+            # --timeout et --window-size donnent le RTO initial et la fenêtre maximale
+            self._rtt = RttEstimator(timeout)
+            self._last_backoff = 0.0
+            self._requested_arq_mode = arq_mode
+            self._arq_mode = arq_mode
+            self._cumulative_acks = False
+            self._file_hash = None
+            self._resume_offset = 0  # octets déjà reçus par le serveur
+            # Upload delta : le serveur a une version du fichier et envoie les
+            # signatures de ses blocs après l'UPLOAD_ACK
+            self._delta = False
+            self._signatures = None
+            self._offer_delta = True  # faux après des signatures jamais reçues
+            # Plage envoyée, pour un upload découpé sur plusieurs connexions
+            self._stripe = None
+            self.stripe_refused = False  # serveur qui ne connaît pas les plages
+            self.file_complete = False  # EOF_ACK de la dernière plage reçue
             self._retransmission_in_progress = False
+            self._scheduler = None
             self._transmission_lock = threading.Lock()
+            # Réveille l'émetteur quand la fenêtre s'ouvre ou que le transfert se termine
+            self._transmission_event = threading.Condition(self._transmission_lock)
             self._transmission_status = "NOT_STARTED"
-            self._connection_mode = connection_mode  # BLUETOOTH or WIFI
+            self._wire_format = WIRE_FORMAT_JSON
+            self._upload_acknowledged = threading.Event()
 
-        def _connect(self):
-            try:
-                if self._connection_mode == "BLUETOOTH":
-                    self._socket = socket.socket(
-                        socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM
-                    )
-                else:
-                    self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                for attempt in range(5):
-                    try:
-                        if self._connection_mode == "BLUETOOTH":
-                            self._socket.connect((self.client.mac_address, 1))
-                        else:
-                            self._socket.connect(
-                                (self.client.server_address, self.client.server_port)
-                            )
-                        print(
-                            "[FileTransmissionProtocol] Connecté avec succès au serveur pour l'exécution de commandes."
-                        )
-                        return True
-                    except socket.error as e:
-                        print(
-                            f"[FileTransmissionProtocol] Échec de la connexion au serveur, tentative {attempt + 1}/5"
-                        )
-                        if attempt < 4:
-                            time.sleep(2)
-                        else:
-                            print(
-                                "[FileTransmissionProtocol] Impossible de se connecter au serveur pour l'exécution de commandes."
-                            )
-                            return False
-            except Exception as e:
-                print(f"Error connecting to server: {e}")
-                return False
+            # Compteurs et histogrammes du transfert, résumés à la fin
+            self.metrics = Metrics()
 
-        def _disconnect(self):
-            if self._socket:
-                self._socket.close()
+        def send_file(
+            self, file_path, remote_name=None, unpack=None, stripe=None, file_hash=None
+        ):
+            # remote_name : chemin relatif du fichier sur le serveur (nom du
+            # fichier par défaut) ; unpack : format d'archive que le serveur
+            # extrait après la réception ; stripe : plage du fichier à envoyer
+            # (identifiant, numéro, nombre, offset, longueur), file_hash étant
+            # alors calculé une fois pour toutes les plages. Retourne le
+            # statut final.
+            self._remote_name = remote_name or os.path.basename(file_path)
+            self._unpack = unpack
+            self._stripe = stripe
+            if not self._connect():
+                return "FAILED"
+            start = time.monotonic()
+            # Le hash identifie l'upload côté serveur : il est calculé avant
+            # l'envoi pour pouvoir reprendre un transfert interrompu
+            if file_hash is None:
+                file_hash = self._hash_file(file_path)
+                self.metrics.observe("hash_seconds", time.monotonic() - start)
+            self._file_hash = file_hash
+            self._upload_id = os.urandom(16).hex()
+            self._offer_delta = True
+            self._offered_codec = self._compression
+            if self._compression != CODEC_NONE and file_looks_incompressible(file_path):
                 print(
-                    "[FileTransmissionProtocol] Déconnecté du serveur de transfert de fichier."
+                    f"[FileTransmissionProtocol] {file_path} looks incompressible, sending it uncompressed"
                 )
+                self._offered_codec = CODEC_NONE
+            self._upload(file_path)
+            while self._transmission_status == "DISCONNECTED":
+                if not self._reconnect():
+                    self._transmission_status = "FAILED"
+                    break
+                self._upload(file_path)
+
+            print(f"Transmission status: {self._transmission_status}")
+            elapsed = time.monotonic() - start
+            bytes_sent = self.metrics.counter("bytes_sent_total")
+            windows_sent = self.metrics.counter("windows_sent_total")
+            if windows_sent:
+                print(
+                    f"[FileTransmissionProtocol] Sent {bytes_sent} bytes in {windows_sent} windows "
+                    f"({self.metrics.counter('send_syscalls_total')} syscalls, {bytes_sent / windows_sent:.0f} bytes/window)"
+                )
+            print(f"[FileTransmissionProtocol] RTT estimator: {self._rtt.summary()}")
+            if len(self._paths) > 1:
+                for path in self._paths:
+                    print(f"[Multipath] {path.summary()}")
+            elif self._paths:
+                print(
+                    f"[FileTransmissionProtocol] Congestion window: {self._paths[0].congestion.summary()}"
+                )
+            print(
+                f"[FileTransmissionProtocol] {self._arq_mode}: retransmitted {self.metrics.counter('segments_retransmitted_total')} segments "
+                f"({self.metrics.counter('bytes_retransmitted_total')} bytes)"
+            )
+            self._print_summary(file_path, elapsed)
+            return self._transmission_status
+
+        def _print_summary(self, file_path, elapsed):
+            # Résumé de fin de transfert : débit utile, octets envoyés et
+            # acquittés, pertes et distribution du RTT
+            file_size = (
+                self._stripe["length"]
+                if self._stripe is not None
+                else os.path.getsize(file_path)
+            )
+            metrics = self.metrics
+            summary = (
+                f"{file_size} bytes in {elapsed:.2f}s ({file_size / max(elapsed, 1e-9) / 1e6:.2f} MB/s), "
+                f"{metrics.counter('bytes_sent_total')} bytes on the wire, "
+                f"{metrics.counter('bytes_acked_total')} payload bytes acked, "
+                f"{metrics.counter('segments_sent_total')} segments, "
+                f"{metrics.counter('segments_retransmitted_total')} retransmitted, "
+                f"{metrics.counter('timeouts_total')} timeouts"
+            )
+            rtt = metrics.histogram("rtt_seconds")
+            if rtt is not None:
+                summary += (
+                    f", RTT p50 {rtt.quantile(0.5) * 1000:.1f} ms, "
+                    f"p99 {rtt.quantile(0.99) * 1000:.1f} ms, max {rtt.max * 1000:.1f} ms"
+                )
+            print(f"[FileTransmissionProtocol] Summary: {summary}")
+
+        def _connect(self):
+            # En multipath, un seul chemin joignable suffit pour commencer ;
+            # sinon la connexion principale est attendue comme d'habitude
+            if len(self._connections) > 1 and any(
+                [connection.connect(attempts=1) for connection in self._connections.values()]
+            ):
+                return True
+            return self._connection.connect()
 
         def _reconnect(self):
-            while True:
+            if len(self._connections) > 1 and any(
+                [connection.connect(attempts=1) for connection in self._connections.values()]
+            ):
+                return True
+            return self._connection.reconnect(self._generation)
+
+        def _open_path(self, mode, connection):
+            # Chaque chemin a sa fenêtre de congestion : après une reconnexion,
+            # elle repart du démarrage lent, le RTT estimé reste valable
+            path = Path(connection, mode, self._rtt.rto, CongestionWindow(self._window_size))
+            path.rtt.ack_delay = self._rtt.ack_delay
+            path.channel = connection.open_channel(
+                lambda message: self._on_message(message, path)
+            )
+            return path
+
+        def _join_paths(self):
+            # Les autres chemins joignables rejoignent l'upload accepté sur le
+            # premier ; un chemin refusé ou muet est simplement laissé de côté
+            for mode, connection in self._connections.items():
+                if connection is self._connection or not connection.connected:
+                    continue
+                path = self._open_path(mode, connection)
                 try:
-                    if self._connection_mode == "BLUETOOTH":
-                        self._socket = socket.socket(
-                            socket.AF_BLUETOOTH,
-                            socket.SOCK_STREAM,
-                            socket.BTPROTO_RFCOMM,
+                    connection.send(
+                        Message(
+                            "JOIN",
+                            content={"transfer_id": self._transfer_id},
+                            channel=path.channel,
                         )
-                    else:
-                        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    return
-                except Exception as e:
-                    print(f"Error reconnecting to server: {e}")
-                    continue
+                    )
+                except socket.error:
+                    path.alive = False
+                if path.alive and path.joined.wait(self._timeout) and path.alive:
+                    with self._transmission_lock:
+                        self._paths.append(path)
+                    print(f"[Multipath] {mode} path joined the upload")
+                else:
+                    print(f"[Multipath] {mode} path could not join the upload")
+                    connection.close_channel(path.channel)
 
-        def send_file(self, file_path):
-            if not self._connect():
-                return
+        def _upload(self, file_path):
+            # Un envoi sur un canal de la connexion courante, repris à l'offset
+            # indiqué par le serveur. Le statut final est DISCONNECTED si la
+            # connexion a été perdue avant la fin.
             self._transmission_status = "IN_PROGRESS"
-            thread = threading.Thread(target=self._listen_server, daemon=True)
-            thread.start()
+            self._current_base = 0
+            self._next_sequence_num = 0
+            self._segments_in_flight.clear()
+            self._acknowledged.clear()
+            self._send_times.clear()
+            self._arq_mode = self._requested_arq_mode
+            self._window_size = self._requested_window_size
+            self._wire_format = WIRE_FORMAT_JSON
+            self._cumulative_acks = False
+            self._resume_offset = 0
+            self._delta = False
+            self._signatures = None
+            self._codec = None
+            self._digest = DIGEST_SHA256
+            self._upload_acknowledged.clear()
+            self._scheduler = RetransmissionScheduler(self._check_timeout)
+            # L'UPLOAD part sur le premier chemin connecté
+            mode, self._connection = next(
+                (
+                    (mode, connection)
+                    for mode, connection in self._connections.items()
+                    if connection.connected
+                ),
+                next(iter(self._connections.items())),
+            )
+            self._generation = self._connection.generation
+            path = self._open_path(mode, self._connection)
+            self._channel = path.channel
+            self._paths = [path]
+            self._segment_paths.clear()
+            self._transfer_id = os.urandom(16).hex() if len(self._connections) > 1 else None
+            self._multipath = False
+            if not self._connection.connected:
+                self._transmission_status = "DISCONNECTED"
 
-            with open(file_path, "rb") as file:
-                if self._compression:
-                    segments = zlib.compress(file.read())
-                else:
-                    segments = file.read()
+            self._send_upload(file_path)
 
-            self._segments_to_send = [
-                segments[i : i + self._segment_size]
-                for i in range(0, len(segments), self._segment_size)
-            ]
+            # Un ancien serveur ne répond pas à l'UPLOAD : on reste alors en JSON
+            # et en Go-Back-N
+            if (
+                not self._upload_acknowledged.wait(self._timeout)
+                and self._transmission_status == "IN_PROGRESS"
+            ):
+                if self._stripe is not None:
+                    # Un ancien serveur prendrait la plage pour le fichier entier
+                    self.stripe_refused = True
+                    self._set_status("FAILED")
+                print(
+                    "[FileTransmissionProtocol] No UPLOAD_ACK received, falling back to JSON frames."
+                )
+                self._arq_mode = ARQ_GO_BACK_N
+            if self._multipath and self._transmission_status == "IN_PROGRESS":
+                self._join_paths()
+            if self._resume_offset:
+                print(
+                    f"[FileTransmissionProtocol] Resuming upload at byte {self._resume_offset}"
+                )
 
-            self._send_upload(file_path)
+            if self._stripe is not None:
+                # Une plage interrompue repart de son début
+                chunks = self._file_chunks(
+                    file_path, self._stripe["offset"], self._stripe["length"]
+                )
+            else:
+                chunks = self._file_chunks(file_path, self._resume_offset)
+            if self._delta:
+                with self._transmission_lock:
+                    self._transmission_event.wait_for(
+                        lambda: self._signatures is not None
+                        or not self._delta
+                        or self._transmission_status != "IN_PROGRESS",
+                        SIGNATURES_TIMEOUT,
+                    )
+                if (
+                    self._delta
+                    and self._signatures is None
+                    and self._transmission_status == "IN_PROGRESS"
+                ):
+                    # Le serveur répond mais n'envoie pas les signatures :
+                    # l'upload recommence sur un nouveau canal, sans delta, et
+                    # le serveur y reconnaît le même envoi
+                    print(
+                        "[FileTransmissionProtocol] No block signatures received, sending the whole file."
+                    )
+                    self._scheduler.stop()
+                    for path in self._paths:
+                        path.connection.close_channel(path.channel)
+                    self._offer_delta = False
+                    return self._upload(file_path)
+                if self._signatures is not None:
+                    chunks = self._delta_chunks(file_path, *self._signatures)
+            segments = self._read_segments(chunks)
+            segment = (
+                next(segments, None)
+                if self._transmission_status == "IN_PROGRESS"
+                else None
+            )
+            while segment is not None:
+                with self._transmission_lock:
+                    self._transmission_event.wait_for(
+                        lambda: self._free_slots() > 0
+                        or self._transmission_status != "IN_PROGRESS"
+                    )
+                    if self._transmission_status != "IN_PROGRESS":
+                        break
+                    free_slots = self._free_slots()
+
+                # Les segments et leur empreinte sont produits hors du verrou,
+                # au rythme de la fenêtre ; une retransmission réutilise l'empreinte
+                window = []
+                while segment is not None and len(window) < free_slots:
+                    sequence_num = self._next_sequence_num + len(window)
+                    self._segments_in_flight[sequence_num] = (
+                        segment,
+                        segment_digest(self._digest, segment),
+                    )
+                    window.append(sequence_num)
+                    segment = next(segments, None)
 
-            self._current_base = 0
-            seq_num = 0
-            while seq_num < len(self._segments_to_send):
                 with self._transmission_lock:
-                    if (
-                        not self._retransmission_in_progress
-                        and seq_num <= self._current_base + self._window_size - 1
-                    ):
-                        self._send_data(self._segments_to_send[seq_num], seq_num)
-                        seq_num += 1
+                    self._next_sequence_num += len(window)
+                    self._send_window(window)
 
             # Attendre que tous les ACKs soient reçus avant de conclure
-            while self._current_base < len(self._segments_to_send):
-                time.sleep(0.1)
+            with self._transmission_lock:
+                self._transmission_event.wait_for(
+                    lambda: self._current_base >= self._next_sequence_num
+                    or self._transmission_status != "IN_PROGRESS"
+                )
 
-            self._send_eof()
+            if self._transmission_status == "IN_PROGRESS":
+                self._send_eof()
 
             # Attendre que le serveur réponde avec un EOF_ACK ou EOF_NACK
-            while self._transmission_status == "IN_PROGRESS":
-                time.sleep(0.1)
+            with self._transmission_lock:
+                self._transmission_event.wait_for(
+                    lambda: self._transmission_status != "IN_PROGRESS"
+                )
 
-            self._segments_to_send = None
-            print(f"Transmission status: {self._transmission_status}")
-            self._disconnect()
+            self._scheduler.stop()
+            for path in self._paths:
+                path.connection.close_channel(path.channel)
+
+        def _free_slots(self):
+            paths = [path for path in self._paths if path.alive]
+            if self._retransmission_in_progress or not paths:
+                return 0
+            if len(paths) == 1:
+                return (
+                    self._current_base + paths[0].congestion.size - self._next_sequence_num
+                )
+            # Multipath : chaque chemin reste dans sa fenêtre de congestion, et
+            # --window-size, la taille du buffer de réordonnancement du
+            # serveur, borne l'écart entre la base et le prochain segment
+            return min(
+                self._current_base + self._window_size - self._next_sequence_num,
+                sum(
+                    max(0, path.congestion.size - path.segments_in_flight)
+                    for path in paths
+                ),
+            )
+
+        def _set_status(self, status):
+            with self._transmission_lock:
+                if self._transmission_status == "IN_PROGRESS":
+                    self._transmission_status = status
+                self._transmission_event.notify_all()
+
+        def _hash_file(self, file_path):
+            file_hash = hashlib.sha256()
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+                    file_hash.update(chunk)
+            return file_hash.hexdigest()
+
+        def _file_chunks(self, file_path, offset=0, length=None):
+            with open(file_path, "rb") as file:
+                file.seek(offset)
+                if length is None:
+                    yield from iter(lambda: file.read(READ_CHUNK_SIZE), b"")
+                    return
+                while length:
+                    chunk = file.read(min(length, READ_CHUNK_SIZE))
+                    if not chunk:
+                        return
+                    length -= len(chunk)
+                    yield chunk
+
+        def _delta_chunks(self, file_path, block_size, signatures):
+            # Seuls les octets absents de la version du serveur sont envoyés
+            plan = compute_delta(file_path, block_size, signatures)
+            reused = sum(count for kind, _, count in plan if kind == DELTA_COPY)
+            literal = sum(length for kind, _, length in plan if kind != DELTA_COPY)
+            print(
+                f"[FileTransmissionProtocol] Delta: {reused * block_size} bytes reused from the server copy, "
+                f"{literal} literal bytes"
+            )
+            return delta_stream(file_path, plan)
 
-            thread.join()
+        def _read_segments(self, chunks):
+            # Compresse et découpe au fil de l'eau les blocs lus : seuls les
+            # segments en vol et les blocs en cours de compression restent en
+            # mémoire. Chaque connexion envoie un flux compressé indépendant.
+            if self._codec is None:
+                # Serveur sans codecs : flux zlib continu si file_compressed
+                if self._offered_codec != CODEC_NONE:
+                    chunks = zlib_stream(
+                        chunks,
+                        self._compression_level if self._offered_codec == CODEC_ZLIB else None,
+                    )
+            elif self._codec != CODEC_NONE:
+                executor = self.client.compression_executor()
+                chunks = compress_blocks(
+                    chunks,
+                    self._codec,
+                    self._compression_level if self._codec == self._offered_codec else None,
+                    executor,
+                    2 * self.client.compression_workers,
+                )
+            pending = bytearray()
+            for chunk in chunks:
+                pending += chunk
+                while len(pending) >= self._segment_size:
+                    yield bytes(pending[: self._segment_size])
+                    del pending[: self._segment_size]
+            if pending:
+                yield bytes(pending)
 
         def _send_upload(self, file_path):
-            file_name = os.path.basename(file_path)
-            file_hash = self._calculate_file_hash(file_path)
+            file_name = self._remote_name
             try:
-                Message(
-                    "UPLOAD",
-                    content={
-                        "file_name": file_name,
-                        "file_hash": file_hash,
-                        "file_compressed": self._compression,
-                    },
-                ).send(self._socket)
+                self._connection.send(
+                    Message(
+                        "UPLOAD",
+                        channel=self._channel,
+                        content={
+                            "file_name": file_name,
+                            "file_hash": self._file_hash,
+                            "file_size": os.path.getsize(file_path),
+                            "file_compressed": self._offered_codec != CODEC_NONE,
+                            # Par ordre de préférence ; zlib et rien sont
+                            # toujours acceptables
+                            "codecs": list(
+                                dict.fromkeys([self._offered_codec, CODEC_ZLIB, CODEC_NONE])
+                            )
+                            if self._offered_codec != CODEC_NONE
+                            else [CODEC_NONE],
+                            "wire_formats": WIRE_FORMATS,
+                            "arq": self._arq_mode,
+                            "window_size": self._window_size,
+                            "cumulative_ack": True,
+                            "sack_ranges": True,
+                            # Une plage n'est ni reprise, ni dédupliquée, ni
+                            # envoyée en delta
+                            "resume": self._stripe is None,
+                            "upload_id": self._upload_id,
+                            "unpack": self._unpack,
+                            "dedup": self._stripe is None,
+                            "delta": self._stripe is None and self._offer_delta,
+                            "transfer_id": self._transfer_id,
+                            "stripe": self._stripe,
+                            # Seules celles calculables ici ; le SHA-256 reste
+                            # acceptable par tous les serveurs
+                            "digests": [
+                                digest
+                                for digest in dict.fromkeys(
+                                    [self._offered_digest, DIGEST_CRC32, DIGEST_SHA256]
+                                )
+                                if digest in SUPPORTED_DIGESTS
+                            ],
+                        },
+                    )
+                )
             except socket.error:
-                self._reconnect()
+                self._set_status("DISCONNECTED")
             print(f"[FileTransmissionProtocol] Sent upload message for {file_name}")
 
-        def _send_data(self, data, sequence_num):
-            data_hash = hashlib.sha256(data).hexdigest()
+        def _send_window(self, sequence_nums, retransmission=False):
+            # Appelé sous le verrou. Chaque segment part sur le chemin qui le
+            # livrerait le plus tôt ; il n'y en a qu'un hors multipath.
+            paths = [path for path in self._paths if path.alive]
+            if not paths:
+                return  # Statut déjà DISCONNECTED
+            batches = {}
+            for sequence_num in sequence_nums:
+                length = len(self._segments_in_flight[sequence_num][0])
+                path = choose_path(paths, length)
+                previous = self._segment_paths.get(sequence_num)
+                if previous is not None and previous is not path:
+                    previous.forget(sequence_num)
+                self._segment_paths[sequence_num] = path
+                path.on_send(sequence_num, length, retransmission)
+                batches.setdefault(path, []).append(sequence_num)
+            for path, batch in batches.items():
+                self._send_batch(path, batch, retransmission)
+
+        def _send_batch(self, path, sequence_nums, retransmission):
+            buffers = []
+            for sequence_num in sequence_nums:
+                data, data_hash = self._segments_in_flight[sequence_num]
+                buffers.extend(
+                    Message(
+                        "DATA", sequence_num, data, data_hash, path.channel
+                    ).frame_buffers(self._wire_format)
+                )
             try:
-                Message("DATA", sequence_num, data, data_hash).send(self._socket)
+                bytes_sent, syscalls = path.connection.send_buffers(buffers)
             except socket.error:
-                self._reconnect()
-            setattr(
-                self,
-                f"_timer_{sequence_num}",
-                threading.Timer(
-                    self._timeout, self._check_timeout, args=(sequence_num,)
-                ),
+                self._lose_path(path)
+                return
+            self.metrics.increment("bytes_sent_total", bytes_sent)
+            self.metrics.increment("send_syscalls_total", syscalls)
+            self.metrics.increment("windows_sent_total")
+            self.metrics.increment("segments_sent_total", len(sequence_nums))
+            if retransmission:
+                self.metrics.increment("segments_retransmitted_total", len(sequence_nums))
+                self.metrics.increment("bytes_retransmitted_total", bytes_sent)
+
+            sent_at = time.monotonic()
+            for sequence_num in sequence_nums:
+                if retransmission:
+                    self._send_times.pop(sequence_num, None)
+                else:
+                    self._send_times[sequence_num] = sent_at
+                self._scheduler.arm(sequence_num, self._segment_rto(path))
+            print(
+                f"[FileTransmissionProtocol] Sent data segments {sequence_nums[0]}-{sequence_nums[-1]} "
+                f"({bytes_sent} bytes, {syscalls} syscalls, {path.label})"
             )
-            getattr(self, f"_timer_{sequence_num}").start()
-            print(f"[FileTransmissionProtocol] Sent data segment {sequence_num}")
+
+        def _segment_rto(self, path):
+            # En multipath, le RTO d'un chemin plus lent que la moyenne est le sien
+            if len(self._paths) == 1 or not path.rtt.samples:
+                return self._rtt.rto
+            return max(self._rtt.rto, path.rtt.rto)
+
+        def _lose_path(self, path):
+            # Appelé sous le verrou. Sans autre chemin, l'envoi s'arrête et
+            # reprendra après reconnexion ; sinon les segments non acquittés
+            # du chemin perdu repartent aussitôt sur les autres, sans réduire
+            # la fenêtre ni doubler le RTO : ce n'est pas une congestion.
+            if not path.alive:
+                return
+            path.alive = False
+            path.joined.set()
+            if path not in self._paths:
+                return  # Chemin qui n'avait pas encore rejoint l'upload
+            if not any(other.alive for other in self._paths):
+                if self._transmission_status == "IN_PROGRESS":
+                    self._transmission_status = "DISCONNECTED"
+                self._transmission_event.notify_all()
+                return
+            sequence_nums = [
+                sequence_num
+                for sequence_num in path.unacknowledged()
+                if sequence_num in self._segments_in_flight
+                and sequence_num not in self._acknowledged
+            ]
+            print(
+                f"[Multipath] {path.label} path lost, resending {len(sequence_nums)} segments on the other paths"
+            )
+            if sequence_nums and self._transmission_status == "IN_PROGRESS":
+                self._send_window(sequence_nums, retransmission=True)
+
+        def _cancel_timer(self, sequence_num):
+            self._scheduler.cancel(sequence_num)
 
         def _send_eof(self):
+            path = next((path for path in self._paths if path.alive), self._paths[0])
             try:
-                Message("EOF").send(self._socket)
+                path.connection.send(
+                    Message(
+                        "EOF", content={"file_hash": self._file_hash}, channel=path.channel
+                    ),
+                    self._wire_format,
+                )
             except socket.error:
-                self._reconnect()
+                self._set_status("DISCONNECTED")
             print(f"[FileTransmissionProtocol] Sent EOF segment")
 
-        def _calculate_file_hash(self, file_path):
-            sha256_hash = hashlib.sha256()
-            with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            return sha256_hash.hexdigest()
-
         def _check_timeout(self, seq_num):
             with self._transmission_lock:
+                if self._transmission_status != "IN_PROGRESS":
+                    return
+                if self._arq_mode == ARQ_SELECTIVE_REPEAT:
+                    # Seul le segment expiré est renvoyé
+                    if (
+                        seq_num >= self._current_base
+                        and seq_num not in self._acknowledged
+                        and seq_num in self._segments_in_flight
+                    ):
+                        print(f"[Timeout] Retransmitting segment {seq_num}")
+                        self._on_timeout(seq_num)
+                        self._send_window([seq_num], retransmission=True)
+                    return
+
                 if (
-                    seq_num > self._current_base
+                    seq_num >= self._current_base
                     and not self._retransmission_in_progress
                 ):
                     self._retransmission_in_progress = True
@@ -195,179 +985,508 @@ class Client:
                     print(
                         f"[Timeout] detected for segment {seq_num}, initiating retransmission from base {self._current_base}."
                     )
-                    end_window = min(
-                        self._current_base + self._window_size,
-                        len(self._segments_to_send),
+                    self._on_timeout(seq_num)
+                    # Tous les segments en vol repartent, même si la fenêtre
+                    # vient d'être réduite
+                    end_window = self._next_sequence_num
+                    print(
+                        f"[Timeout] Retransmitting segments {self._current_base}-{end_window - 1}"
+                    )
+                    self._send_window(
+                        range(self._current_base, end_window), retransmission=True
                     )
-                    for seq_num in range(self._current_base, end_window):
-                        print(f"[Timeout] Retransmitting segment {seq_num}")
-                        self._send_data(self._segments_to_send[seq_num], seq_num)
 
                     self._retransmission_in_progress = False
 
-        def _listen_server(self):
-            buffer = b""
-            allow_running = True
-            while allow_running:
-                try:
-                    data = self._socket.recv(2048)
-                    if not data:
-                        break  # La connexion a été fermée
-                    buffer += data
-
-                    # Continuez à essayer de traiter les messages tant que vous avez assez de données dans le buffer
-                    while (
-                        len(buffer) >= 4
-                    ):  # Vérifiez si vous avez la longueur du message
-                        message_length = int.from_bytes(buffer[:4], byteorder="big")
-
-                        # Assurez-vous d'avoir reçu le message complet
-                        if len(buffer) - 4 >= message_length:
-                            message_data = buffer[4 : 4 + message_length]
-                            buffer = buffer[
-                                4 + message_length :
-                            ]  # Supprimez les données traitées du buffer
-
-                            ack_message = Message.deserialize(message_data)
-                            if ack_message.type == "ACK":
-                                print(
-                                    f"[Server] ACK for segment {ack_message.sequence_num}"
-                                )
-                                if hasattr(self, f"_timer_{ack_message.sequence_num}"):
-                                    getattr(
-                                        self, f"_timer_{ack_message.sequence_num}"
-                                    ).cancel()
-                                    delattr(self, f"_timer_{ack_message.sequence_num}")
-                                self._current_base = max(
-                                    self._current_base, ack_message.sequence_num + 1
-                                )
-                            elif ack_message.type == "EOF_ACK":
-                                print("[Server] EOF ACK")
-                                self._transmission_status = "SUCCESS"
-                                allow_running = False
-                            elif ack_message.type == "EOF_NACK":
-                                print(f"[Server] EOF NACK : {ack_message.content}")
-                                self._transmission_status = "FAILED"
-                                allow_running = False
-                        else:
-                            break
-                except Exception as e:
-                    print(f"Error listening for messages: {e}")
-                    break
-            print("[FileTransmissionProtocol] Server listener stopped.")
+        def _on_timeout(self, sequence_num):
+            # En Selective Repeat, les segments d'une même fenêtre expirent un
+            # par un : le RTO ne double qu'une fois par délai écoulé, sinon il
+            # atteindrait MAX_RTO dès la première rafale de pertes
+            self.metrics.increment("timeouts_total")
+            now = time.monotonic()
+            if now - self._last_backoff >= self._rtt.rto - CLOCK_GRANULARITY:
+                self._rtt.backoff()
+                self._last_backoff = now
+            path = self._segment_paths.get(sequence_num)
+            if path is not None:
+                path.congestion.on_loss(sequence_num, self._next_sequence_num)
+
+        def _handle_ack(self, sequence_num):
+            newly_acknowledged = []
+            if self._arq_mode == ARQ_SELECTIVE_REPEAT:
+                # ACK individuel : la base n'avance que sur les segments contigus
+                if (
+                    sequence_num >= self._current_base
+                    and sequence_num not in self._acknowledged
+                    and sequence_num in self._segments_in_flight
+                ):
+                    self._acknowledged.add(sequence_num)
+                    self._cancel_timer(sequence_num)
+                    newly_acknowledged.append(sequence_num)
+                while self._current_base in self._acknowledged:
+                    self._acknowledged.remove(self._current_base)
+                    self._segments_in_flight.pop(self._current_base, None)
+                    self._current_base += 1
+            else:
+                # ACK cumulatif : tous les segments jusqu'à sequence_num sont reçus
+                # et quittent le buffer de retransmission
+                while self._current_base <= sequence_num:
+                    self._cancel_timer(self._current_base)
+                    self._segments_in_flight.pop(self._current_base, None)
+                    newly_acknowledged.append(self._current_base)
+                    self._current_base += 1
+            self._on_acknowledged(newly_acknowledged)
+
+        def _handle_cumulative_ack(self, next_expected, sack=0, sack_ranges=()):
+            # Tous les segments avant next_expected sont reçus : la base avance et
+            # leurs timers sont annulés en une fois
+            newly_acknowledged = []
+            while self._current_base < next_expected:
+                self._cancel_timer(self._current_base)
+                self._segments_in_flight.pop(self._current_base, None)
+                if self._current_base not in self._acknowledged:
+                    newly_acknowledged.append(self._current_base)
+                self._acknowledged.discard(self._current_base)
+                self._current_base += 1
+
+            # SACK en plages [début, fin[, limitées aux segments envoyés, ou
+            # bitmap d'un ancien serveur : le bit i correspond au segment
+            # next_expected + 1 + i
+            selected = [
+                sequence_num
+                for start, end in sack_ranges
+                for sequence_num in range(
+                    max(start, next_expected), min(end, self._next_sequence_num)
+                )
+            ]
+            offset = 0
+            while sack:
+                if sack & 1:
+                    selected.append(next_expected + 1 + offset)
+                sack >>= 1
+                offset += 1
+            for sequence_num in selected:
+                if (
+                    sequence_num not in self._acknowledged
+                    and sequence_num in self._segments_in_flight
+                ):
+                    self._acknowledged.add(sequence_num)
+                    self._cancel_timer(sequence_num)
+                    newly_acknowledged.append(sequence_num)
+            self._on_acknowledged(newly_acknowledged)
+
+        def _on_acknowledged(self, sequence_nums):
+            if not sequence_nums:
+                return
+            # Règle de Karn : seuls les segments jamais retransmis ont encore
+            # leur instant d'envoi et fournissent une mesure du RTT
+            sent_times = [
+                self._send_times.pop(sequence_num)
+                for sequence_num in sequence_nums
+                if sequence_num in self._send_times
+            ]
+            if sent_times:
+                rtt = time.monotonic() - max(sent_times)
+                self._rtt.sample(rtt)
+                self.metrics.observe("rtt_seconds", rtt)
+            acknowledged = {}  # chemin -> segments acquittés
+            for sequence_num in sequence_nums:
+                path = self._segment_paths.pop(sequence_num, None)
+                if path is not None:
+                    self.metrics.increment("bytes_acked_total", path.on_ack(sequence_num))
+                    acknowledged[path] = acknowledged.get(path, 0) + 1
+            for path, count in acknowledged.items():
+                path.congestion.on_ack(count)
+            self._transmission_event.notify_all()
+
+        def _on_message(self, message, path):
+            # Appelé par le thread de lecture de la connexion d'un chemin pour
+            # chaque trame de son canal, puis avec None si elle est perdue
+            if message is None:
+                with self._transmission_lock:
+                    self._lose_path(path)
+            elif message.type == "JOIN_ACK":
+                path.alive = bool(message.content.get("joined"))
+                path.joined.set()
+            elif message.type == "UPLOAD_ACK" and message.content.get("stored"):
+                # Le serveur a déjà ce contenu : aucune donnée à envoyer
+                print("[Server] UPLOAD ACK, file already stored")
+                self._set_status("SUCCESS")
+                self._upload_acknowledged.set()
+            elif (
+                message.type == "UPLOAD_ACK"
+                and self._stripe is not None
+                and not message.content.get("stripe")
+            ):
+                print("[Server] UPLOAD ACK, striped uploads are not supported")
+                self.stripe_refused = True
+                self._set_status("FAILED")
+                self._upload_acknowledged.set()
+            elif message.type == "UPLOAD_ACK":
+                self._wire_format = message.content["wire_format"]
+                self._arq_mode = message.content.get("arq", ARQ_GO_BACK_N)
+                self._cumulative_acks = message.content.get("cumulative_ack", False)
+                # Un ACK retardé ne doit pas faire expirer le segment qu'il acquitte
+                ack_delay = message.content.get("ack_delay", 0.0)
+                self._rtt.ack_delay = ack_delay
+                for path in self._paths:
+                    path.rtt.ack_delay = ack_delay
+                self._resume_offset = message.content.get("resume_offset", 0)
+                self._delta = message.content.get("delta", False)
+                self._codec = message.content.get("codec")
+                # Un serveur qui ne négocie pas l'empreinte vérifie du SHA-256
+                self._digest = message.content.get("digest", DIGEST_SHA256)
+                self._multipath = message.content.get("multipath", False)
+                # Fenêtre bornée par le buffer de réordonnancement du serveur ;
+                # aucun segment n'est encore parti, la fenêtre de congestion
+                # repart simplement de cette limite
+                window_size = message.content.get("window_size")
+                if window_size and window_size < self._window_size:
+                    print(f"[Server] UPLOAD ACK, window limited to {window_size} segments")
+                    self._window_size = window_size
+                    for path in self._paths:
+                        path.congestion = CongestionWindow(window_size)
+                print(
+                    f"[Server] UPLOAD ACK, using {self._wire_format} frames, {self._arq_mode}, "
+                    f"codec {self._codec} and digest {self._digest}"
+                )
+                self._upload_acknowledged.set()
+            elif message.type == "SIGNATURES" and "error" in message.content:
+                # Version du serveur illisible : il attend le fichier entier
+                print(
+                    f"[FileTransmissionProtocol] Server cannot use its copy for a delta ({message.content['error']}), sending the whole file."
+                )
+                with self._transmission_lock:
+                    self._delta = False
+                    self._transmission_event.notify_all()
+            elif message.type == "SIGNATURES":
+                signatures = base64.b64decode(message.content["signatures"])
+                with self._transmission_lock:
+                    self._signatures = (message.content["block_size"], signatures)
+                    self._transmission_event.notify_all()
+            elif message.type == "ACK" and self._cumulative_acks:
+                content = message.content or {}
+                print(f"[Server] ACK up to segment {message.sequence_num}")
+                with self._transmission_lock:
+                    self._handle_cumulative_ack(
+                        message.sequence_num,
+                        content.get("sack", 0),
+                        content.get("sack_ranges", []),
+                    )
+            elif message.type == "ACK":
+                print(f"[Server] ACK for segment {message.sequence_num}")
+                with self._transmission_lock:
+                    self._handle_ack(message.sequence_num)
+            elif message.type == "EOF_ACK" and (message.content or {}).get(
+                "stripes_pending"
+            ):
+                print("[Server] EOF ACK, waiting for the other stripes")
+                self._set_status("SUCCESS")
+            elif message.type == "EOF_ACK":
+                print("[Server] EOF ACK")
+                self.file_complete = True
+                self._set_status("SUCCESS")
+            elif message.type == "EOF_NACK":
+                print(f"[Server] EOF NACK : {message.content}")
+                self._set_status("FAILED")
 
     class FileExecutionProtocol:
         def __init__(self, client, connection_mode):
             self.client = client
-            self._sock = None
-            self._connection_mode = connection_mode  # BLUETOOTH or WIFI
+            self._connection = client.connection(connection_mode)
+            self._messages = queue.Queue()
+            self._decoders = {}  # sorties texte, par descripteur
 
-        def _connect(self):
+        def _write_output(self, descriptor, content):
+            # Le numéro de séquence est le descripteur de la sortie. Une sortie
+            # sans buffer binaire (StringIO, IDE) reçoit le texte décodé ; un
+            # caractère coupé entre deux trames est recomposé.
+            output = sys.stderr if descriptor == 2 else sys.stdout
+            buffer = getattr(output, "buffer", None)
+            if buffer is not None:
+                output.flush()  # le texte déjà affiché passe avant
+                buffer.write(content)
+            else:
+                if descriptor not in self._decoders:
+                    self._decoders[descriptor] = codecs.getincrementaldecoder("utf-8")(
+                        errors="replace"
+                    )
+                output.write(self._decoders[descriptor].decode(content))
+            output.flush()
+
+        def execute_file(self, file_name, args=()):
+            # Affiche les sorties du fichier au fil de l'exécution sur le
+            # serveur. Retourne son code de sortie, ou None en cas d'erreur.
+            if not self._connection.connect():
+                return None
+            self._decoders.clear()
+
+            channel = self._connection.open_channel(self._messages.put)
             try:
-                if self._connection_mode == "BLUETOOTH":
-                    self._sock = socket.socket(
-                        socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM
+                try:
+                    self._connection.send(
+                        Message(
+                            "EXECUTE",
+                            content={
+                                "file_name": file_name,
+                                "args": list(args),
+                                "wire_formats": WIRE_FORMATS,
+                                "stream_output": True,
+                            },
+                            channel=channel,
+                        )
                     )
-                else:
-                    self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                for attempt in range(5):
-                    try:
-                        if self._connection_mode == "BLUETOOTH":
-                            self._sock.connect((self.client.mac_address, 1))
-                        else:
-                            self._sock.connect(
-                                (self.client.server_address, self.client.server_port)
-                            )
+                except socket.error as e:
+                    print(f"[FileExecutionProtocol] Error sending execute message: {e}")
+                    return None
+                print(f"[FileExecutionProtocol] Sent execute message for {file_name}")
+
+                while True:
+                    message = self._messages.get()
+                    if message is None:
+                        print("[FileExecutionProtocol] Connection lost.")
+                        return None
+                    if message.type == "EXECUTE_ACK":
+                        print("[FileExecutionProtocol] Request to execute file acknowledged.")
+                    elif message.type == "EXECUTE_OUTPUT":
+                        self._write_output(message.sequence_num, message.content)
+                    elif message.type == "EXECUTE_ERROR":
+                        print(f"[FileExecutionProtocol] EXECUTE NACK : {message.content}")
+                        return None
+                    elif message.type == "EXECUTE_RESULT" and isinstance(
+                        message.content, dict
+                    ):
                         print(
-                            "[FileExecutionProtocol] Connecté avec succès au serveur pour l'exécution de commandes."
+                            f"[FileExecutionProtocol] EXECUTE RESULT : exit code {message.content['exit_code']} "
+                            f"in {message.content['duration']:.3f}s"
+                            f"{' (cached)' if message.content.get('cached') else ''}"
                         )
-                        return True
-                    except socket.error as e:
+                        return message.content["exit_code"]
+                    elif message.type == "EXECUTE_RESULT":
+                        # Ancien serveur : un simple texte
+                        print(f"[FileExecutionProtocol] EXECUTE RESULT : {message.content}")
+                        return 0
+                    else:
                         print(
-                            f"[FileExecutionProtocol] Échec de la connexion au serveur, tentative {attempt + 1}/5"
+                            f"[FileExecutionProtocol] Invalid message type: {message.type}"
                         )
-                        if attempt < 4:
-                            time.sleep(2)
-                        else:
-                            print(
-                                "[FileExecutionProtocol] Impossible de se connecter au serveur pour l'exécution de commandes."
-                            )
-                            return False
-            except Exception as e:
-                print(f"Error connecting to server: {e}")
-                return False
+                        return None
+            finally:
+                self._connection.close_channel(channel)
 
-        def _disconnect(self):
-            if self._sock:
-                self._sock.close()
-                print(
-                    "[FileExecutionProtocol] Déconnecté du serveur pour l'exécution de commandes."
-                )
+    class FileDownloadProtocol:
+        def __init__(self, client, connection_mode, compression=CODEC_NONE):
+            self.client = client
+            self._connection = client.connection(connection_mode)
+            self._compression = compression
 
-        def execute_file(self, file_name):
-            if not self._connect():
-                return
+        def download_file(self, remote_name, local_path):
+            # Le fichier est écrit au fil de la réception dans local_path.part,
+            # renommé une fois son hash vérifié. Un download coupé reprend à
+            # la fin de ce fichier, après une reconnexion ou une nouvelle
+            # commande.
+            if not self._connection.connect():
+                return "FAILED"
+            part_path = local_path + ".part"
+            restarted = False
+            while True:
+                generation = self._connection.generation
+                result = self._download(remote_name, part_path)
+                if result == "SUCCESS":
+                    os.replace(part_path, local_path)
+                    print(f"[FileDownloadProtocol] {remote_name} saved to {local_path}")
+                    return "SUCCESS"
+                if result == "LOST":
+                    if not self._connection.reconnect(generation):
+                        self._discard_empty(part_path)
+                        return "FAILED"
+                elif result == "RESTART" and not restarted:
+                    # Le début déjà reçu ne correspond plus au fichier du
+                    # serveur, qui a changé entre-temps
+                    print("[FileDownloadProtocol] Partial file is stale, starting over.")
+                    os.remove(part_path)
+                    restarted = True
+                else:
+                    self._discard_empty(part_path)
+                    return "FAILED"
 
+        def _discard_empty(self, part_path):
+            # Un échec avant le premier octet reçu (fichier absent sur le
+            # serveur par exemple) ne laisse pas de fichier partiel vide
             try:
-                Message("EXECUTE", content={"file_name": file_name}).send(self._sock)
-            except socket.error:
-                self._disconnect()
-            print(f"[FileExecutionProtocol] Sent execute message for {file_name}")
+                if os.path.getsize(part_path) == 0:
+                    os.remove(part_path)
+            except OSError:
+                pass
 
-            buffer = b""
-            while True:
+        def _download(self, remote_name, part_path):
+            # Une tentative : SUCCESS, FAILED, LOST si la connexion est
+            # perdue, RESTART si la reprise depuis part_path est impossible
+            messages = queue.Queue(DOWNLOAD_QUEUE_SIZE)
+            with open(part_path, "a+b") as file:
+                file.seek(0)
+                file_hash = hashlib.sha256()
+                for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+                    file_hash.update(chunk)
+                offset = file.tell()
+                resumed = offset > 0
+                failed = "RESTART" if resumed else "FAILED"
+
+                channel = self._connection.open_channel(messages.put)
                 try:
-                    data = self._sock.recv(2048)
-                    if not data:
-                        break  # La connexion a été fermée
-                    buffer += data
-
-                    # Continuez à essayer de traiter les messages tant que vous avez assez de données dans le buffer
-                    while (
-                        len(buffer) >= 4
-                    ):  # Vérifiez si vous avez la longueur du message
-                        message_length = int.from_bytes(buffer[:4], byteorder="big")
-
-                        # Assurez-vous d'avoir reçu le message complet
-                        if len(buffer) - 4 >= message_length:
-                            message_data = buffer[4 : 4 + message_length]
-                            buffer = buffer[
-                                4 + message_length :
-                            ]  # Supprimez les données traitées du buffer
-
-                            message = Message.deserialize(message_data)
-                            if message.type == "EXECUTE_ACK":
-                                print(
-                                    "[FileExecutionProtocol] Request to execute file acknowledged."
-                                )
-                            elif message.type == "EXECUTE_ERROR":
-                                print(
-                                    f"[FileExecutionProtocol] EXECUTE NACK : {message.content}"
-                                )
-                                self._disconnect()
-                                return
-                            elif message.type == "EXECUTE_RESULT":
-                                print(
-                                    f"[FileExecutionProtocol] EXECUTE RESULT : {message.content}"
-                                )
-                                self._disconnect()
-                                return
-                            else:
-                                print(
-                                    f"[FileExecutionProtocol] Invalid message type: {message.type}"
-                                )
-                                self._disconnect()
-                                return
-                        else:
+                    try:
+                        self._connection.send(
+                            Message(
+                                "DOWNLOAD",
+                                content={
+                                    "file_name": remote_name,
+                                    "offset": offset,
+                                    "codecs": [self._compression],
+                                    "wire_formats": WIRE_FORMATS,
+                                },
+                                channel=channel,
+                            )
+                        )
+                    except (socket.error, ConnectionError) as e:
+                        print(f"[FileDownloadProtocol] Error sending download message: {e}")
+                        return "LOST"
+                    if resumed:
+                        print(f"[FileDownloadProtocol] Resuming {remote_name} at byte {offset}")
+
+                    try:
+                        message = messages.get(timeout=DOWNLOAD_ACK_TIMEOUT)
+                    except queue.Empty:
+                        print("[FileDownloadProtocol] No DOWNLOAD_ACK received, server does not support downloads.")
+                        return "FAILED"
+                    if message is None:
+                        return "LOST"
+                    if message.type == "DOWNLOAD_ERROR":
+                        print(f"[FileDownloadProtocol] DOWNLOAD NACK : {message.content}")
+                        return failed
+                    if message.type != "DOWNLOAD_ACK" or message.content["offset"] != offset:
+                        print(f"[FileDownloadProtocol] Unexpected answer: {message.type}")
+                        return "FAILED"
+                    file_size = message.content["file_size"]
+                    codec = message.content["codec"]
+                    decoder = BlockDecoder(codec) if codec != CODEC_NONE else None
+                    print(
+                        f"[FileDownloadProtocol] Receiving {remote_name} "
+                        f"({file_size} bytes, codec {codec})"
+                    )
+
+                    start = time.monotonic()
+                    frames = 0
+                    while True:
+                        message = messages.get()
+                        if message is None:
+                            print("[FileDownloadProtocol] Connection lost.")
+                            file.flush()
+                            return "LOST"
+                        if message.type == "DATA":
+                            if message.sequence_num != frames:
+                                print(f"[FileDownloadProtocol] Unexpected frame {message.sequence_num}")
+                                return "FAILED"
+                            frames += 1
+                            # Chaque morceau décompressé est écrit avant que
+                            # le suivant soit produit
+                            chunks = (
+                                decoder.feed(message.content)
+                                if decoder is not None
+                                else [message.content]
+                            )
+                            try:
+                                for chunk in chunks:
+                                    file.write(chunk)
+                                    file_hash.update(chunk)
+                            except ValueError as e:
+                                print(f"[FileDownloadProtocol] Decompression error: {e}")
+                                return "FAILED"
+                        elif message.type == "EOF":
                             break
-                except Exception as e:
-                    print(f"Error listening for messages: {e}")
-                    break
+                        else:
+                            print(f"[FileDownloadProtocol] Invalid message type: {message.type}")
+                            return "FAILED"
+                finally:
+                    self._connection.close_channel(channel)
+                    # Libère le thread de lecture s'il attend de la place
+                    while not messages.empty():
+                        messages.get_nowait()
+
+                elapsed = time.monotonic() - start
+                received = file.tell() - offset
+                if (
+                    (decoder is not None and not decoder.complete)
+                    or message.sequence_num != frames
+                    or file.tell() != file_size
+                ):
+                    print(
+                        f"[FileDownloadProtocol] Incomplete file: {file.tell()} of {file_size} bytes"
+                    )
+                    return failed
+                if file_hash.hexdigest() != message.content["file_hash"]:
+                    print("[FileDownloadProtocol] File hash mismatch.")
+                    return failed
+                print(
+                    f"[FileDownloadProtocol] {received} bytes received in {elapsed:.3f}s "
+                    f"({received / max(elapsed, 1e-9) / 1e6:.1f} MB/s), hash verified"
+                )
+                return "SUCCESS"
 
-    def __init__(self, server_address, server_port, mac_address):
+    def __init__(
+        self,
+        server_address,
+        server_port,
+        mac_address,
+        keepalive=15.0,
+        compression_workers=None,
+    ):
         self.server_address = server_address
         self.server_port = server_port
         self.mac_address = mac_address
+        self.keepalive = keepalive
+        # Processus compressant les blocs des gros fichiers, partagés par
+        # tous les uploads ; créés au premier besoin
+        self.compression_workers = compression_workers or os.cpu_count() or 1
+        self._compression_executor = None
+        self._compression_lock = threading.Lock()
+        # Connexions persistantes partagées par les commandes, par mode et
+        # par numéro dans le pool (le mode batch peut en ouvrir plusieurs)
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+
+    def connection(self, connection_mode, index=0):
+        with self._connections_lock:
+            key = (connection_mode, index)
+            if key not in self._connections:
+                self._connections[key] = self.Connection(
+                    self, connection_mode, self.keepalive
+                )
+            return self._connections[key]
+
+    def compression_executor(self):
+        # None avec un seul worker : les blocs sont compressés dans le thread
+        # de l'upload
+        if self.compression_workers <= 1:
+            return None
+        with self._compression_lock:
+            if self._compression_executor is None:
+                # forkserver : le client a déjà des threads, qu'un fork
+                # copierait dans un état incohérent
+                self._compression_executor = concurrent.futures.ProcessPoolExecutor(
+                    self.compression_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._compression_executor
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+        with self._compression_lock:
+            if self._compression_executor is not None:
+                self._compression_executor.shutdown()
+                self._compression_executor = None
 
     def send_file(
         self,
@@ -377,15 +1496,204 @@ class Client:
         timeout,
         compression,
         connection_mode,
+        arq_mode=ARQ_GO_BACK_N,
+        connection_index=0,
+        remote_name=None,
+        unpack=None,
+        compression_level=None,
+        digest=DIGEST_CRC32,
+        stripes=1,
+    ):
+        # stripes : nombre de connexions portant chacune une plage du fichier,
+        # borné pour que chaque plage fasse au moins STRIPE_MIN_SIZE octets
+        protocol_args = (
+            window_size,
+            segment_size,
+            timeout,
+            compression,
+            connection_mode,
+            arq_mode,
+        )
+        stripes = min(
+            stripes, MAX_STRIPES, os.path.getsize(file_path) // STRIPE_MIN_SIZE
+        )
+        if stripes > 1 and unpack is None:
+            status = self._send_striped(
+                file_path,
+                stripes,
+                protocol_args,
+                connection_index,
+                remote_name,
+                compression_level,
+                digest,
+            )
+            if status is not None:
+                return status
+        return self.FileTransmissionProtocol(
+            self,
+            *protocol_args,
+            connection_index,
+            compression_level,
+            digest,
+        ).send_file(file_path, remote_name, unpack)
+
+    def _send_striped(
+        self,
+        file_path,
+        stripes,
+        protocol_args,
+        connection_index,
+        remote_name,
+        compression_level,
+        digest,
+    ):
+        # Une fenêtre sur une seule connexion plafonne le débit à sa taille
+        # divisée par le RTT : le fichier est découpé en plages envoyées en
+        # même temps, chacune sur sa connexion et avec sa propre fenêtre. Le
+        # serveur écrit chaque plage à son offset et vérifie le hash du
+        # fichier entier à l'arrivée de la dernière. Retourne None si le
+        # serveur ne connaît pas les plages.
+        file_size = os.path.getsize(file_path)
+        protocols = [
+            self.FileTransmissionProtocol(
+                self,
+                *protocol_args,
+                connection_index + index,
+                compression_level,
+                digest,
+            )
+            for index in range(stripes)
+        ]
+        file_hash = protocols[0]._hash_file(file_path)
+        transfer_id = os.urandom(16).hex()
+        bounds = [file_size * index // stripes for index in range(stripes + 1)]
+
+        def send_stripe(index):
+            stripe = {
+                "id": transfer_id,
+                "index": index,
+                "count": stripes,
+                "offset": bounds[index],
+                "length": bounds[index + 1] - bounds[index],
+            }
+            return protocols[index].send_file(
+                file_path, remote_name, None, stripe, file_hash
+            )
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(stripes) as executor:
+            statuses = list(executor.map(send_stripe, range(stripes)))
+        elapsed = time.perf_counter() - start
+
+        if any(protocol.stripe_refused for protocol in protocols):
+            print("[Stripes] Server does not support striped uploads, sending one stream")
+            return None
+        # Seule la dernière plage arrivée porte le verdict sur le fichier entier
+        complete = all(status == "SUCCESS" for status in statuses) and any(
+            protocol.file_complete for protocol in protocols
+        )
+        print(
+            f"[Stripes] {file_size} bytes in {stripes} stripes, {elapsed:.2f}s: "
+            f"{file_size / elapsed / 1e6:.2f} MB/s"
+        )
+        return "SUCCESS" if complete else "FAILED"
+
+    def upload_batch(
+        self,
+        source,
+        window_size,
+        segment_size,
+        timeout,
+        compression,
+        connection_mode,
+        arq_mode=ARQ_GO_BACK_N,
+        parallel=4,
+        connections=1,
+        pack_threshold=BATCH_PACK_THRESHOLD,
+        pack_size=BATCH_PACK_SIZE,
+        compression_level=None,
+        digest=DIGEST_CRC32,
     ):
-        self.FileTransmissionProtocol(
-            self, window_size, segment_size, timeout, compression, connection_mode
-        ).send_file(file_path)
+        # Envoie un répertoire ou les fichiers d'un manifeste. Plusieurs
+        # uploads sont en cours en même temps, chacun sur son canal, répartis
+        # sur un pool de connexions : les allers-retours UPLOAD/UPLOAD_ACK et
+        # EOF/EOF_ACK d'un fichier se recouvrent avec les données des autres.
+        # Les petits fichiers sont regroupés dans des archives tar que le
+        # serveur extrait. Retourne True si tous les fichiers sont arrivés.
+        entries = _batch_entries(source)
+        total_bytes = sum(os.path.getsize(local_path) for local_path, _ in entries)
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as pack_directory:
+            items = _pack_small_files(entries, pack_threshold, pack_size, pack_directory)
+            # Les plus gros d'abord, pour équilibrer les transferts en parallèle
+            items.sort(key=lambda item: os.path.getsize(item[0]), reverse=True)
 
-    def execute_file(self, file_name, connection_mode):
-        self.FileExecutionProtocol(self, connection_mode=connection_mode).execute_file(
-            file_name
+            def upload(index, item):
+                local_path, remote_name, unpack = item
+                return self.send_file(
+                    local_path,
+                    window_size,
+                    segment_size,
+                    timeout,
+                    compression,
+                    connection_mode,
+                    arq_mode,
+                    index % connections,
+                    remote_name,
+                    unpack,
+                    compression_level,
+                    digest,
+                )
+
+            with concurrent.futures.ThreadPoolExecutor(parallel) as executor:
+                statuses = list(executor.map(upload, range(len(items)), items))
+        elapsed = time.perf_counter() - start
+
+        failed = [
+            remote_name
+            for (_, remote_name, _), status in zip(items, statuses)
+            if status != "SUCCESS"
+        ]
+        for remote_name in failed:
+            print(f"[Batch] Failed: {remote_name}")
+        archives = sum(1 for _, _, unpack in items if unpack)
+        print(
+            f"[Batch] {len(entries)} files ({len(items)} uploads, {archives} archives), "
+            f"{total_bytes} bytes in {elapsed:.2f}s: {total_bytes / elapsed / 1e6:.2f} MB/s, "
+            f"{len(entries) / elapsed:.1f} files/s, {len(failed)} failed"
         )
+        return not failed
+
+    def execute_file(self, file_name, connection_mode, args=()):
+        return self.FileExecutionProtocol(
+            self, connection_mode=connection_mode
+        ).execute_file(file_name, args)
+
+    def download_file(
+        self, remote_name, local_path, connection_mode, compression=CODEC_NONE
+    ):
+        return self.FileDownloadProtocol(
+            self, connection_mode, compression
+        ).download_file(remote_name, local_path)
+
+    def server_stats(self, connection_mode):
+        # Métriques du worker serveur qui porte la connexion, ou None
+        connection = self.connection(connection_mode)
+        if not connection.connect():
+            return None
+        messages = queue.Queue()
+        channel = connection.open_channel(messages.put)
+        try:
+            connection.send(Message("STATS", channel=channel))
+            message = messages.get(timeout=STATS_TIMEOUT)
+        except (socket.error, ConnectionError, queue.Empty):
+            print("[Client] No STATS_RESULT received.")
+            return None
+        finally:
+            connection.close_channel(channel)
+        if message is None or message.type != "STATS_RESULT":
+            return None
+        return message.content
 
 
 if __name__ == "__main__":
@@ -432,17 +1740,127 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--compression",
-        type=bool,
-        default=True,
-        help="Activer la compression des données",
+        choices=CODECS,
+        default=CODEC_ZLIB,
+        help="Codec de compression des données (none pour désactiver)",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        help="Niveau de compression (défaut du codec si absent)",
+    )
+    parser.add_argument(
+        "--compression-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Nombre de processus compressant les blocs en parallèle",
+    )
+    parser.add_argument(
+        "--digest",
+        choices=DIGESTS,
+        default=DIGEST_CRC32,
+        help="Empreinte de contrôle des segments (none pour s'en remettre au hash du fichier)",
+    )
+    parser.add_argument(
+        "--stripes",
+        type=int,
+        default=1,
+        help="Nombre de connexions portant chacune une plage d'un gros fichier",
+    )
+    parser.add_argument(
+        "--download-compression",
+        choices=CODECS,
+        default=CODEC_NONE,
+        help="Codec proposé au serveur pour les downloads (none : envoi sans copie)",
+    )
+    parser.add_argument(
+        "--arq",
+        choices=ARQ_MODES,
+        default=ARQ_GO_BACK_N,
+        help="Mode de retransmission des segments perdus",
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        default=15.0,
+        help="Intervalle des PING sur la connexion persistante, en secondes (0 pour désactiver)",
+    )
+
+    # mode batch, non interactif
+    parser.add_argument(
+        "--upload-batch",
+        type=str,
+        metavar="PATH",
+        help="Envoyer un répertoire ou les fichiers d'un manifeste, puis quitter",
+    )
+    parser.add_argument(
+        "--connection-mode",
+        choices=["WIFI", "BLUETOOTH", "MULTIPATH"],
+        default="WIFI",
+        help="Mode de connexion du mode batch",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=4,
+        help="Nombre d'uploads simultanés du mode batch",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="Nombre de connexions utilisées par le mode batch",
+    )
+    parser.add_argument(
+        "--pack-threshold",
+        type=int,
+        default=BATCH_PACK_THRESHOLD,
+        help="Taille en dessous de laquelle les fichiers sont regroupés en archives",
+    )
+    parser.add_argument(
+        "--pack-size",
+        type=int,
+        default=BATCH_PACK_SIZE,
+        help="Taille maximale d'une archive de petits fichiers",
     )
 
     args = parser.parse_args()
-    client = Client(args.host, args.port, args.mac_address)
+    client = Client(
+        args.host,
+        args.port,
+        args.mac_address,
+        args.keepalive,
+        args.compression_workers,
+    )
+
+    if args.upload_batch:
+        succeeded = client.upload_batch(
+            args.upload_batch,
+            args.window_size,
+            args.segment_size,
+            args.timeout,
+            args.compression,
+            args.connection_mode,
+            args.arq,
+            args.parallel,
+            args.connections,
+            args.pack_threshold,
+            args.pack_size,
+            args.compression_level,
+            args.digest,
+        )
+        client.close()
+        sys.exit(0 if succeeded else 1)
+    # Les uploads tournent en arrière-plan : une exécution peut être lancée
+    # pendant qu'un upload est en cours sur la même connexion
+    uploads = []
 
     while True:
         command = input("Enter command: ")
         if command == "exit":
+            for upload in uploads:
+                upload.join()
+            client.close()
             break
         elif command.startswith("upload"):
             if len(command.split(" ")) != 2:
@@ -452,27 +1870,77 @@ if __name__ == "__main__":
             if not os.path.exists(file_path):
                 print(f"File {file_path} does not exist.")
                 continue
-            connection_mode = input("Enter connection mode (BLUETOOTH or WIFI): ")
-            if connection_mode not in ["BLUETOOTH", "WIFI"]:
+            connection_mode = input(
+                "Enter connection mode (BLUETOOTH, WIFI or MULTIPATH): "
+            )
+            if connection_mode not in ["BLUETOOTH", "WIFI", "MULTIPATH"]:
                 print("Invalid connection mode")
                 continue
-            client.send_file(
-                file_path,
-                args.window_size,
-                args.segment_size,
-                args.timeout,
-                args.compression,
-                connection_mode,
+            upload = threading.Thread(
+                target=client.send_file,
+                args=(
+                    file_path,
+                    args.window_size,
+                    args.segment_size,
+                    args.timeout,
+                    args.compression,
+                    connection_mode,
+                    args.arq,
+                ),
+                kwargs={
+                    "compression_level": args.compression_level,
+                    "digest": args.digest,
+                    "stripes": args.stripes,
+                },
             )
+            upload.start()
+            uploads.append(upload)
         elif command.startswith("execute"):
-            if len(command.split(" ")) != 2:
+            # execute <fichier> [arguments...], avec les guillemets du shell
+            try:
+                _, file_name, *execute_args = shlex.split(command)
+            except ValueError:
                 print("execute command requires a file name.")
                 continue
-            _, file_name = command.split(" ")
             connection_mode = input("Enter connection mode (BLUETOOTH or WIFI): ")
             if connection_mode not in ["BLUETOOTH", "WIFI"]:
                 print("Invalid connection mode")
                 continue
-            client.execute_file(file_name, connection_mode)
+            client.execute_file(file_name, connection_mode, execute_args)
+        elif command == "stats":
+            connection_mode = input("Enter connection mode (BLUETOOTH or WIFI): ")
+            if connection_mode not in ["BLUETOOTH", "WIFI"]:
+                print("Invalid connection mode")
+                continue
+            stats = client.server_stats(connection_mode)
+            if stats is not None:
+                print(f"Server worker {stats['worker']}:")
+                for line in summarize(stats):
+                    print(f"  {line}")
+                for upload in stats["uploads"]:
+                    print(
+                        f"  upload {upload['file_name']}: {upload['bytes_received']} bytes "
+                        f"in {upload['seconds']:.1f}s ({upload['throughput'] / 1e6:.2f} MB/s)"
+                    )
+        elif command.startswith("download"):
+            # download <fichier distant> [chemin local]
+            try:
+                _, remote_name, *local_path = shlex.split(command)
+            except ValueError:
+                print("download command requires a file name.")
+                continue
+            if len(local_path) > 1:
+                print("download command takes a file name and an optional local path.")
+                continue
+            connection_mode = input("Enter connection mode (BLUETOOTH or WIFI): ")
+            if connection_mode not in ["BLUETOOTH", "WIFI"]:
+                print("Invalid connection mode")
+                continue
+            client.download_file(
+                remote_name,
+                local_path[0] if local_path else os.path.basename(remote_name),
+                connection_mode,
+                args.download_compression,
+            )
         else:
             print("Invalid command")
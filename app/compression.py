@@ -0,0 +1,214 @@
+import bz2
+import collections
+import itertools
+import math
+import os
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:  # Python compilé sans liblzma
+    lzma = None
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_LZMA = "lzma"
+CODEC_BZ2 = "bz2"
+CODECS = [CODEC_NONE, CODEC_ZLIB, CODEC_LZMA, CODEC_BZ2]
+# Codecs disponibles sur cette machine
+SUPPORTED_CODECS = [codec for codec in CODECS if codec != CODEC_LZMA or lzma]
+
+# Le flux est découpé en blocs compressés indépendamment : ils peuvent l'être
+# en parallèle, et un bloc qui ne gagne rien est envoyé tel quel
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+# En-tête d'un bloc : type (brut ou compressé) et longueur du contenu
+BLOCK_HEADER = struct.Struct("!BI")
+BLOCK_STORED = 0
+BLOCK_COMPRESSED = 1
+
+# Entropie (bits par octet) au-delà de laquelle les données sont considérées
+# comme incompressibles : déjà compressées, chiffrées ou aléatoires
+ENTROPY_THRESHOLD = 7.9
+ENTROPY_SAMPLE_SIZE = 4096
+ENTROPY_FILE_SAMPLES = 8
+
+# Taille maximale produite par un appel au décompresseur, pour borner la mémoire
+DECOMPRESS_MAX_OUTPUT = 64 * 1024
+
+DECOMPRESSION_ERRORS = (zlib.error, OSError, EOFError, ValueError) + (
+    (lzma.LZMAError,) if lzma else ()
+)
+
+
+def negotiate_codec(offered_codecs):
+    # Premier codec proposé par le client que ce serveur sait décompresser
+    for codec in offered_codecs or []:
+        if codec in SUPPORTED_CODECS:
+            return codec
+    return CODEC_NONE
+
+
+def entropy(sample):
+    # Entropie de Shannon d'ordre 0, en bits par octet
+    if not sample:
+        return 0.0
+    counts = collections.Counter(sample).values()
+    return -sum(count * math.log2(count / len(sample)) for count in counts) / len(sample)
+
+
+def _block_sample(block):
+    if len(block) <= 3 * ENTROPY_SAMPLE_SIZE:
+        return block
+    middle = len(block) // 2
+    return (
+        block[:ENTROPY_SAMPLE_SIZE]
+        + block[middle : middle + ENTROPY_SAMPLE_SIZE]
+        + block[-ENTROPY_SAMPLE_SIZE:]
+    )
+
+
+def file_looks_incompressible(file_path):
+    # Quelques échantillons répartis dans le fichier suffisent pour écarter
+    # un fichier déjà compressé sans le lire en entier
+    size = os.path.getsize(file_path)
+    samples = []
+    with open(file_path, "rb") as file:
+        for index in range(ENTROPY_FILE_SAMPLES):
+            file.seek(size * index // ENTROPY_FILE_SAMPLES)
+            samples.append(file.read(ENTROPY_SAMPLE_SIZE))
+    return entropy(b"".join(samples)) > ENTROPY_THRESHOLD
+
+
+def compress(codec, level, data):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, -1 if level is None else level)
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, preset=level)
+    if codec == CODEC_BZ2:
+        return bz2.compress(data, 9 if level is None else level)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def encode_block(codec, level, block):
+    # Bloc encadré de son en-tête ; exécuté dans un processus du pool
+    if entropy(_block_sample(block)) <= ENTROPY_THRESHOLD:
+        compressed = compress(codec, level, block)
+        if len(compressed) < len(block):
+            return BLOCK_HEADER.pack(BLOCK_COMPRESSED, len(compressed)) + compressed
+    return BLOCK_HEADER.pack(BLOCK_STORED, len(block)) + block
+
+
+def _blocks(chunks, block_size):
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def compress_blocks(chunks, codec, level, executor=None, in_flight=1):
+    # Compresse le flux par blocs indépendants, dans l'ordre. Avec un
+    # executor, jusqu'à in_flight blocs sont compressés en même temps ; un
+    # flux d'un seul bloc est compressé sur place, sans passer par le pool.
+    blocks = _blocks(chunks, COMPRESSION_BLOCK_SIZE)
+    head = list(itertools.islice(blocks, 2))
+    blocks = itertools.chain(head, blocks)
+    if executor is None or len(head) < 2:
+        for block in blocks:
+            yield encode_block(codec, level, block)
+        return
+
+    pending = collections.deque()
+    for block in blocks:
+        pending.append(executor.submit(encode_block, codec, level, block))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def zlib_stream(chunks, level=None):
+    # Flux zlib continu, seul format compris par les serveurs sans codecs
+    compressor = zlib.compressobj(-1 if level is None else level)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def _decompressor(codec):
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_LZMA:
+        return lzma.LZMADecompressor()
+    if codec == CODEC_BZ2:
+        return bz2.BZ2Decompressor()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def _decompress(decompressor, data):
+    # Morceaux d'au plus DECOMPRESS_MAX_OUTPUT octets, produits à la demande :
+    # un petit bloc très compressé n'est jamais décompressé en entier
+    if hasattr(decompressor, "unconsumed_tail"):  # zlib
+        while data:
+            yield decompressor.decompress(data, DECOMPRESS_MAX_OUTPUT)
+            data = decompressor.unconsumed_tail
+        return
+    yield decompressor.decompress(data, DECOMPRESS_MAX_OUTPUT)
+    while not decompressor.eof and not decompressor.needs_input:
+        yield decompressor.decompress(b"", DECOMPRESS_MAX_OUTPUT)
+
+
+class BlockDecoder:
+    # Décode le flux de blocs du client ; les blocs et leurs en-têtes peuvent
+    # être coupés n'importe où entre deux appels à feed. feed est un
+    # générateur : chaque morceau décodé doit être consommé avant que le
+    # suivant soit produit. Lève ValueError si le flux est corrompu.
+    def __init__(self, codec):
+        self.codec = codec
+        self._header = bytearray()
+        self._remaining = 0  # octets restants du bloc en cours
+        self._decompressor = None
+
+    def feed(self, data):
+        view = memoryview(data)
+        position = 0
+        while position < len(view):
+            if self._remaining:
+                length = min(self._remaining, len(view) - position)
+                piece = view[position : position + length]
+                position += length
+                self._remaining -= length
+                if self._decompressor is None:
+                    yield bytes(piece)
+                    continue
+                try:
+                    yield from _decompress(self._decompressor, bytes(piece))
+                except DECOMPRESSION_ERRORS as e:
+                    raise ValueError(f"Invalid {self.codec} block: {e}") from e
+                if not self._remaining:
+                    if hasattr(self._decompressor, "flush"):  # zlib
+                        yield self._decompressor.flush()
+                    if not self._decompressor.eof:
+                        raise ValueError(f"Truncated {self.codec} block")
+                    self._decompressor = None
+                continue
+
+            missing = BLOCK_HEADER.size - len(self._header)
+            self._header += view[position : position + missing]
+            position += min(missing, len(view) - position)
+            if len(self._header) < BLOCK_HEADER.size:
+                break
+            kind, self._remaining = BLOCK_HEADER.unpack(self._header)
+            self._header.clear()
+            if kind not in (BLOCK_STORED, BLOCK_COMPRESSED) or not self._remaining:
+                raise ValueError(f"Invalid compressed block header: {kind}")
+            if kind == BLOCK_COMPRESSED:
+                self._decompressor = _decompressor(self.codec)
+
+    @property
+    def complete(self):
+        return not self._header and not self._remaining
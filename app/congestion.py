@@ -0,0 +1,78 @@
+MIN_RTO = 0.05
+MAX_RTO = 60.0
+CLOCK_GRANULARITY = 0.01  # pas de la roue de timers
+
+
+class RttEstimator:
+    # Estimation du RTT et du délai de retransmission (Jacobson/Karels, RFC 6298).
+    # Selon la règle de Karn, l'appelant ne fournit que des mesures de segments
+    # qui n'ont jamais été retransmis.
+    def __init__(self, initial_rto):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.samples = 0
+        # Délai maximal pendant lequel le pair retient un ACK (ACK retardés).
+        # Le RTO doit le dépasser : sinon les derniers segments d'un envoi,
+        # dont l'ACK attend le délai, expireraient à chaque fois.
+        self.ack_delay = 0.0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+        self.rto = min(max(self.rto, MIN_RTO) + self.ack_delay, MAX_RTO)
+        self.samples += 1
+
+    def backoff(self):
+        # Expiration : le délai double jusqu'à la prochaine mesure valide
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+    def summary(self):
+        if self.srtt is None:
+            return f"rto={self.rto:.3f}s (no RTT sample)"
+        return (
+            f"srtt={self.srtt * 1000:.1f}ms rttvar={self.rttvar * 1000:.1f}ms "
+            f"rto={self.rto:.3f}s ({self.samples} samples)"
+        )
+
+
+class CongestionWindow:
+    # Fenêtre AIMD : démarrage lent jusqu'au seuil, puis +1 segment par RTT.
+    # Une perte divise la fenêtre par deux, une seule fois par fenêtre envoyée.
+    def __init__(self, max_window, initial_window=4):
+        self.max_window = max_window
+        self.cwnd = float(min(initial_window, max_window))
+        self.ssthresh = float(max_window)
+        self._recovery_point = -1
+        self.losses = 0
+
+    @property
+    def size(self):
+        return max(1, int(self.cwnd))
+
+    def on_ack(self, acked_segments):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked_segments
+        else:
+            self.cwnd += acked_segments / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_loss(self, sequence_num, next_sequence_num):
+        # Les pertes d'une même fenêtre ne comptent que pour une réduction
+        if sequence_num < self._recovery_point:
+            return
+        self._recovery_point = next_sequence_num
+        self.ssthresh = max(self.cwnd / 2, 1.0)
+        self.cwnd = self.ssthresh
+        self.losses += 1
+
+    def summary(self):
+        return (
+            f"cwnd={self.cwnd:.1f} ssthresh={self.ssthresh:.1f} "
+            f"max={self.max_window} ({self.losses} reductions)"
+        )
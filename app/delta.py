@@ -0,0 +1,197 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import zlib
+
+# Taille des blocs comparés : racine carrée de la taille de la copie du
+# serveur, comme rsync, arrondie au multiple de 64 et bornée
+DELTA_MIN_BLOCK = 1024
+DELTA_MAX_BLOCK = 64 * 1024
+# En dessous, la copie du serveur ne vaut pas l'échange des signatures
+DELTA_MIN_SIZE = 64 * 1024
+# Octets parcourus un par un par la somme glissante au-delà desquels le reste
+# du fichier est envoyé tel quel : le parcours octet par octet est lent en
+# Python, et un fichier entièrement différent n'y gagnerait rien
+DELTA_MAX_SCAN = 4 * 1024 * 1024
+# Longueur maximale d'un littéral, pour que sa longueur tienne sur 32 bits
+DELTA_MAX_LITERAL = 1 << 30
+
+# Modulo d'Adler-32
+ADLER_MODULUS = 65521
+
+# Signature d'un bloc : somme faible glissante (32 bits) et empreinte forte
+SIGNATURE = struct.Struct("!I16s")
+# Instructions du flux delta : octets littéraux, ou copie de blocs consécutifs
+# de la version du serveur (premier bloc, nombre de blocs)
+DELTA_LITERAL = 0
+DELTA_COPY = 1
+LITERAL_HEADER = struct.Struct("!BI")
+COPY_HEADER = struct.Struct("!BII")
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def block_size_for(file_size):
+    block_size = int(math.sqrt(file_size)) & ~63
+    return min(max(block_size, DELTA_MIN_BLOCK), DELTA_MAX_BLOCK)
+
+
+def weak_checksum(block):
+    # Somme faible : Adler-32, calculée en C par zlib pour un bloc entier et
+    # qui peut glisser d'un octet (voir compute_delta). Retourne (a, b).
+    checksum = zlib.adler32(block)
+    return checksum & 0xFFFF, checksum >> 16
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def file_signatures(file, block_size):
+    # Signatures des blocs complets du fichier ouvert ; le dernier bloc
+    # incomplet n'en a pas et sera envoyé en littéral
+    signatures = []
+    file.seek(0)
+    for block in iter(lambda: file.read(block_size), b""):
+        if len(block) < block_size:
+            break
+        signatures.append(SIGNATURE.pack(zlib.adler32(block), strong_checksum(block)))
+    return b"".join(signatures)
+
+
+def compute_delta(file_path, block_size, signatures):
+    # Compare le fichier local aux blocs du serveur. Retourne les instructions
+    # (DELTA_COPY, premier bloc, nombre) et (DELTA_LITERAL, offset, longueur).
+    blocks = {}
+    weak_sums = set()
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(signatures)):
+        blocks.setdefault(strong, index)
+        weak_sums.add(weak)
+
+    size = os.path.getsize(file_path)
+    plan = []
+
+    def add_literal(start, end):
+        if end > start:
+            plan.append((DELTA_LITERAL, start, end - start))
+
+    def add_copy(index):
+        if plan and plan[-1][0] == DELTA_COPY and plan[-1][1] + plan[-1][2] == index:
+            plan[-1] = (DELTA_COPY, plan[-1][1], plan[-1][2] + 1)
+        else:
+            plan.append((DELTA_COPY, index, 1))
+
+    if not blocks or size < block_size:
+        add_literal(0, size)
+        return plan
+
+    with open(file_path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        literal_start = 0
+        position = 0
+        scanned = 0
+        while position + block_size <= size and scanned < DELTA_MAX_SCAN:
+            # Après une correspondance, le bloc suivant est souvent lui aussi
+            # inchangé : l'empreinte forte est essayée directement
+            index = blocks.get(strong_checksum(data[position : position + block_size]))
+            if index is None:
+                # Sinon la somme faible glisse d'un octet à la fois jusqu'au
+                # prochain bloc connu : a = 1 + somme des octets et
+                # b = somme des valeurs successives de a
+                a, b = weak_checksum(data[position : position + block_size])
+                while position + block_size < size and scanned < DELTA_MAX_SCAN:
+                    removed = data[position]
+                    added = data[position + block_size]
+                    a = (a - removed + added) % ADLER_MODULUS
+                    b = (b - block_size * removed + a - 1) % ADLER_MODULUS
+                    position += 1
+                    scanned += 1
+                    if a | b << 16 in weak_sums:
+                        index = blocks.get(
+                            strong_checksum(data[position : position + block_size])
+                        )
+                        if index is not None:
+                            break
+                if index is None:
+                    break
+            add_literal(literal_start, position)
+            add_copy(index)
+            position += block_size
+            literal_start = position
+        add_literal(literal_start, size)
+    return plan
+
+
+def delta_stream(file_path, plan):
+    # Flux delta envoyé à la place du contenu du fichier : en-têtes des
+    # instructions et octets littéraux lus au fil de l'eau
+    with open(file_path, "rb") as file:
+        for kind, start, length in plan:
+            if kind == DELTA_COPY:
+                yield COPY_HEADER.pack(DELTA_COPY, start, length)
+                continue
+            file.seek(start)
+            while length:
+                literal_length = min(length, DELTA_MAX_LITERAL)
+                yield LITERAL_HEADER.pack(DELTA_LITERAL, literal_length)
+                length -= literal_length
+                while literal_length:
+                    chunk = file.read(min(literal_length, READ_CHUNK_SIZE))
+                    if not chunk:
+                        raise ValueError(f"{file_path} changed during the upload")
+                    literal_length -= len(chunk)
+                    yield chunk
+
+
+class DeltaDecoder:
+    # Découpe le flux delta reçu en morceaux du fichier reconstruit : des
+    # octets littéraux, ou des plages (offset, longueur) de la version du
+    # serveur. Les instructions peuvent être coupées n'importe où entre deux
+    # appels à feed.
+    def __init__(self, block_size, block_count):
+        self.block_size = block_size
+        self.block_count = block_count
+        self._header = bytearray()
+        self._literal_remaining = 0
+
+    def feed(self, data):
+        pieces = []
+        view = memoryview(data)
+        position = 0
+        while position < len(view):
+            if self._literal_remaining:
+                length = min(self._literal_remaining, len(view) - position)
+                pieces.append(bytes(view[position : position + length]))
+                self._literal_remaining -= length
+                position += length
+                continue
+
+            tag = self._header[0] if self._header else view[position]
+            if tag not in (DELTA_LITERAL, DELTA_COPY):
+                raise ValueError(f"Invalid delta instruction: {tag}")
+            header = COPY_HEADER if tag == DELTA_COPY else LITERAL_HEADER
+            missing = header.size - len(self._header)
+            self._header += view[position : position + missing]
+            position += min(missing, len(view) - position)
+            if len(self._header) < header.size:
+                break
+
+            if header is LITERAL_HEADER:
+                _, self._literal_remaining = LITERAL_HEADER.unpack(self._header)
+            else:
+                _, first_block, block_count = COPY_HEADER.unpack(self._header)
+                if first_block + block_count > self.block_count:
+                    raise ValueError(f"Invalid delta block reference: {first_block}")
+                pieces.append(
+                    (first_block * self.block_size, block_count * self.block_size)
+                )
+            self._header.clear()
+        return pieces
+
+    @property
+    def complete(self):
+        # Le flux ne s'arrête pas au milieu d'une instruction
+        return not self._header and not self._literal_remaining
@@ -0,0 +1,52 @@
+import hashlib
+import zlib
+
+try:
+    import xxhash
+except ImportError:  # Module optionnel : pip install xxhash
+    xxhash = None
+
+# Empreintes possibles des segments DATA, négociées dans l'UPLOAD. Le hash
+# SHA-256 du fichier, vérifié à l'EOF, garantit déjà l'intégrité de bout en
+# bout ; l'empreinte d'un segment ne sert qu'à écarter un segment abîmé avant
+# qu'il soit acquitté, pour qu'il soit retransmis au lieu de faire échouer
+# tout l'upload.
+DIGEST_SHA256 = "sha256"  # Seule empreinte connue des anciens clients et serveurs
+DIGEST_BLAKE2B = "blake2b"  # BLAKE2b tronqué à 16 octets
+DIGEST_XXH64 = "xxh64"  # Non cryptographique, nécessite xxhash
+DIGEST_CRC32 = "crc32"
+DIGEST_NONE = "none"  # Seuls le checksum TCP et le hash du fichier protègent les données
+DIGESTS = [DIGEST_CRC32, DIGEST_XXH64, DIGEST_BLAKE2B, DIGEST_SHA256, DIGEST_NONE]
+# Empreintes disponibles sur cette machine
+SUPPORTED_DIGESTS = [digest for digest in DIGESTS if digest != DIGEST_XXH64 or xxhash]
+
+BLAKE2B_DIGEST_SIZE = 16
+
+
+def negotiate_digest(offered_digests):
+    # Première empreinte proposée par le client que ce serveur sait calculer
+    for digest in offered_digests or []:
+        if digest in SUPPORTED_DIGESTS:
+            return digest
+    return DIGEST_SHA256
+
+
+def segment_digest(digest, data):
+    # Empreinte brute (bytes) d'un segment ; None pour DIGEST_NONE
+    if digest == DIGEST_CRC32:
+        return zlib.crc32(data).to_bytes(4, "big")
+    if digest == DIGEST_XXH64:
+        return xxhash.xxh64_digest(data)
+    if digest == DIGEST_BLAKE2B:
+        return hashlib.blake2b(data, digest_size=BLAKE2B_DIGEST_SIZE).digest()
+    if digest == DIGEST_SHA256:
+        return hashlib.sha256(data).digest()
+    if digest == DIGEST_NONE:
+        return None
+    raise ValueError(f"Unknown digest: {digest}")
+
+
+def verify_digest(digest, data, expected):
+    if digest == DIGEST_NONE:
+        return True
+    return expected == segment_digest(digest, data)
@@ -0,0 +1,147 @@
+import asyncio
+import collections
+import os
+import signal
+import sys
+import time
+
+from blobs import FileHashCache
+
+# Interpréteurs des fichiers sans droit d'exécution, selon leur extension
+INTERPRETERS = {".py": [sys.executable], ".sh": ["/bin/sh"]}
+# Descripteurs des sorties, utilisés comme numéro de séquence des EXECUTE_OUTPUT
+STDOUT = 1
+STDERR = 2
+OUTPUT_CHUNK_SIZE = 16 * 1024
+# Résultats gardés en cache, et taille maximale des sorties d'un résultat
+# pour qu'il y entre
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_MAX_OUTPUT = 1024 * 1024
+
+
+class ExecutionError(Exception):
+    pass
+
+
+class ExecutionTimeout(ExecutionError):
+    pass
+
+
+class ExecutionEngine:
+    # Exécute les fichiers reçus dans des processus, au plus workers à la
+    # fois ; les demandes suivantes attendent une place. Les sorties sont
+    # transmises au fil de l'eau à on_output. Un processus qui dépasse timeout
+    # secondes est tué avec tous ses descendants. Les résultats sont gardés
+    # par (hash du fichier, arguments) : un fichier inchangé exécuté avec les
+    # mêmes arguments rejoue sa sortie sans relancer de processus.
+    def __init__(
+        self, workers, timeout, file_hashes=None, cache_size=RESULT_CACHE_SIZE
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(workers)
+        self._cache_size = cache_size
+        self._results = collections.OrderedDict()  # clé -> (code, sorties)
+        self._file_hashes = file_hashes or FileHashCache()
+        self.processes_started = 0
+        self.cache_hits = 0
+
+    @staticmethod
+    def command(file_path, args):
+        interpreter = INTERPRETERS.get(os.path.splitext(file_path)[1].lower())
+        if interpreter is not None:
+            return [*interpreter, file_path, *args]
+        if os.access(file_path, os.X_OK):
+            return [file_path, *args]
+        raise ExecutionError(f"File is not executable: {os.path.basename(file_path)}")
+
+    def _file_hash(self, file_path):
+        with open(file_path, "rb") as file:
+            return self._file_hashes.file_hash(file)
+
+    async def run(self, file_path, args, on_output):
+        # Retourne le code de sortie et si le résultat vient du cache. Lève
+        # ExecutionError si le fichier ne peut pas être exécuté, et
+        # ExecutionTimeout s'il a dû être interrompu.
+        command = self.command(file_path, args)
+        loop = asyncio.get_running_loop()
+        try:
+            file_hash = await loop.run_in_executor(None, self._file_hash, file_path)
+        except OSError as e:
+            raise ExecutionError(f"Cannot read {os.path.basename(file_path)}: {e}")
+        key = (file_hash, tuple(args))
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.cache_hits += 1
+            exit_code, outputs = self._results[key]
+            for stream, data in outputs:
+                await on_output(stream, data)
+            return exit_code, True
+
+        async with self._slots:
+            exit_code, outputs = await self._run_process(command, file_path, on_output)
+        if outputs is not None:
+            self._results[key] = (exit_code, outputs)
+            if len(self._results) > self._cache_size:
+                self._results.popitem(last=False)
+        return exit_code, False
+
+    async def _run_process(self, command, file_path, on_output):
+        # Sorties gardées pour le cache, tant qu'elles ne sont pas trop grosses
+        outputs = []
+        output_size = 0
+
+        async def pump(stream, reader):
+            nonlocal outputs, output_size
+            while True:
+                data = await reader.read(OUTPUT_CHUNK_SIZE)
+                if not data:
+                    return
+                if outputs is not None:
+                    output_size += len(data)
+                    if output_size > RESULT_CACHE_MAX_OUTPUT:
+                        outputs = None
+                    else:
+                        outputs.append((stream, data))
+                await on_output(stream, data)
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=os.path.dirname(file_path),
+                start_new_session=True,  # groupe de processus tué d'un coup
+            )
+        except OSError as e:
+            raise ExecutionError(f"Cannot execute {os.path.basename(file_path)}: {e}")
+        self.processes_started += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    pump(STDOUT, process.stdout),
+                    pump(STDERR, process.stderr),
+                    process.wait(),
+                ),
+                self.timeout,
+            )
+        except TimeoutError:
+            self._kill(process)
+            await process.wait()
+            raise ExecutionTimeout(
+                f"Execution timed out after {time.monotonic() - start:.1f}s"
+            )
+        except BaseException:
+            # Client parti ou sortie impossible à transmettre
+            self._kill(process)
+            raise
+        return process.returncode, outputs
+
+    @staticmethod
+    def _kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -1,16 +1,105 @@
 import base64
 import json
+import struct
+
+# Nombre maximal de buffers par appel à sendmsg (IOV_MAX sous Linux)
+SENDMSG_MAX_BUFFERS = 1024
+# Plus grand contenu brut d'une trame : segment DATA, morceau de
+# téléchargement ou signatures d'un upload delta
+MAX_PAYLOAD_SIZE = 1024 * 1024
+# Plus grande trame acceptée : contenu encodé en base64 dans le format JSON,
+# plus l'en-tête et les autres champs. Une longueur annoncée au-delà est
+# une erreur et la connexion est fermée.
+MAX_FRAME_SIZE = MAX_PAYLOAD_SIZE * 4 // 3 + 64 * 1024
+
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary"
+# Formats supportés, par ordre de préférence
+WIRE_FORMATS = [WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON]
+
+# Modes de retransmission (ARQ) négociés dans l'UPLOAD
+ARQ_GO_BACK_N = "GO_BACK_N"
+ARQ_SELECTIVE_REPEAT = "SELECTIVE_REPEAT"
+ARQ_MODES = [ARQ_GO_BACK_N, ARQ_SELECTIVE_REPEAT]
+
+# Format binaire : en-tête fixe suivi du hash brut puis du contenu brut
+# magic, version, type, flags, sequence_num, longueur du hash, longueur du contenu
+BINARY_HEADER = struct.Struct("!BBBBIBI")
+# La version 2 ajoute le canal après les flags ; elle n'est utilisée que hors
+# du canal 0, que les pairs sans multiplexage ne voient jamais
+BINARY_HEADER_V2 = struct.Struct("!BBBBHIBI")
+BINARY_MAGIC = 0xB1
+BINARY_VERSION = 1
+BINARY_VERSION_CHANNELS = 2
+
+MESSAGE_TYPES = [
+    "UPLOAD",
+    "UPLOAD_ACK",
+    "DATA",
+    "ACK",
+    "EOF",
+    "EOF_ACK",
+    "EOF_NACK",
+    "EXECUTE",
+    "EXECUTE_ACK",
+    "EXECUTE_ERROR",
+    "EXECUTE_RESULT",
+    "HELLO",
+    "HELLO_ACK",
+    "PING",
+    "PONG",
+    "SIGNATURES",
+    "JOIN",
+    "JOIN_ACK",
+    "EXECUTE_OUTPUT",
+    "DOWNLOAD",
+    "DOWNLOAD_ACK",
+    "DOWNLOAD_ERROR",
+    "STATS",
+    "STATS_RESULT",
+]
+TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES)}
+
+# Types dont le contenu est brut, encodé en base64 dans le format JSON
+BYTES_CONTENT_TYPES = ("DATA", "EXECUTE_OUTPUT")
+
+FLAG_HAS_CONTENT = 0x01
+FLAG_JSON_CONTENT = 0x02  # contenu non binaire (dict, str...) encodé en JSON
+
+
+def sack_ranges(sequence_nums):
+    # Segments reçus au-delà du prochain attendu, en plages [début, fin[ : la
+    # taille de l'ACK dépend du nombre de trous, pas de l'écart qu'ils couvrent
+    ranges = []
+    for sequence_num in sorted(sequence_nums):
+        if ranges and ranges[-1][1] == sequence_num:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([sequence_num, sequence_num + 1])
+    return ranges
+
+
+def negotiate_wire_format(offered_formats):
+    # Un pair qui ne propose rien est une ancienne version : JSON uniquement
+    for wire_format in WIRE_FORMATS:
+        if wire_format in (offered_formats or []):
+            return wire_format
+    return WIRE_FORMAT_JSON
 
 
 class Message:
-    def __init__(self, type, sequence_num=0, content=None, hash=None):
+    def __init__(self, type, sequence_num=0, content=None, hash=None, channel=0):
         self.type = type
         self.sequence_num = sequence_num
         self.content = content
-        self.hash = hash
+        self.hash = hash  # empreinte brute (bytes) du contenu
+        self.channel = channel  # canal de la connexion multiplexée
+
+    def serialize(self, wire_format=WIRE_FORMAT_JSON):
+        if wire_format == WIRE_FORMAT_BINARY:
+            return b"".join(self._binary_buffers())
 
-    def serialize(self):
-        if isinstance(self.content, bytes):
+        if isinstance(self.content, (bytes, bytearray, memoryview)):
             content_encoded = base64.b64encode(self.content).decode("utf-8")
         else:
             content_encoded = self.content
@@ -19,29 +108,248 @@ class Message:
             "type": self.type,
             "sequence_num": self.sequence_num,
             "content": content_encoded,
-            "hash": self.hash,
+            "hash": self.hash.hex() if self.hash is not None else None,
         }
+        if self.channel:
+            message_data["channel"] = self.channel
 
         serialized_data = json.dumps(message_data).encode("utf-8")
         length_prefix = len(serialized_data).to_bytes(4, byteorder="big")
 
         return length_prefix + serialized_data
 
+    def frame_buffers(self, wire_format=WIRE_FORMAT_JSON):
+        # Morceaux de la trame à envoyer tels quels avec sendmsg, sans recopier
+        # le contenu dans un buffer intermédiaire
+        if wire_format == WIRE_FORMAT_BINARY:
+            return self._binary_buffers()
+        return [self.serialize(wire_format)]
+
+    def _binary_buffers(self):
+        flags = 0
+        if self.content is None:
+            payload = b""
+        elif isinstance(self.content, (bytes, bytearray, memoryview)):
+            flags |= FLAG_HAS_CONTENT
+            payload = self.content
+        else:
+            flags |= FLAG_HAS_CONTENT | FLAG_JSON_CONTENT
+            payload = json.dumps(self.content).encode("utf-8")
+        digest = self.hash or b""
+
+        buffers = [self._binary_header(flags, len(digest), len(payload))]
+        if digest:
+            buffers.append(digest)
+        if payload:
+            buffers.append(payload)
+        return buffers
+
+    def binary_header(self, payload_length):
+        # Début d'une trame binaire dont le contenu brut, de payload_length
+        # octets, est écrit à part sur le socket (os.sendfile par exemple)
+        return self._binary_header(FLAG_HAS_CONTENT, 0, payload_length)
+
+    def _binary_header(self, flags, digest_length, payload_length):
+        if self.channel:
+            header = BINARY_HEADER_V2.pack(
+                BINARY_MAGIC,
+                BINARY_VERSION_CHANNELS,
+                TYPE_CODES[self.type],
+                flags,
+                self.channel,
+                self.sequence_num or 0,
+                digest_length,
+                payload_length,
+            )
+        else:
+            header = BINARY_HEADER.pack(
+                BINARY_MAGIC,
+                BINARY_VERSION,
+                TYPE_CODES[self.type],
+                flags,
+                self.sequence_num or 0,
+                digest_length,
+                payload_length,
+            )
+        frame_length = len(header) + digest_length + payload_length
+        return frame_length.to_bytes(4, byteorder="big") + header
+
     @staticmethod
     def deserialize(data):
-        obj = json.loads(data.decode("utf-8"))
+        if data[0] == BINARY_MAGIC:
+            return Message._deserialize_binary(data)
+
+        obj = json.loads(str(data, "utf-8"))
         content_decoded = obj["content"]
 
-        if content_decoded is not None and obj["type"] == "DATA":
+        if content_decoded is not None and obj["type"] in BYTES_CONTENT_TYPES:
             content_decoded = base64.b64decode(content_decoded)
 
+        hash = obj.get("hash")
         return Message(
-            obj["type"], obj.get("sequence_num"), content_decoded, obj.get("hash")
+            obj["type"],
+            obj.get("sequence_num"),
+            content_decoded,
+            bytes.fromhex(hash) if hash is not None else None,
+            obj.get("channel", 0),
         )
 
-    def send(self, socket):
-        serialized_message = self.serialize()
-        try:
-            socket.send(serialized_message)
-        except socket.error:
-            raise
+    @staticmethod
+    def _deserialize_binary(data):
+        version = data[1]
+        if version == BINARY_VERSION:
+            (
+                _,
+                _,
+                type_code,
+                flags,
+                sequence_num,
+                digest_length,
+                payload_length,
+            ) = BINARY_HEADER.unpack_from(data)
+            channel = 0
+            offset = BINARY_HEADER.size
+        elif version == BINARY_VERSION_CHANNELS:
+            (
+                _,
+                _,
+                type_code,
+                flags,
+                channel,
+                sequence_num,
+                digest_length,
+                payload_length,
+            ) = BINARY_HEADER_V2.unpack_from(data)
+            offset = BINARY_HEADER_V2.size
+        else:
+            raise ValueError(f"Unsupported binary frame version: {version}")
+
+        digest = bytes(data[offset : offset + digest_length]) or None
+        offset += digest_length
+        payload = bytes(data[offset : offset + payload_length])
+
+        if not flags & FLAG_HAS_CONTENT:
+            content = None
+        elif flags & FLAG_JSON_CONTENT:
+            content = json.loads(payload.decode("utf-8"))
+        else:
+            content = payload
+
+        return Message(MESSAGE_TYPES[type_code], sequence_num, content, digest, channel)
+
+    def send(self, socket, wire_format=WIRE_FORMAT_JSON):
+        # sendall boucle jusqu'à ce que toute la trame soit écrite
+        socket.sendall(self.serialize(wire_format))
+
+
+def send_buffers(socket, buffers):
+    # Envoie les buffers avec le moins d'appels système possible en reprenant
+    # après chaque écriture partielle. Retourne (octets envoyés, appels système).
+    if not hasattr(socket, "sendmsg"):
+        data = b"".join(buffers)
+        socket.sendall(data)
+        return len(data), 1
+
+    pending = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    bytes_sent = 0
+    syscalls = 0
+    while pending:
+        sent = socket.sendmsg(pending[:SENDMSG_MAX_BUFFERS])
+        syscalls += 1
+        bytes_sent += sent
+        # Retire les buffers entièrement écrits et tronque le buffer partiel
+        index = 0
+        while index < len(pending) and sent >= len(pending[index]):
+            sent -= len(pending[index])
+            index += 1
+        pending = pending[index:]
+        if sent:
+            pending[0] = pending[0][sent:]
+    return bytes_sent, syscalls
+
+
+class FrameReader:
+    # Lit les trames préfixées par leur longueur avec recv_into dans un buffer
+    # préalloué. Les trames sont des memoryview sur ce buffer, valides
+    # jusqu'à l'itération suivante.
+    def __init__(self, socket, buffer_size=65536, max_frame_size=MAX_FRAME_SIZE):
+        self._socket = socket
+        self._max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # début des données non consommées
+        self._end = 0  # fin des données reçues
+
+    def __iter__(self):
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                yield frame
+            elif not self._commit(self._socket.recv_into(self._free_space())):
+                return  # Connexion fermée
+
+    async def frames(self, loop):
+        # Même lecture pour un socket non bloquant piloté par une boucle asyncio
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                yield frame
+            elif not self._commit(
+                await loop.sock_recv_into(self._socket, self._free_space())
+            ):
+                return
+
+    def _next_frame(self):
+        available = self._end - self._start
+        if available < 4:
+            return None
+        message_length = int.from_bytes(
+            self._view[self._start : self._start + 4], byteorder="big"
+        )
+        if message_length > self._max_frame_size:
+            raise ValueError(f"Frame too large: {message_length} bytes")
+        if available - 4 < message_length:
+            self._reserve(4 + message_length)
+            return None
+
+        frame = self._view[self._start + 4 : self._start + 4 + message_length]
+        self._start += 4 + message_length
+        return frame
+
+    def _reserve(self, frame_size):
+        # Fait de la place pour la suite d'une trame de frame_size octets
+        if self._start + frame_size <= len(self._buffer):
+            return
+        self._compact()
+        if self._end == len(self._buffer):
+            # Seul cas où le buffer grandit : une trame plus grande que lui l'a
+            # rempli. Il double, sans dépasser la trame : la mémoire suit les
+            # octets reçus, pas la longueur annoncée par le pair.
+            buffer = bytearray(min(frame_size, 2 * len(self._buffer)))
+            view = memoryview(buffer)
+            view[: self._end] = self._view[: self._end]
+            self._buffer, self._view = buffer, view
+
+    def _compact(self):
+        # Ne déplace que la trame partielle en attente, jamais tout l'historique
+        pending = self._end - self._start
+        if pending:
+            self._view[:pending] = self._view[self._start : self._end]
+        self._start, self._end = 0, pending
+
+    @property
+    def buffer_size(self):
+        return len(self._buffer)
+
+    def _free_space(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            self._compact()
+        return self._view[self._end :]
+
+    def _commit(self, received):
+        if not received:
+            return False
+        self._end += received
+        return True
@@ -0,0 +1,167 @@
+import bisect
+import math
+import threading
+
+# Bornes des histogrammes de durée, en secondes
+DURATION_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+# Bornes des histogrammes de débit, en octets par seconde
+THROUGHPUT_BUCKETS = (1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+
+class Histogram:
+    # Distribution sur des intervalles fixes, comme un histogramme
+    # Prometheus : nombre d'observations par intervalle, somme et extrêmes.
+    # La mémoire ne dépend pas du nombre d'observations.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # le dernier : au-delà des bornes
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        # Histogramme reçu dans un STATS, pour en estimer les quantiles
+        histogram = cls(tuple(bound for bound, _ in snapshot["buckets"]))
+        previous = 0
+        for index, (_, cumulative) in enumerate(snapshot["buckets"]):
+            histogram.counts[index] = cumulative - previous
+            previous = cumulative
+        histogram.counts[-1] = snapshot["count"] - previous
+        histogram.count = snapshot["count"]
+        histogram.sum = snapshot["sum"]
+        if snapshot["count"]:
+            histogram.min, histogram.max = snapshot["min"], snapshot["max"]
+        return histogram
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Estimation par interpolation linéaire dans l'intervalle qui contient
+        # le quantile, bornée par les extrêmes observés
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index else self.min
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+
+def summarize(snapshot):
+    # Lignes lisibles d'un état de Metrics.snapshot()
+    lines = [f"{name}: {value}" for name, value in sorted(snapshot["counters"].items())]
+    lines += [f"{name}: {value}" for name, value in sorted(snapshot["gauges"].items())]
+    for name, data in sorted(snapshot["histograms"].items()):
+        histogram = Histogram.from_snapshot(data)
+        if not histogram.count:
+            continue
+        lines.append(
+            f"{name}: {histogram.count} observations, mean {histogram.sum / histogram.count:.4g}, "
+            f"p50 {histogram.quantile(0.5):.4g}, p99 {histogram.quantile(0.99):.4g}, "
+            f"max {histogram.max:.4g}"
+        )
+    return lines
+
+
+class Metrics:
+    # Compteurs, jauges et histogrammes nommés. Les étages du pipeline et
+    # les threads des connexions les mettent à jour en même temps : un
+    # verrou les protège. Une jauge est une fonction évaluée à la lecture.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(buckets)
+            self._histograms[name].observe(value)
+
+    def gauge(self, name, function):
+        self._gauges[name] = function
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def histogram(self, name):
+        return self._histograms.get(name)
+
+    def snapshot(self):
+        # État sérialisable en JSON, pour le message STATS
+        gauges = {name: function() for name, function in self._gauges.items()}
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": gauges,
+                "histograms": {
+                    name: histogram.snapshot()
+                    for name, histogram in self._histograms.items()
+                },
+            }
+
+    def prometheus(self, prefix):
+        # Format texte d'exposition de Prometheus
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {prefix}_{name} counter", f"{prefix}_{name} {value}"]
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for bound, count in histogram["buckets"]:
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f'{prefix}_{name}_bucket{{le="+Inf"}} {histogram["count"]}',
+                f"{prefix}_{name}_sum {histogram['sum']}",
+                f"{prefix}_{name}_count {histogram['count']}",
+            ]
+        return "\n".join(lines) + "\n"
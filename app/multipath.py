@@ -0,0 +1,124 @@
+import threading
+import time
+
+from congestion import RttEstimator
+
+# Modes de connexion utilisés par un upload multipath, par ordre de préférence
+# pour porter l'UPLOAD
+MULTIPATH_MODES = ["WIFI", "BLUETOOTH"]
+# Poids d'une nouvelle mesure dans le débit estimé d'un chemin
+RATE_GAIN = 0.25
+
+
+class Path:
+    # Un chemin d'un upload : une connexion persistante, le canal ouvert
+    # dessus et sa fenêtre de congestion. Le RTT et le débit de livraison sont
+    # mesurés sur les segments acquittés qu'il a transportés.
+    def __init__(self, connection, label, initial_rto, congestion):
+        self.connection = connection
+        self.label = label
+        self.channel = None
+        self.alive = True
+        self.joined = threading.Event()  # JOIN_ACK reçu, ou chemin perdu
+        self.congestion = congestion
+        self.rtt = RttEstimator(initial_rto)
+        self.delivery_rate = None  # octets par seconde
+        # Segments envoyés sur ce chemin et pas encore acquittés : longueur,
+        # octets livrés et instant de la dernière livraison au moment de
+        # l'envoi, instant d'envoi (None si retransmis)
+        self._in_flight = {}
+        self.bytes_in_flight = 0
+        self._delivered = 0
+        self._delivered_at = time.monotonic()
+        self.bytes_sent = 0
+        self.segments_sent = 0
+
+    def on_send(self, sequence_num, length, retransmission):
+        self.forget(sequence_num)
+        now = time.monotonic()
+        if not self._in_flight:
+            # Chemin inactif jusqu'ici : le temps passé sans rien à livrer ne
+            # compte pas dans le débit
+            self._delivered_at = now
+        self._in_flight[sequence_num] = (
+            length,
+            self._delivered,
+            self._delivered_at,
+            None if retransmission else now,
+        )
+        self.bytes_in_flight += length
+        self.bytes_sent += length
+        self.segments_sent += 1
+
+    def on_ack(self, sequence_num):
+        # Mesure du débit de livraison à la façon de BBR : octets livrés
+        # depuis l'envoi du segment, sur le temps écoulé depuis la livraison
+        # qui le précédait. Retourne la longueur du segment acquitté.
+        if sequence_num not in self._in_flight:
+            return 0
+        length, delivered, delivered_at, sent_at = self._in_flight.pop(sequence_num)
+        self.bytes_in_flight -= length
+        now = time.monotonic()
+        self._delivered += length
+        self._delivered_at = now
+        if sent_at is None:
+            return length  # Règle de Karn
+        self.rtt.sample(now - sent_at)
+        if now > delivered_at:
+            rate = (self._delivered - delivered) / (now - delivered_at)
+            if self.delivery_rate is None:
+                self.delivery_rate = rate
+            else:
+                self.delivery_rate += RATE_GAIN * (rate - self.delivery_rate)
+        return length
+
+    def forget(self, sequence_num):
+        # Segment renvoyé sur un autre chemin
+        entry = self._in_flight.pop(sequence_num, None)
+        if entry is not None:
+            self.bytes_in_flight -= entry[0]
+
+    @property
+    def segments_in_flight(self):
+        return len(self._in_flight)
+
+    def unacknowledged(self):
+        return sorted(self._in_flight)
+
+    def summary(self):
+        rate = (
+            f"{self.delivery_rate / 1e6:.2f} MB/s"
+            if self.delivery_rate is not None
+            else "no rate sample"
+        )
+        return (
+            f"{self.label}: {self.segments_sent} segments ({self.bytes_sent} bytes), "
+            f"{rate}, {self.rtt.summary()}, {self.congestion.summary()}"
+            f"{'' if self.alive else ', lost'}"
+        )
+
+
+def choose_path(paths, length):
+    # Chemin qui livrerait le segment le plus tôt : la moitié de son RTT plus
+    # le temps d'écouler les octets déjà en vol et le segment (Earliest
+    # Completion First). Les segments se répartissent ainsi selon le débit
+    # et le RTT de chaque chemin. Un chemin pas encore mesuré est supposé
+    # aussi rapide que le meilleur ; sans aucune mesure, les octets en vol
+    # sont simplement équilibrés. Seuls les chemins dont la fenêtre de
+    # congestion a de la place sont candidats, s'il y en a.
+    if len(paths) == 1:
+        return paths[0]
+    paths = [
+        path for path in paths if path.segments_in_flight < path.congestion.size
+    ] or paths
+    default_rate = max(
+        (path.delivery_rate for path in paths if path.delivery_rate), default=None
+    )
+    if default_rate is None:
+        return min(paths, key=lambda path: path.bytes_in_flight)
+
+    def completion(path):
+        rate = path.delivery_rate or default_rate
+        return (path.rtt.srtt or 0) / 2 + (path.bytes_in_flight + length) / rate
+
+    return min(paths, key=completion)
@@ -0,0 +1,127 @@
+import fcntl
+import json
+import os
+import time
+
+# Longueur hexadécimale d'un hash SHA-256
+FILE_HASH_LENGTH = 64
+
+
+def valid_file_hash(file_hash):
+    # Le hash sert de nom de fichier : on n'accepte que de l'hexadécimal
+    return (
+        isinstance(file_hash, str)
+        and len(file_hash) == FILE_HASH_LENGTH
+        and all(c in "0123456789abcdef" for c in file_hash)
+    )
+
+
+class PartialUploadStore:
+    # Uploads interrompus conservés pour être repris, indexés par le hash du
+    # fichier : <hash>.part contient les octets déjà vérifiés et écrits,
+    # <hash>.json le nom du fichier et leur nombre. Une entrée expire quand
+    # ses métadonnées n'ont pas été mises à jour depuis ttl secondes.
+    # Les workers partagent le répertoire : l'upload qui écrit un fichier
+    # partiel le verrouille avec flock, et seul le détenteur du verrou modifie
+    # l'entrée (fichier et métadonnées).
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def part_path(self, file_hash):
+        return os.path.join(self.directory, f"{file_hash}.part")
+
+    def _metadata_path(self, file_hash):
+        return os.path.join(self.directory, f"{file_hash}.json")
+
+    def acquire(self, file_hash):
+        # Ouvre et verrouille le fichier partiel, sans le tronquer. None s'il
+        # est verrouillé par un upload en cours, dans ce worker ou un autre.
+        path = self.part_path(file_hash)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            # Le fichier a pu être livré ou supprimé entre l'ouverture et le
+            # verrou : le nom désigne alors un autre fichier, ou aucun
+            try:
+                if os.path.samestat(os.fstat(fd), os.stat(path)):
+                    return os.fdopen(fd, "r+b")
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def load(self, file_hash):
+        # Octets vérifiés d'un upload interrompu, 0 s'il n'y en a pas ou s'il
+        # a expiré. Appelé par le détenteur du verrou, qui réécrit l'entrée.
+        metadata_path = self._metadata_path(file_hash)
+        try:
+            expired = time.time() - os.path.getmtime(metadata_path) > self.ttl
+            with open(metadata_path) as metadata_file:
+                offset = json.load(metadata_file)["offset"]
+        except (OSError, ValueError, KeyError):
+            return 0
+        return 0 if expired else offset
+
+    def save(self, file_hash, file_name, offset):
+        # Écriture atomique : une coupure ne laisse jamais de métadonnées tronquées
+        metadata_path = self._metadata_path(file_hash)
+        with open(metadata_path + ".tmp", "w") as metadata_file:
+            json.dump({"file_name": file_name, "offset": offset}, metadata_file)
+        os.replace(metadata_path + ".tmp", metadata_path)
+
+    def remove(self, file_hash, keep_part=False):
+        # keep_part : le fichier partiel vient d'être renommé vers sa
+        # destination, seules les métadonnées restent à supprimer
+        paths = [self._metadata_path(file_hash)]
+        if not keep_part:
+            paths.append(self.part_path(file_hash))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_unused(self, file_hash):
+        # Supprime l'entrée sauf si un upload en cours, dans n'importe quel
+        # worker, détient le verrou. Le verrou est gardé pendant la suppression.
+        try:
+            fd = os.open(self.part_path(file_hash), os.O_RDONLY)
+        except FileNotFoundError:
+            self.remove(file_hash)  # Métadonnées seules
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        else:
+            self.remove(file_hash)
+            return True
+        finally:
+            os.close(fd)
+
+    def expire(self, active_hashes=()):
+        # Supprime les entrées expirées, sauf celles des uploads en cours
+        file_hashes = {
+            entry.split(".")[0]
+            for entry in os.listdir(self.directory)
+            if entry.endswith((".part", ".json"))
+        }
+        removed = 0
+        now = time.time()
+        for file_hash in file_hashes - set(active_hashes):
+            # Un fichier partiel sans métadonnées expire selon sa propre date
+            for path in (self._metadata_path(file_hash), self.part_path(file_hash)):
+                if os.path.exists(path):
+                    break
+            try:
+                expired = now - os.path.getmtime(path) > self.ttl
+            except OSError:
+                continue
+            if expired and self._remove_unused(file_hash):
+                removed += 1
+        return removed
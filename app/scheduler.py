@@ -0,0 +1,77 @@
+import math
+import threading
+import time
+
+
+class RetransmissionScheduler:
+    # Roue de timers hachée : armement et annulation en O(1) par numéro de
+    # séquence, et un seul thread pour traiter toutes les expirations d'un
+    # transfert.
+    def __init__(self, callback, tick=0.01, slots=512):
+        self._callback = callback
+        self._tick = tick
+        self._slots = [{} for _ in range(slots)]  # numéro de séquence -> tours restants
+        self._slot_of = {}  # numéro de séquence -> emplacement dans la roue
+        self._current_slot = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def arm(self, sequence_num, timeout):
+        ticks = max(1, math.ceil(timeout / self._tick))
+        with self._lock:
+            self._cancel(sequence_num)
+            slot = (self._current_slot + ticks) % len(self._slots)
+            self._slots[slot][sequence_num] = (ticks - 1) // len(self._slots)
+            self._slot_of[sequence_num] = slot
+            self._wakeup.notify()
+
+    def cancel(self, sequence_num):
+        with self._lock:
+            self._cancel(sequence_num)
+
+    def _cancel(self, sequence_num):
+        slot = self._slot_of.pop(sequence_num, None)
+        if slot is not None:
+            del self._slots[slot][sequence_num]
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self._lock:
+                # Aucun timer armé : le thread dort au lieu de faire tourner la roue
+                while self._running and not self._slot_of:
+                    self._wakeup.wait()
+                    next_tick = time.monotonic()
+                if not self._running:
+                    return
+
+            delay = next_tick + self._tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += self._tick
+
+            expired = []
+            with self._lock:
+                self._current_slot = (self._current_slot + 1) % len(self._slots)
+                slot = self._slots[self._current_slot]
+                for sequence_num, rounds in list(slot.items()):
+                    if rounds:
+                        slot[sequence_num] = rounds - 1
+                    else:
+                        del slot[sequence_num]
+                        del self._slot_of[sequence_num]
+                        expired.append(sequence_num)
+
+            # Les callbacks s'exécutent hors du verrou : ils peuvent réarmer
+            for sequence_num in expired:
+                self._callback(sequence_num)
@@ -1,22 +1,760 @@
+import asyncio
+import base64
 import hashlib
-import threading
+import multiprocessing
+import multiprocessing.connection
 import socket
+import time
 import os
+import shutil
+import signal
+import sys
 import zlib
-from message import Message
+from message import (
+    ARQ_GO_BACK_N,
+    ARQ_MODES,
+    ARQ_SELECTIVE_REPEAT,
+    MAX_PAYLOAD_SIZE,
+    FrameReader,
+    Message,
+    WIRE_FORMAT_BINARY,
+    WIRE_FORMAT_JSON,
+    negotiate_wire_format,
+    sack_ranges,
+)
 import random
 import argparse
+import tarfile
+import tempfile
+from blobs import BlobStore, FileHashCache
+from compression import (
+    CODEC_NONE,
+    DECOMPRESS_MAX_OUTPUT,
+    BlockDecoder,
+    compress_blocks,
+    file_looks_incompressible,
+    negotiate_codec,
+)
+from digests import DIGEST_SHA256, negotiate_digest, verify_digest
+from execution import ExecutionEngine, ExecutionError
+from metrics import THROUGHPUT_BUCKETS, Metrics
+from delta import (
+    DELTA_MIN_SIZE,
+    SIGNATURE,
+    DeltaDecoder,
+    block_size_for,
+    file_signatures,
+)
+from partials import PartialUploadStore, valid_file_hash
+from stripes import StripedUploadStore, valid_stripe
 
+# Éléments en attente entre deux étages du pipeline de réception
+PIPELINE_QUEUE_SIZE = 64
+# Octets décodés passés d'un coup à l'étage d'écriture
+DECODE_OUTPUT_SIZE = 256 * 1024
+# Segments gardés au plus dans le buffer de réordonnancement d'un upload,
+# quelle que soit la fenêtre demandée par le client
+MAX_REORDER_SEGMENTS = 1024
+# Contenu d'une trame DATA d'un download
+DOWNLOAD_FRAME_SIZE = MAX_PAYLOAD_SIZE
+# Intervalle entre deux sauvegardes de l'offset d'un upload qui peut être
+# repris, pour qu'un arrêt brutal du serveur ne le fasse pas repartir de zéro
+PARTIAL_SAVE_INTERVAL = 2.0
+# Intervalle maximal entre deux purges des uploads interrompus expirés
+PARTIAL_EXPIRY_INTERVAL = 3600
+# Format des archives de petits fichiers envoyées par le mode batch du client
+ARCHIVE_TAR = "tar"
+# Répertoires internes du serveur, jamais écrits par un upload
+PARTIALS_DIRECTORY = ".partial"
+BLOBS_DIRECTORY = ".blobs"
+STRIPES_DIRECTORY = ".stripes"
+RESERVED_DIRECTORIES = (PARTIALS_DIRECTORY, BLOBS_DIRECTORY, STRIPES_DIRECTORY)
 
-class ClientSession:
+
+def safe_relative_path(file_name):
+    # Garde l'arborescence relative envoyée par le client sans jamais sortir
+    # du répertoire des fichiers
+    parts = [
+        part
+        for part in file_name.replace("\\", "/").split("/")
+        if part not in ("", ".", "..")
+    ]
+    if parts and parts[0] in RESERVED_DIRECTORIES:
+        parts[0] = "_" + parts[0]
+    return os.path.join(*parts) if parts else "unnamed"
+
+
+def unpack_archive(archive_path, files_directory):
+    # Extrait une archive de petits fichiers puis la supprime ; le filtre
+    # "data" refuse les chemins absolus, les liens et les fichiers spéciaux.
+    # tarfile écrirait à travers un fichier existant, qui peut être un lien
+    # vers un blob : l'archive est extraite à part et chaque fichier extrait
+    # remplace ensuite l'ancien par un renommage.
+    extract_directory = tempfile.mkdtemp(dir=files_directory, prefix=".archive.")
+    try:
+        with tarfile.open(archive_path) as archive:
+            members = [
+                member
+                for member in archive.getmembers()
+                if safe_relative_path(member.name) == os.path.normpath(member.name)
+            ]
+            archive.extractall(extract_directory, members, filter="data")
+        file_names = set()
+        for member in members:
+            name = os.path.normpath(member.name)
+            if member.isdir():
+                os.makedirs(os.path.join(files_directory, name), exist_ok=True)
+            elif member.isfile():
+                file_names.add(name)
+        for name in file_names:
+            file_path = os.path.join(files_directory, name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(os.path.join(extract_directory, name), file_path)
+        return len(file_names)
+    finally:
+        shutil.rmtree(extract_directory, ignore_errors=True)
+        os.remove(archive_path)
+
+
+class FileReceiver:
+    # Décompresse, hache et écrit les segments vérifiés dans un fichier
+    # temporaire du répertoire de destination. Le fichier n'est renommé vers
+    # son nom final que si le hash correspond. decode et write ne partagent
+    # aucun état et peuvent s'exécuter en même temps dans deux threads.
+    # Avec un magasin de reprise et le hash du fichier, le fichier temporaire
+    # survit à une coupure et l'upload reprend après les octets déjà écrits.
+    # En mode delta, les données reçues sont des instructions qui copient des
+    # blocs de la version actuelle du fichier : le hachage se fait alors à
+    # l'écriture, seul étage à voir le fichier reconstruit dans l'ordre.
+    def __init__(
+        self,
+        files_directory,
+        file_name,
+        compressed,
+        file_size=None,
+        partials=None,
+        file_hash=None,
+        codec=None,
+    ):
+        os.makedirs(files_directory, exist_ok=True)
+        self.file_name = file_name
+        self.file_path = os.path.join(files_directory, file_name)
+        self._partials = partials if file_hash else None
+        self._file_hash = file_hash
+        self._hash = hashlib.sha256()
+        self.resume_offset = 0
+        # Temps passé à décompresser et à hacher, en secondes
+        self.decompress_time = 0.0
+        self.hash_time = 0.0
+
+        self._file = None
+        if self._partials is not None:
+            self._file = self._partials.acquire(file_hash)
+            if self._file is None:
+                # Le même fichier est en cours d'upload dans un autre worker ou
+                # une autre connexion : reçu en entier, sans reprise
+                print(f"[Server] Partial upload of {file_name} is in use, not resuming")
+                self._partials = None
+        if self._partials is None:
+            fd, self._temp_path = tempfile.mkstemp(
+                dir=files_directory,
+                prefix=f".{os.path.basename(file_name)}.",
+                suffix=".part",
+            )
+            self._file = os.fdopen(fd, "wb")
+        else:
+            self._temp_path = self._partials.part_path(file_hash)
+            self.resume_offset = self._partials.load(file_hash)
+            if self.resume_offset:
+                # L'état du hash ne se sérialise pas : on relit les octets déjà reçus
+                remaining = self.resume_offset
+                while remaining:
+                    chunk = self._file.read(min(remaining, DECOMPRESS_MAX_OUTPUT))
+                    if not chunk:
+                        break  # Fichier tronqué : la reprise commence plus tôt
+                    self._update_hash(chunk)
+                    remaining -= len(chunk)
+                self.resume_offset -= remaining
+                self._file.seek(self.resume_offset)
+            else:
+                self._file.truncate(0)
+                self._partials.save(file_hash, file_name, 0)
+
+        if file_size:
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, file_size)
+            except (AttributeError, OSError):
+                pass  # Préallocation non supportée par le système de fichiers
+        # Blocs compressés du codec négocié, ou flux zlib continu d'un client
+        # sans codecs ; chaque connexion envoie un flux indépendant
+        self._blocks = BlockDecoder(codec) if codec not in (None, CODEC_NONE) else None
+        self._decompressor = (
+            zlib.decompressobj() if compressed and codec is None else None
+        )
+        self._corrupted = False
+        self.bytes_written = self.resume_offset
+        self._saved_offset = self.resume_offset  # offset des métadonnées
+        self._saved_at = time.monotonic()
+        self._basis = None  # version actuelle du fichier, en mode delta
+        self._delta = None
+
+    def open_basis(self):
+        # Prend la version actuelle du fichier comme base d'un upload delta.
+        # Retourne la taille des blocs, ou None s'il n'y a pas de base utile.
+        try:
+            basis = open(self.file_path, "rb")
+        except OSError:
+            return None
+        size = os.fstat(basis.fileno()).st_size
+        if size < DELTA_MIN_SIZE:
+            basis.close()
+            return None
+        block_size = block_size_for(size)
+        if size // block_size * SIGNATURE.size > MAX_PAYLOAD_SIZE:
+            basis.close()
+            return None  # Signatures trop grandes pour une trame
+        # Le descripteur reste valide quand le fichier est remplacé au commit
+        self._basis = basis
+        self._delta = DeltaDecoder(block_size, size // block_size)
+        return block_size
+
+    def basis_signatures(self):
+        return file_signatures(self._basis, self._delta.block_size)
+
+    def drop_basis(self):
+        # Signatures impossibles à calculer : le client enverra le contenu brut
+        self._close_basis()
+        self._basis = None
+        self._delta = None
+
+    def decode(self, data):
+        # Décompresse et hache ; générateur des morceaux à écrire sur le
+        # disque, produits au fur et à mesure qu'ils sont demandés
+        return self._apply(self._decompress(data))
+
+    def _update_hash(self, chunk):
+        start = time.perf_counter()
+        self._hash.update(chunk)
+        self.hash_time += time.perf_counter() - start
+
+    def _decompress(self, data):
+        if self._corrupted:
+            return
+        if self._blocks is not None:
+            chunks = self._blocks.feed(data)
+        elif self._decompressor is not None:
+            chunks = self._inflate(data)
+        else:
+            chunks = [data]
+        start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                self.decompress_time += time.perf_counter() - start
+                yield chunk
+                if self._corrupted:
+                    return
+                start = time.perf_counter()
+        except (ValueError, zlib.error) as e:
+            # Flux corrompu : la suite est ignorée et l'EOF conclura à un échec
+            print(f"[FileTransmissionProtocol] Decompression error: {e}")
+            self._corrupted = True
+
+    def _inflate(self, data):
+        # Flux zlib continu, par morceaux d'au plus DECOMPRESS_MAX_OUTPUT octets
+        while data:
+            yield self._decompressor.decompress(data, DECOMPRESS_MAX_OUTPUT)
+            data = self._decompressor.unconsumed_tail
+
+    def _apply(self, chunks):
+        for chunk in chunks:
+            if self._delta is None:
+                self._update_hash(chunk)
+                yield chunk
+                continue
+            # Octets littéraux et plages (offset, longueur) de la base
+            try:
+                pieces = self._delta.feed(chunk)
+            except ValueError as e:
+                print(f"[FileTransmissionProtocol] Delta error: {e}")
+                self._corrupted = True
+                return
+            yield from pieces
+
+    def write(self, chunks):
+        if self._corrupted:
+            return
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, tuple):
+                    self._copy_from_basis(*chunk)
+                    continue
+                if self._delta is not None:
+                    self._update_hash(chunk)
+                self._file.write(chunk)
+                self.bytes_written += len(chunk)
+            if (
+                self._partials is not None
+                and self.bytes_written != self._saved_offset
+                and time.monotonic() - self._saved_at >= PARTIAL_SAVE_INTERVAL
+            ):
+                self._save_offset()
+        except OSError as e:
+            # Disque plein par exemple : l'EOF conclura à un échec
+            print(f"[FileTransmissionProtocol] Write error: {e}")
+            self._corrupted = True
+
+    def _copy_from_basis(self, offset, length):
+        while length:
+            chunk = os.pread(
+                self._basis.fileno(), min(length, DECOMPRESS_MAX_OUTPUT), offset
+            )
+            if not chunk:
+                raise OSError(f"Delta basis of {self.file_name} is truncated")
+            self._update_hash(chunk)
+            self._file.write(chunk)
+            self.bytes_written += len(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+
+    def commit(self, expected_hash):
+        try:
+            if self._decompressor is not None and not self._corrupted:
+                self.write(self._apply([self._decompressor.flush()]))
+        except zlib.error:
+            self._corrupted = True
+        if self._blocks is not None and not self._blocks.complete:
+            self._corrupted = True  # Flux coupé au milieu d'un bloc
+        if self._delta is not None and not self._delta.complete:
+            self._corrupted = True  # Flux delta coupé au milieu d'une instruction
+        self._close_basis()
+
+        if self._corrupted or self._hash.hexdigest() != expected_hash:
+            self.abort()
+            return False
+
+        # La préallocation a pu agrandir le fichier au-delà des données reçues
+        self._file.truncate(self.bytes_written)
+        self._file.flush()
+        os.fchmod(self._file.fileno(), 0o644)  # mkstemp crée le fichier en 0600
+        os.fsync(self._file.fileno())
+        # Fichier fermé, et verrou du fichier partiel relâché, en dernier :
+        # un autre worker ne peut pas reprendre un upload déjà livré
+        try:
+            if self._partials is not None:
+                self._partials.remove(self._file_hash, keep_part=True)
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            os.replace(self._temp_path, self.file_path)
+        finally:
+            self._file.close()
+        return True
+
+    def suspend(self):
+        # Connexion perdue : les octets écrits sont gardés pour une reprise.
+        # Retourne leur nombre.
+        if self._partials is None or self._corrupted:
+            self.abort()
+            return 0
+        self._close_basis()
+        self._save_offset()
+        self._file.close()
+        return self.bytes_written
+
+    def _save_offset(self):
+        # L'offset n'est sauvegardé qu'après le fsync des octets qu'il couvre :
+        # une reprise après un arrêt brutal ne compte que des octets écrits
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._partials.save(self._file_hash, self.file_name, self.bytes_written)
+        self._saved_offset = self.bytes_written
+        self._saved_at = time.monotonic()
+
+    def abort(self):
+        self._close_basis()
+        if self._partials is not None:
+            self._partials.remove(self._file_hash)
+        elif os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        self._file.close()
+
+    def _close_basis(self):
+        if self._basis is not None:
+            self._basis.close()
+
+
+class StripeReceiver:
+    # Reçoit une plage d'un upload découpé : les segments décompressés sont
+    # écrits à leur offset dans le fichier partagé par toutes les plages. Le
+    # hash du fichier n'est vérifié qu'à l'EOF de la dernière plage arrivée.
+    # Une plage interrompue est renvoyée depuis son début.
+    resume_offset = 0
+
+    def __init__(self, files_directory, file_name, file_size, stripes, stripe, codec):
+        self.file_name = file_name
+        self.file_path = os.path.join(files_directory, file_name)
+        self._stripes = stripes
+        self._transfer_id = stripe["id"]
+        self._index = stripe["index"]
+        self._count = stripe["count"]
+        self._offset = stripe["offset"]
+        self._length = stripe["length"]
+        self._fd = stripes.open(self._transfer_id, file_size)
+        self._blocks = BlockDecoder(codec) if codec not in (None, CODEC_NONE) else None
+        self._corrupted = False
+        self.bytes_written = 0
+        self.file_complete = False  # toutes les plages reçues, à l'EOF de celle-ci
+        self.decompress_time = 0.0
+        self.hash_time = 0.0  # relecture du fichier réassemblé, à la dernière plage
+
+    def decode(self, data):
+        if self._blocks is None:
+            return [data]
+        return self._decompress(data)
+
+    def _decompress(self, data):
+        if self._corrupted:
+            return
+        start = time.perf_counter()
+        try:
+            for chunk in self._blocks.feed(data):
+                self.decompress_time += time.perf_counter() - start
+                yield chunk
+                if self._corrupted:
+                    return
+                start = time.perf_counter()
+        except ValueError as e:
+            print(f"[FileTransmissionProtocol] Decompression error: {e}")
+            self._corrupted = True
+
+    def write(self, chunks):
+        if self._corrupted:
+            return
+        try:
+            for chunk in chunks:
+                if self.bytes_written + len(chunk) > self._length:
+                    raise OSError(f"Stripe {self._index} of {self.file_name} overflows")
+                os.pwrite(self._fd, chunk, self._offset + self.bytes_written)
+                self.bytes_written += len(chunk)
+        except OSError as e:
+            print(f"[FileTransmissionProtocol] Write error: {e}")
+            self._corrupted = True
+
+    def commit(self, expected_hash):
+        # True si la plage est complète ; file_complete indique si c'était la
+        # dernière, et le résultat porte alors sur le hash du fichier entier
+        os.close(self._fd)
+        if (
+            self._corrupted
+            or (self._blocks is not None and not self._blocks.complete)
+            or self.bytes_written != self._length
+        ):
+            # Le fichier ne pourra pas être complet : les autres plages échoueront
+            self._stripes.remove(self._transfer_id)
+            return False
+        if not self._stripes.finish(self._transfer_id, self._index, self._count):
+            return True
+        self.file_complete = True
+        start = time.perf_counter()
+        try:
+            return self._stripes.commit(self._transfer_id, expected_hash, self.file_path)
+        finally:
+            self.hash_time = time.perf_counter() - start
+
+    def suspend(self):
+        os.close(self._fd)
+        return 0
+
+    def abort(self):
+        os.close(self._fd)
+
+
+class ReceivePipeline:
+    # Étages de réception d'un upload reliés par des files bornées :
+    # vérification des segments, décompression et hachage, écriture disque.
+    # Chaque étage traite d'un coup tout ce qui attend dans sa file, dans un
+    # thread de l'executor. Quand un étage prend du retard, sa file se remplit
+    # et bloque l'étage précédent, jusqu'à la lecture du socket : le noyau
+    # réduit alors la fenêtre TCP et l'émetteur ralentit.
+    def __init__(
+        self,
+        receiver,
+        accept_segment,
+        digest=DIGEST_SHA256,
+        on_failure=None,
+        queue_size=PIPELINE_QUEUE_SIZE,
+        metrics=None,
+    ):
+        self.receiver = receiver
+        self._metrics = metrics
+        self.digest = digest  # empreinte négociée des segments
+        self._accept_segment = accept_segment  # ARQ et ACK d'un segment vérifié
+        self._verify_queue = asyncio.Queue(queue_size)
+        self._decode_queue = asyncio.Queue(queue_size)
+        self._write_queue = asyncio.Queue(queue_size)
+        # Ferme la session si un étage échoue ; par défaut, interrompt la
+        # tâche qui lit les segments
+        self._on_failure = on_failure or asyncio.current_task().cancel
+        self._draining = False
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._verify_stage()),
+            loop.create_task(self._decode_stage()),
+            loop.create_task(self._write_stage()),
+        ]
+        for task in self._tasks:
+            task.add_done_callback(self._on_stage_done)
+
+    async def submit(self, message):
+        await self._verify_queue.put(message)
+
+    async def deliver(self, data):
+        # Données contiguës, dans l'ordre du fichier
+        await self._decode_queue.put(data)
+
+    async def finish(self):
+        # Attend que tout ce qui a été soumis soit écrit ; False si un étage
+        # a échoué
+        await self._verify_queue.put(None)
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        return not any(isinstance(result, BaseException) for result in results)
+
+    async def drain(self):
+        # Connexion perdue : les segments pas encore vérifiés sont abandonnés,
+        # ceux déjà acceptés finissent d'être écrits
+        self._on_failure = None
+        self._draining = True
+        return await self.finish()
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _on_stage_done(self, task):
+        # Un étage arrêté bloquerait la session : on l'interrompt
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[FileTransmissionProtocol] Pipeline error: {task.exception()}")
+            self.cancel()
+            # Libère les coroutines bloquées sur une file pleine
+            for queue in (self._verify_queue, self._decode_queue, self._write_queue):
+                while not queue.empty():
+                    queue.get_nowait()
+            if self._on_failure is not None:
+                self._on_failure()
+
+    @staticmethod
+    async def _take(queue):
+        # Tout ce qui attend, pour amortir le passage par l'executor ; None
+        # marque la fin du flux
+        batch = [await queue.get()]
+        while batch[-1] is not None and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    @staticmethod
+    def _verify(digest, messages):
+        return [
+            verify_digest(digest, message.content, message.hash) for message in messages
+        ]
+
+    async def _verify_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._take(self._verify_queue)
+            messages = [message for message in batch if message is not None]
+            if messages and not self._draining:
+                valid = await loop.run_in_executor(
+                    None, self._verify, self.digest, messages
+                )
+                if self._metrics is not None and not all(valid):
+                    self._metrics.increment(
+                        "segments_corrupted_total", valid.count(False)
+                    )
+                for message, is_valid in zip(messages, valid):
+                    if is_valid and not self._draining:
+                        try:
+                            await self._accept_segment(message)
+                        except OSError:
+                            # ACK impossible : la connexion est perdue, les
+                            # segments déjà acceptés restent à écrire
+                            self._draining = True
+            if batch[-1] is None:
+                await self._decode_queue.put(None)
+                return
+
+    @staticmethod
+    def _next_output(chunks):
+        # Morceaux suivants du décodeur, jusqu'à DECODE_OUTPUT_SIZE octets
+        output = []
+        size = 0
+        for chunk in chunks:
+            output.append(chunk)
+            if not isinstance(chunk, tuple):  # plage de la base d'un delta
+                size += len(chunk)
+            if size >= DECODE_OUTPUT_SIZE:
+                break
+        return output
+
+    async def _decode_stage(self):
+        # La sortie du décodeur est tirée par lots bornés : des données très
+        # compressibles ne sont jamais décompressées en entier en mémoire, et
+        # la file d'écriture pleine suspend la décompression
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._take(self._decode_queue)
+            data = b"".join(segment for segment in batch if segment is not None)
+            if data:
+                chunks = iter(self.receiver.decode(data))
+                while True:
+                    output = await loop.run_in_executor(None, self._next_output, chunks)
+                    if not output:
+                        break
+                    await self._write_queue.put(output)
+            if batch[-1] is None:
+                await self._write_queue.put(None)
+                return
+
+    async def _write_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._take(self._write_queue)
+            chunks = [chunk for chunks in batch if chunks is not None for chunk in chunks]
+            if chunks:
+                await loop.run_in_executor(None, self.receiver.write, chunks)
+            if batch[-1] is None:
+                return
+
+
+class ClientConnection:
+    # Connexion d'un client. Les commandes y sont multiplexées : chaque trame
+    # porte un canal, et chaque canal a sa propre session.
     def __init__(self, client_socket):
         self.socket = client_socket
+        self.wire_format = WIRE_FORMAT_JSON
+        self.reader = FrameReader(client_socket)
+        self.sessions = {}  # canal -> ClientSession
+        self.send_lock = asyncio.Lock()
+        self.tasks = set()
+        self.task = asyncio.current_task()  # tâche qui lit la connexion
+
+    def session(self, channel):
+        if channel not in self.sessions:
+            self.sessions[channel] = ClientSession(self, channel)
+        return self.sessions[channel]
+
+    def release(self, session, channel=None):
+        # Commande terminée : le canal pourra être réutilisé par le client.
+        # Un ancien client envoie tout sur le canal 0, même pendant un upload.
+        channel = session.channel if channel is None else channel
+        if self.sessions.get(channel) is session and not session.is_uploading:
+            del self.sessions[channel]
+
+    async def send(self, message, wire_format=None):
+        # Plusieurs coroutines peuvent écrire (ACK retardés, autres canaux) :
+        # les trames ne doivent pas s'entrelacer
+        async with self.send_lock:
+            await asyncio.get_running_loop().sock_sendall(
+                self.socket, message.serialize(wire_format or self.wire_format)
+            )
+
+    async def send_file_range(self, header, file, offset, count):
+        # Trame binaire dont le contenu est lu directement dans le fichier :
+        # os.sendfile copie les octets du cache du système vers le socket sans
+        # passer par Python. La boucle se rabat sur read/send si le socket ne
+        # le permet pas.
+        async with self.send_lock:
+            loop = asyncio.get_running_loop()
+            await loop.sock_sendall(self.socket, header)
+            sent = await loop.sock_sendfile(self.socket, file, offset, count)
+            if sent != count:
+                # Fichier raccourci pendant l'envoi : la trame est incomplète
+                raise OSError(f"File truncated: {sent} of {count} bytes sent")
+
+    def spawn(self, coroutine):
+        # Garde une référence sur la tâche tant qu'elle s'exécute
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+class ClientSession:
+    # État d'un canal de la connexion : un upload ou une exécution
+    def __init__(self, connection, channel=0):
+        self.connection = connection
+        self.channel = channel
+        # Chemins (connexion, canal) de la session. Un upload multipath en a
+        # plusieurs, rejoints par JOIN avec son identifiant de transfert ;
+        # les réponses partent sur celui du dernier segment reçu.
+        self.paths = [(connection, channel)]
+        self.transfer_id = None
+        # Identifiant d'envoi du client, inchangé à ses reconnexions
+        self.upload_id = None
         self.is_uploading = False
-        self.file_data_buffer = bytearray()
+        self.committing = False  # EOF reçu, fichier en cours de validation
+        self.pipeline = None
         self.num_expected_acks = 0
         self.file_hash = None
         self.file_name = None
         self.file_compressed = None
+        self.codec = None  # None : flux zlib continu selon file_compressed
+        self.digest = DIGEST_SHA256  # empreinte des segments DATA
+        self.unpack = None  # format d'archive à extraire après réception
+        self.stripe = None  # plage reçue, pour un upload découpé
+        # Début de l'upload et octets des segments acceptés, pour son débit
+        self.started_at = None
+        self.bytes_received = 0
+        self.arq_mode = ARQ_GO_BACK_N
+        # Segments reçus en avance (Selective Repeat), bornés par la fenêtre
+        self.reorder_buffer = {}
+        self.reorder_limit = 1
+        # ACK cumulatifs retardés : envoyés tous les N segments ou après un délai
+        self.cumulative_acks = False
+        self.sack_ranges = False  # SACK en plages plutôt qu'en bitmap
+        self.ack_every = 1
+        self.unacked_segments = 0
+        self.ack_timer = None
+
+    @property
+    def wire_format(self):
+        # Le format de trame est commun à tous les canaux de la connexion
+        return self.connection.wire_format
+
+    @wire_format.setter
+    def wire_format(self, wire_format):
+        self.connection.wire_format = wire_format
+
+    async def send(self, message, wire_format=None):
+        # La réponse part sur le canal de la commande, ou sur un autre chemin
+        # si celui-ci vient d'être coupé
+        while True:
+            connection = self.connection
+            message.channel = self.channel
+            try:
+                return await connection.send(message, wire_format)
+            except OSError:
+                if not self.detach(connection):
+                    raise
+
+    def spawn(self, coroutine):
+        self.connection.spawn(coroutine)
+
+    def use_path(self, connection, channel):
+        if (connection, channel) in self.paths:
+            self.connection = connection
+            self.channel = channel
+
+    def join(self, connection, channel):
+        self.paths.append((connection, channel))
+        connection.sessions[channel] = self
+
+    def detach(self, connection):
+        # Connexion fermée ; True si la session continue sur un autre chemin
+        self.paths = [path for path in self.paths if path[0] is not connection]
+        if self.paths and self.connection is connection:
+            self.connection, self.channel = self.paths[0]
+        return bool(self.paths)
+
+    def close(self):
+        for connection, _ in self.paths:
+            connection.task.cancel()
 
 
 class Server:
@@ -28,6 +766,13 @@ class Server:
         files_directory,
         drop_test,
         drop_test_probability,
+        ack_every=4,
+        ack_delay=0.05,
+        workers=1,
+        partial_ttl=86400,
+        execute_workers=None,
+        execute_timeout=60.0,
+        metrics_port=None,
     ):
         self.host = host
         self.port = port
@@ -37,162 +782,975 @@ class Server:
         self.drop_test = drop_test
         self.drop_test_probability = drop_test_probability
 
-    def start(self):
-        server_blutooth_thread = threading.Thread(target=self._start_bluetooth)
-        server_wifi_thread = threading.Thread(target=self._start_wifi)
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+
+        self.partials = PartialUploadStore(
+            os.path.join(files_directory, PARTIALS_DIRECTORY), partial_ttl
+        )
+        self.blobs = BlobStore(os.path.join(files_directory, BLOBS_DIRECTORY))
+        self.stripes = StripedUploadStore(
+            os.path.join(files_directory, STRIPES_DIRECTORY), partial_ttl
+        )
+        # Uploads reprenables en cours, par hash de fichier
+        self._uploads = {}
+        # Uploads multipath en cours, par identifiant de transfert
+        self._transfers = {}
+        # Hash des fichiers servis (exécutions, downloads), propres à chaque worker
+        self.file_hashes = FileHashCache()
+        # Exécutions des fichiers reçus, propres à chaque worker
+        self.executions = ExecutionEngine(
+            execute_workers or os.cpu_count() or 1, execute_timeout, self.file_hashes
+        )
 
-        server_blutooth_thread.start()
-        server_wifi_thread.start()
+        self.workers = workers
+        # Socket d'écoute créé avant le fork quand SO_REUSEPORT n'existe pas
+        self._inherited_wifi_socket = None
+        self.worker = 0  # numéro du worker de ce processus
 
-    def _start_wifi(self):
+        # Compteurs et histogrammes, propres à chaque worker : lus par STATS,
+        # ou en HTTP au format Prometheus sur metrics_port + numéro du worker
+        self.metrics_port = metrics_port
+        self._connections = set()
+        self.metrics = Metrics()
+        self.metrics.gauge("connections", lambda: len(self._connections))
+        self.metrics.gauge("sessions_active", lambda: len(self._sessions()))
+        self.metrics.gauge(
+            "uploads_active",
+            lambda: sum(session.is_uploading for session in self._sessions()),
+        )
+        self.metrics.gauge("buffer_bytes", self._buffer_bytes)
+
+    def _sessions(self):
+        return {
+            session
+            for connection in self._connections
+            for session in connection.sessions.values()
+        }
+
+    def _buffer_bytes(self):
+        # Mémoire des buffers de réception : lecture des trames et segments
+        # reçus en avance
+        readers = sum(connection.reader.buffer_size for connection in self._connections)
+        return readers + sum(
+            len(segment)
+            for session in self._sessions()
+            for segment in session.reorder_buffer.values()
+        )
+
+    def start(self):
+        if self.workers > 1:
+            self._supervise()
+        else:
+            asyncio.run(self.serve())
+
+    async def serve(self, bluetooth=True, worker=0):
+        # Une seule boucle d'événements pour les deux écoutes et toutes les sessions
+        self.worker = worker
+        expiry = asyncio.get_running_loop().create_task(self._collect_garbage())
+        listeners = [self._serve_wifi()]
+        if bluetooth:
+            listeners.append(self._serve_bluetooth())
+        if self.metrics_port is not None:
+            listeners.append(self._serve_metrics(self.metrics_port + worker))
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-                server_socket.bind((self.host, self.port))
-                server_socket.listen()
-                print(f"[Server WIFI] Server listening on {self.host}:{self.port}")
+            await asyncio.gather(*listeners)
+        finally:
+            expiry.cancel()
 
-                while True:
-                    client_socket, address = server_socket.accept()
-                    print(f"[Server WIFI] Connection from {address}")
-                    client_thread = threading.Thread(
-                        target=self._handle_client, args=(ClientSession(client_socket),)
+    async def _collect_garbage(self):
+        # Purge des uploads interrompus ou découpés expirés et des blobs sans
+        # référence
+        loop = asyncio.get_running_loop()
+        while True:
+            removed = await loop.run_in_executor(
+                None, self.partials.expire, set(self._uploads)
+            )
+            if removed:
+                print(f"[Server] Removed {removed} expired partial uploads")
+            removed = await loop.run_in_executor(None, self.stripes.expire)
+            if removed:
+                print(f"[Server] Removed {removed} expired striped uploads")
+            removed = await loop.run_in_executor(None, self.blobs.collect)
+            if removed:
+                print(f"[Server] Removed {removed} unreferenced blobs")
+            await asyncio.sleep(min(self.partials.ttl, PARTIAL_EXPIRY_INTERVAL))
+
+    # ---------------------------- Workers -------------------------------------
+
+    def _supervise(self):
+        # Chaque worker a sa propre boucle asyncio et partage le port Wi-Fi
+        # (SO_REUSEPORT, ou socket hérité du superviseur). Le RFCOMM ne peut pas
+        # être partagé : seul le worker 0 écoute en Bluetooth.
+        if not hasattr(socket, "SO_REUSEPORT"):
+            self._inherited_wifi_socket = self._bind_wifi()
+
+        context = multiprocessing.get_context("fork")
+        processes = {}
+        started_at = {}
+
+        def start_worker(index):
+            process = context.Process(
+                target=self._run_worker, args=(index,), name=f"server-worker-{index}"
+            )
+            process.start()
+            processes[process.sentinel] = (index, process)
+            started_at[index] = time.monotonic()
+
+        # SIGTERM passe par le bloc finally pour ne pas laisser de workers orphelins
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        for index in range(self.workers):
+            start_worker(index)
+        print(f"[Server] Supervising {self.workers} workers")
+
+        try:
+            while True:
+                for sentinel in multiprocessing.connection.wait(list(processes)):
+                    index, process = processes.pop(sentinel)
+                    process.join()
+                    print(
+                        f"[Server] Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting"
                     )
-                    client_thread.start()
+                    # Un worker qui plante dès son démarrage ne doit pas boucler
+                    if time.monotonic() - started_at[index] < 1:
+                        time.sleep(1)
+                    start_worker(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for _, process in processes.values():
+                process.terminate()
+            for _, process in processes.values():
+                process.join()
+
+    def _run_worker(self, index):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            asyncio.run(self.serve(bluetooth=index == 0, worker=index))
+        except KeyboardInterrupt:
+            pass
+
+    def _bind_wifi(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers > 1 and hasattr(socket, "SO_REUSEPORT"):
+            # Le noyau répartit les connexions entre les workers
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((self.host, self.port))
+        return server_socket
+
+    # ---------------------------- Listeners -----------------------------------
+
+    async def _serve_wifi(self):
+        try:
+            server_socket = self._inherited_wifi_socket or self._bind_wifi()
         except Exception as e:
             print(f"[Server WIFI] Wi-Fi error: {e}")
-            exit(1)
+            return
+        print(f"[Server WIFI] Server listening on {self.host}:{self.port}")
+        await self._accept_clients(server_socket, "[Server WIFI]")
 
-    def _start_bluetooth(self):
+    async def _serve_bluetooth(self):
         try:
-            with socket.socket(
+            server_socket = socket.socket(
                 socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM
-            ) as bluetooth_socket:
-                bluetooth_socket.bind((self.mac_address, 1))
-                bluetooth_socket.listen()
-                print(f"[Server BLUETOOTH] Server listening on {self.mac_address}:1")
-
-                while True:
-                    client_socket, address = bluetooth_socket.accept()
-                    print(f"[Server BLUETOOTH] Connection from {address}")
-                    client_thread = threading.Thread(
-                        target=self._handle_client, args=(ClientSession(client_socket),)
-                    )
-                    client_thread.start()
+            )
+            server_socket.bind((self.mac_address, 1))
         except Exception as e:
             print(f"[Server BLUETOOTH] Bluetooth error: {e}")
-            exit(1)
+            return
+        print(f"[Server BLUETOOTH] Server listening on {self.mac_address}:1")
+        await self._accept_clients(server_socket, "[Server BLUETOOTH]")
+
+    async def _serve_metrics(self, port):
+        # Point d'accès HTTP minimal, en local seulement : GET /metrics
+        try:
+            server = await asyncio.start_server(self._handle_metrics, "127.0.0.1", port)
+        except OSError as e:
+            print(f"[Server METRICS] Metrics error: {e}")
+            return
+        print(f"[Server METRICS] Prometheus metrics on http://127.0.0.1:{port}/metrics")
+        async with server:
+            await server.serve_forever()
 
-    def _handle_client(self, session):
-        buffer = b""
+    async def _handle_metrics(self, reader, writer):
         try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # En-têtes ignorés
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                status = "200 OK"
+                body = self.metrics.prometheus("network_server").encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (OSError, ValueError):
+            pass  # Requête trop longue ou client parti
+        finally:
+            writer.close()
+
+    async def _accept_clients(self, server_socket, label):
+        loop = asyncio.get_running_loop()
+        sessions = set()
+        with server_socket:
+            server_socket.listen(socket.SOMAXCONN)
+            server_socket.setblocking(False)
             while True:
-                data = session.socket.recv(2048)
-                if not data:
-                    break  # Connexion fermée par le client
-                buffer += data
-
-                while len(buffer) >= 4:
-                    # Longueur du message attendu
-                    message_length = int.from_bytes(buffer[:4], byteorder="big")
-                    if len(buffer) - 4 >= message_length:
-                        # Message complet reçu
-                        message_data = buffer[4 : 4 + message_length]
-                        buffer = buffer[4 + message_length :]
-
-                        message = Message.deserialize(message_data)
-                        self._process_message(message, session)
-                    else:
-                        break  # Attend plus de données
+                try:
+                    client_socket, address = await loop.sock_accept(server_socket)
+                except OSError as e:
+                    # Trop de descripteurs ouverts par exemple : on réessaie
+                    print(f"{label} Accept error: {e}")
+                    await asyncio.sleep(0.1)
+                    continue
+                print(f"{label} Connection from {address}")
+                client_socket.setblocking(False)
+                if client_socket.family != getattr(socket, "AF_BLUETOOTH", None):
+                    # Sans Nagle : une petite réponse qui suit une autre (ACK,
+                    # sorties d'une exécution) n'attend pas l'ACK TCP retardé
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                task = loop.create_task(self._handle_client(client_socket))
+                sessions.add(task)
+                task.add_done_callback(sessions.discard)
+
+    async def _handle_client(self, client_socket):
+        loop = asyncio.get_running_loop()
+        connection = ClientConnection(client_socket)
+        self._connections.add(connection)
+        try:
+            # L'itération s'arrête quand la connexion est fermée par le client
+            async for frame in connection.reader.frames(loop):
+                message = Message.deserialize(frame)
+                session = connection.session(message.channel)
+                if session.connection is not connection:
+                    # Upload multipath : on répond par le chemin du dernier segment
+                    session.use_path(connection, message.channel)
+                await self._process_message(message, session)
         except Exception as e:
             print(f"[Server Client] Error: {e}")
         finally:
             print("[Server Client] Client disconnected")
-            session.socket.close()
+            # Un upload multipath continue sur ses autres chemins
+            sessions = [
+                session
+                for session in set(connection.sessions.values())
+                if not session.detach(connection)
+            ]
+            for session in sessions:
+                self._cancel_ack_timer(session)
+            for task in list(connection.tasks):
+                task.cancel()
+            connection.socket.close()
+            try:
+                for session in sessions:
+                    if session.is_uploading:
+                        await self._suspend_upload(session)
+            finally:
+                for session in sessions:
+                    self._end_upload(session)
+                self._connections.discard(connection)
 
-    def _process_message(self, message, session):
+    async def _process_message(self, message, session):
         if message.type == "UPLOAD" and not session.is_uploading:
-            self._handle_upload(session, message)
+            await self._handle_upload(session, message)
         elif message.type == "DATA" and session.is_uploading:
-            self._handle_data(message, session)
+            await self._handle_data(message, session)
         elif message.type == "EOF" and session.is_uploading:
-            self._handle_eof(message, session)
+            await self._handle_eof(message, session)
         elif message.type == "EXECUTE":
-            self._handle_execute(message, session)
+            # L'exécution peut durer : la lecture des autres canaux continue
+            session.spawn(self._handle_execute(message, session))
+        elif message.type == "DOWNLOAD":
+            session.spawn(self._handle_download(message, session))
+        elif message.type == "JOIN":
+            await self._handle_join(message, session)
+        elif message.type == "HELLO":
+            await self._handle_hello(message, session)
+        elif message.type == "STATS":
+            await self._handle_stats(message, session)
+        elif message.type == "PING":
+            await session.send(Message("PONG", message.sequence_num))
+            session.connection.release(session)
         else:
             print(f"[Server Client] Invalid message type: {message.type}")
 
+    async def _handle_hello(self, message, session):
+        # Ouverture d'une connexion persistante : le format de trame est
+        # négocié une fois pour tous les canaux
+        session.wire_format = negotiate_wire_format(message.content.get("wire_formats"))
+        await session.send(
+            Message(
+                "HELLO_ACK",
+                content={"wire_format": session.wire_format, "channels": True},
+            ),
+            WIRE_FORMAT_JSON,
+        )
+        session.connection.release(session)
+
+    async def _handle_stats(self, message, session):
+        # Métriques du worker et uploads en cours avec leur débit
+        now = time.monotonic()
+        stats = self.metrics.snapshot()
+        stats["worker"] = self.worker
+        stats["uploads"] = [
+            {
+                "file_name": upload.file_name,
+                "bytes_received": upload.bytes_received,
+                "seconds": now - upload.started_at,
+                "throughput": upload.bytes_received / max(now - upload.started_at, 1e-9),
+                "paths": len(upload.paths),
+            }
+            for upload in self._sessions()
+            if upload.is_uploading
+        ]
+        await session.send(Message("STATS_RESULT", message.sequence_num, stats))
+        session.connection.release(session)
+
     # ---------------------------- FileTransmissionProtocol --------------------
 
-    def _handle_upload(self, session, message):
-        session.is_uploading = True
-        session.file_data_buffer.clear()
+    async def _handle_upload(self, session, message):
+        loop = asyncio.get_running_loop()
         session.num_expected_acks = 0
-        session.file_name = message.content["file_name"]
-        session.file_hash = message.content["file_hash"]
+        session.file_name = safe_relative_path(message.content["file_name"])
+        session.file_hash = message.content.get("file_hash")
         session.file_compressed = message.content["file_compressed"]
+        session.codec = (
+            negotiate_codec(message.content["codecs"])
+            if "codecs" in message.content
+            else None
+        )
+        # Sans proposition, l'ancien client hache chaque segment en SHA-256
+        session.digest = negotiate_digest(message.content.get("digests", [DIGEST_SHA256]))
+        session.unpack = message.content.get("unpack")
+        # Plage d'un upload découpé, envoyée sur sa propre connexion
+        session.stripe = message.content.get("stripe")
+        if session.stripe is not None and not valid_stripe(
+            session.stripe, message.content.get("file_size")
+        ):
+            print(f"[FileTransmissionProtocol] Invalid stripe: {session.stripe}")
+            session.connection.release(session)
+            return
+
+        # Contenu déjà présent : le fichier devient une référence vers son blob
+        # et le client n'envoie aucune donnée. Seuls les clients qui annoncent
+        # "dedup" savent sauter l'envoi.
+        if (
+            message.content.get("dedup")
+            and session.unpack is None
+            and session.stripe is None
+            and await loop.run_in_executor(None, self._link_blob, session)
+        ):
+            session.wire_format = negotiate_wire_format(message.content.get("wire_formats"))
+            await session.send(
+                Message(
+                    "UPLOAD_ACK",
+                    content={"wire_format": session.wire_format, "stored": True},
+                ),
+                WIRE_FORMAT_JSON,
+            )
+            print(
+                f"[FileTransmissionProtocol] {session.file_name} already stored, nothing to receive"
+            )
+            self.metrics.increment("uploads_deduplicated_total")
+            session.connection.release(session)
+            return
 
-        print(f"[FileTransmissionProtocol] Receiving file: {session.file_name}")
+        # Seul un upload dont le hash est connu d'avance peut être repris
+        resumable = (
+            bool(message.content.get("resume"))
+            and session.stripe is None
+            and valid_file_hash(session.file_hash)
+        )
+        session.upload_id = message.content.get("upload_id")
+        if resumable:
+            previous = self._uploads.get(session.file_hash)
+            if previous is not None and (
+                not session.upload_id
+                or previous.upload_id != session.upload_id
+                or not previous.is_uploading
+                or previous.committing
+            ):
+                # Même fichier envoyé en parallèle, par ce client ou un autre
+                resumable = False
+            elif previous is not None:
+                # Le même envoi, après une reconnexion du client que le serveur
+                # n'a pas encore détectée
+                await self._take_over_upload(previous)
+        if resumable:
+            self._uploads[session.file_hash] = session
+
+        # Création (ou réouverture) et préallocation du fichier temporaire
+        # hors de la boucle
+        if session.stripe is not None:
+            receiver = await loop.run_in_executor(
+                None,
+                StripeReceiver,
+                self.FILES_DIRECTORY,
+                session.file_name,
+                message.content["file_size"],
+                self.stripes,
+                session.stripe,
+                session.codec,
+            )
+        else:
+            receiver = await loop.run_in_executor(
+                None,
+                FileReceiver,
+                self.FILES_DIRECTORY,
+                session.file_name,
+                session.file_compressed,
+                message.content.get("file_size"),
+                self.partials if resumable else None,
+                session.file_hash,
+                session.codec,
+            )
+        # Upload delta contre la version actuelle du fichier ; une reprise
+        # continue toujours avec le contenu brut
+        delta_block_size = None
+        if (
+            message.content.get("delta")
+            and session.unpack is None
+            and session.stripe is None
+            and not receiver.resume_offset
+        ):
+            delta_block_size = await loop.run_in_executor(None, receiver.open_basis)
+        session.pipeline = ReceivePipeline(
+            receiver,
+            lambda segment: self._accept_segment(segment, session),
+            session.digest,
+            session.close,
+            metrics=self.metrics,
+        )
+        session.is_uploading = True
+        session.started_at = time.monotonic()
+        session.bytes_received = 0
+        self.metrics.increment("uploads_started_total")
+        # Les autres chemins d'un upload multipath le rejoignent avec son
+        # identifiant, impossible à deviner
+        session.transfer_id = message.content.get("transfer_id")
+        if session.transfer_id:
+            self._transfers[session.transfer_id] = session
 
-    def _handle_data(self, message, session):
-        if message.sequence_num != session.num_expected_acks:
+        # Négociation du format de trame ; la réponse est toujours en JSON
+        # pour que les anciens clients puissent l'ignorer
+        session.wire_format = negotiate_wire_format(message.content.get("wire_formats"))
+        session.arq_mode = message.content.get("arq", ARQ_GO_BACK_N)
+        if session.arq_mode not in ARQ_MODES:
+            session.arq_mode = ARQ_GO_BACK_N
+        session.reorder_buffer.clear()
+        session.reorder_limit = min(
+            max(1, message.content.get("window_size", 1)), MAX_REORDER_SEGMENTS
+        )
+        session.cumulative_acks = bool(message.content.get("cumulative_ack"))
+        session.sack_ranges = bool(message.content.get("sack_ranges"))
+        # Au moins deux ACK par fenêtre pour que l'émetteur ne s'arrête pas
+        # en attendant le délai
+        session.ack_every = min(self.ack_every, max(1, session.reorder_limit // 2))
+        session.unacked_segments = 0
+        await session.send(
+            Message(
+                "UPLOAD_ACK",
+                content={
+                    "wire_format": session.wire_format,
+                    "arq": session.arq_mode,
+                    "cumulative_ack": session.cumulative_acks,
+                    # Délai maximal d'un ACK retardé, ajouté au RTO du client
+                    "ack_delay": self.ack_delay if session.cumulative_acks else 0.0,
+                    # Fenêtre accordée : au plus MAX_REORDER_SEGMENTS
+                    "window_size": session.reorder_limit,
+                    "resume_offset": receiver.resume_offset,
+                    "delta": delta_block_size is not None,
+                    "codec": session.codec,
+                    "digest": session.digest,
+                    "multipath": bool(session.transfer_id),
+                    "stripe": session.stripe is not None,
+                },
+            ),
+            WIRE_FORMAT_JSON,
+        )
+        if delta_block_size is not None:
+            # Les signatures d'un gros fichier prennent du temps : la lecture
+            # des autres canaux continue pendant leur calcul
+            session.spawn(self._send_signatures(session, delta_block_size))
+
+        print(
+            f"[FileTransmissionProtocol] Receiving file: {session.file_name} ({session.wire_format}, {session.arq_mode}, codec {session.codec}, digest {session.digest})"
+        )
+        if receiver.resume_offset:
+            print(
+                f"[FileTransmissionProtocol] Resuming {session.file_name} at byte {receiver.resume_offset}"
+            )
+        if session.stripe is not None:
+            print(
+                f"[FileTransmissionProtocol] Stripe {session.stripe['index'] + 1}/{session.stripe['count']} "
+                f"of {session.file_name}: {session.stripe['length']} bytes at offset {session.stripe['offset']}"
+            )
+
+    async def _send_signatures(self, session, block_size):
+        receiver = session.pipeline.receiver
+        try:
+            signatures = await asyncio.get_running_loop().run_in_executor(
+                None, receiver.basis_signatures
+            )
+        except (OSError, ValueError) as e:
+            # Base illisible ou fermée : le client n'attend pas indéfiniment
+            # et envoie le fichier en entier
+            print(
+                f"[FileTransmissionProtocol] Cannot compute block signatures for {session.file_name}: {e}"
+            )
+            receiver.drop_basis()
+            await session.send(
+                Message("SIGNATURES", content={"error": str(e)}), WIRE_FORMAT_JSON
+            )
             return
+        await session.send(
+            Message(
+                "SIGNATURES",
+                content={
+                    "block_size": block_size,
+                    "signatures": base64.b64encode(signatures).decode("ascii"),
+                },
+            ),
+            WIRE_FORMAT_JSON,
+        )
+        print(
+            f"[FileTransmissionProtocol] Sent {len(signatures)} bytes of block signatures for {session.file_name}"
+        )
+
+    async def _handle_join(self, message, session):
+        # Chemin supplémentaire d'un upload multipath, depuis une autre
+        # connexion du même client : ses segments alimentent la session de
+        # l'upload. Avec plusieurs workers, les deux connexions peuvent
+        # arriver dans des processus différents et le JOIN est alors refusé.
+        transfer = self._transfers.get(message.content.get("transfer_id"))
+        joined = (
+            transfer is not None
+            and transfer.is_uploading
+            and all(connection is not session.connection for connection, _ in transfer.paths)
+        )
+        await session.send(Message("JOIN_ACK", content={"joined": joined}), WIRE_FORMAT_JSON)
+        if joined:
+            transfer.join(session.connection, session.channel)
+            print(
+                f"[FileTransmissionProtocol] {transfer.file_name} now received over {len(transfer.paths)} paths"
+            )
+        else:
+            session.connection.release(session)
+
+    def _link_blob(self, session):
+        return self.blobs.has(session.file_hash) and self.blobs.link(
+            session.file_hash,
+            os.path.join(self.FILES_DIRECTORY, session.file_name),
+        )
 
+    async def _suspend_upload(self, session):
+        # Les segments déjà acceptés sont écrits avant de conserver le fichier
+        # partiel ; un pipeline en échec ne laisse rien de réutilisable
+        loop = asyncio.get_running_loop()
+        self._cancel_ack_timer(session)
+        receiver = session.pipeline.receiver
+        self.metrics.increment("uploads_interrupted_total")
+        if await session.pipeline.drain():
+            offset = await loop.run_in_executor(None, receiver.suspend)
+            if offset:
+                print(
+                    f"[FileTransmissionProtocol] Upload of {session.file_name} suspended at byte {offset}"
+                )
+        else:
+            await loop.run_in_executor(None, receiver.abort)
+
+    async def _take_over_upload(self, session):
+        # Seul l'upload de l'ancienne session est suspendu : les autres canaux
+        # de sa connexion continuent, et ses segments sont désormais ignorés
+        session.is_uploading = False
+        try:
+            await self._suspend_upload(session)
+        finally:
+            self._end_upload(session)
+
+    def _end_upload(self, session):
+        session.is_uploading = False
+        if self._uploads.get(session.file_hash) is session:
+            del self._uploads[session.file_hash]
+        if self._transfers.get(session.transfer_id) is session:
+            del self._transfers[session.transfer_id]
+        for connection, channel in session.paths:
+            connection.release(session, channel)
+
+    async def _handle_data(self, message, session):
+        self.metrics.increment("segments_received_total")
         if self.drop_test and random.random() < self.drop_test_probability:
             print(f"[FileTransmissionProtocol] Dropped packet {message.sequence_num}.")
+            self.metrics.increment("segments_dropped_total")
             return
+        # La boucle de lecture ne fait que découper les trames : la suite se
+        # déroule dans les étages du pipeline
+        await session.pipeline.submit(message)
 
-        if message.hash == hashlib.sha256(message.content).hexdigest():
-            session.file_data_buffer.extend(message.content)
+    async def _accept_segment(self, message, session):
+        # Segment dont le hash a été vérifié par le pipeline
+        selective_repeat = session.arq_mode == ARQ_SELECTIVE_REPEAT
+        if message.sequence_num < session.num_expected_acks:
+            # Doublon dont l'ACK a été perdu : on acquitte à nouveau
+            self.metrics.increment("segments_duplicate_total")
+            if session.cumulative_acks:
+                await self._flush_ack(session)
+                return
+            await self._send_ack(
+                session,
+                message.sequence_num
+                if selective_repeat
+                else session.num_expected_acks - 1,
+            )
+            return
+        if message.sequence_num != session.num_expected_acks and (
+            not selective_repeat
+            or message.sequence_num
+            >= session.num_expected_acks + session.reorder_limit
+        ):
+            return
+
+        if message.sequence_num not in session.reorder_buffer:
+            session.bytes_received += len(message.content)
+            self.metrics.increment("bytes_received_total", len(message.content))
+        if message.sequence_num == session.num_expected_acks:
+            # Les segments déjà reçus en avance deviennent contigus
+            segments = [message.content]
             session.num_expected_acks += 1
-            Message("ACK", message.sequence_num).send(session.socket)
-            print(f"[FileTransmissionProtocol] ACK {message.sequence_num}.")
-
-    def _handle_eof(self, message, session):
-        if session.file_compressed:
-            print("[FileTransmissionProtocol] Decompressing file.")
-            session.file_data_buffer = zlib.decompress(session.file_data_buffer)
-
-        received_file_hash = hashlib.sha256(session.file_data_buffer).hexdigest()
-
-        if received_file_hash == session.file_hash:
-            if not os.path.exists(self.FILES_DIRECTORY):
-                os.makedirs(self.FILES_DIRECTORY)
-            file_path = os.path.join(self.FILES_DIRECTORY, session.file_name)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            with open(file_path, "wb") as file:
-                file.write(session.file_data_buffer)
+            while session.num_expected_acks in session.reorder_buffer:
+                segments.append(session.reorder_buffer.pop(session.num_expected_acks))
+                session.num_expected_acks += 1
+            await session.pipeline.deliver(b"".join(segments))
+        else:
+            session.reorder_buffer[message.sequence_num] = message.content
+
+        if not session.cumulative_acks:
+            await self._send_ack(session, message.sequence_num)
+            return
+        session.unacked_segments += 1
+        if session.unacked_segments >= session.ack_every:
+            await self._flush_ack(session)
+        elif session.ack_timer is None:
+            session.ack_timer = asyncio.get_running_loop().call_later(
+                self.ack_delay, self._on_ack_timer, session
+            )
+
+    async def _send_ack(self, session, sequence_num):
+        await session.send(Message("ACK", sequence_num))
+        self.metrics.increment("acks_sent_total")
+        print(f"[FileTransmissionProtocol] ACK {sequence_num}.")
+
+    async def _flush_ack(self, session):
+        # ACK cumulatif : sequence_num est le prochain segment attendu, la SACK
+        # indique les segments reçus au-delà, en plages [début, fin[ pour les
+        # clients qui les annoncent. Les autres reçoivent un bitmap (bit i pour
+        # sequence_num + 1 + i), borné par MAX_REORDER_SEGMENTS.
+        self._cancel_ack_timer(session)
+        session.unacked_segments = 0
+        next_expected = session.num_expected_acks
+        if session.sack_ranges:
+            sack = sack_ranges(session.reorder_buffer)
+            content = {"sack_ranges": sack} if sack else None
+            shown = sack
+        else:
+            sack = 0
+            for sequence_num in session.reorder_buffer:
+                sack |= 1 << (sequence_num - next_expected - 1)
+            content = {"sack": sack} if sack else None
+            shown = f"{sack:b}"
+        await session.send(Message("ACK", next_expected, content))
+        self.metrics.increment("acks_sent_total")
+        print(f"[FileTransmissionProtocol] ACK up to {next_expected} (SACK {shown}).")
+
+    def _on_ack_timer(self, session):
+        session.ack_timer = None
+        session.spawn(self._flush_ack(session))
+
+    def _cancel_ack_timer(self, session):
+        if session.ack_timer is not None:
+            session.ack_timer.cancel()
+            session.ack_timer = None
+
+    async def _handle_eof(self, message, session):
+        # Le client calcule le hash pendant l'envoi et le transmet avec l'EOF
+        if message.content and message.content.get("file_hash"):
+            session.file_hash = message.content["file_hash"]
+        if not await session.pipeline.finish() or not session.is_uploading:
+            return  # Session fermée, ou upload repris sur une autre connexion
+        session.committing = True
+        self._cancel_ack_timer(session)
+
+        # fsync et renommage dans l'executor
+        loop = asyncio.get_running_loop()
+        receiver = session.pipeline.receiver
+        committed = await loop.run_in_executor(None, receiver.commit, session.file_hash)
+        error = None if committed else "Hash mismatch."
+        elapsed = time.monotonic() - session.started_at
+        self.metrics.observe("upload_decompress_seconds", receiver.decompress_time)
+        self.metrics.observe("upload_hash_seconds", receiver.hash_time)
+        # Plage d'un upload découpé : le hash n'est vérifié qu'à l'EOF de la
+        # dernière arrivée, les autres sont seulement acquittées
+        pending = session.stripe is not None and not receiver.file_complete
+        if pending:
+            error = None if committed else "Incomplete stripe."
+        elif committed and session.unpack == ARCHIVE_TAR:
+            # Archive de petits fichiers du mode batch
+            try:
+                files = await loop.run_in_executor(
+                    None, unpack_archive, receiver.file_path, self.FILES_DIRECTORY
+                )
+                print(f"[FileTransmissionProtocol] Unpacked {files} files.")
+            except (OSError, tarfile.TarError) as e:
+                error = f"Archive error: {e}"
+        elif committed:
+            # Le contenu rejoint le magasin, ou remplace le fichier par une
+            # référence s'il y était déjà
+            await loop.run_in_executor(
+                None, self.blobs.add, session.file_hash, receiver.file_path
+            )
+
+        if error is None:
+            self.metrics.increment("uploads_completed_total")
+            self.metrics.observe("upload_seconds", elapsed)
+            self.metrics.observe(
+                "upload_throughput_bytes_per_second",
+                session.bytes_received / max(elapsed, 1e-9),
+                THROUGHPUT_BUCKETS,
+            )
+        else:
+            self.metrics.increment("uploads_failed_total")
+        if error is None and pending:
+            print(
+                f"[FileTransmissionProtocol] EOF_ACK Stripe {session.stripe['index'] + 1}/{session.stripe['count']} received."
+            )
+            await session.send(
+                Message("EOF_ACK", message.sequence_num, {"stripes_pending": True})
+            )
+        elif error is None:
             print(
                 "[FileTransmissionProtocol] EOF_ACK File transfer complete with hash verification."
             )
-            Message("EOF_ACK", message.sequence_num).send(session.socket)
+            await session.send(Message("EOF_ACK", message.sequence_num))
         else:
-            print("[FileTransmissionProtocol] EOF_NACK Hash mismatch.")
-            Message(
-                "EOF_NACK", message.sequence_num, "EOF received. Hash mismatch."
-            ).send(session.socket)
+            print(f"[FileTransmissionProtocol] EOF_NACK {error}")
+            await session.send(
+                Message("EOF_NACK", message.sequence_num, f"EOF received. {error}")
+            )
 
-        session.is_uploading = False
+        session.reorder_buffer.clear()
+        self._end_upload(session)
 
     # ---------------------------- FileExecutionProtocol -----------------------
 
-    def _handle_execute(self, message, session):
-        Message("EXECUTE_ACK").send(session.socket)
+    async def _handle_execute(self, message, session):
+        session.wire_format = negotiate_wire_format(message.content.get("wire_formats"))
+        await session.send(
+            Message("EXECUTE_ACK", content={"wire_format": session.wire_format}),
+            WIRE_FORMAT_JSON,
+        )
+        try:
+            await self._execute(message, session)
+        finally:
+            session.connection.release(session)
 
-        file_path = os.path.join(self.FILES_DIRECTORY, message.content["file_name"])
-        if not os.path.exists(file_path):
+    async def _execute(self, message, session):
+        file_name = safe_relative_path(message.content["file_name"])
+        file_path = os.path.join(self.FILES_DIRECTORY, file_name)
+        args = [str(arg) for arg in message.content.get("args") or []]
+        if not os.path.isfile(file_path):
             print(f"[FileExecutionProtocol] File not found: {file_path}")
-            Message(
-                "EXECUTE_ERROR",
-                content=f"File not found: {message.content['file_name']}",
-            ).send(session.socket)
+            await session.send(
+                Message("EXECUTE_ERROR", content=f"File not found: {file_name}")
+            )
             return
 
-        print(f"[FileExecutionProtocol] Simulating execution of {file_path}")
+        # Les sorties partent au fil de l'eau dans des EXECUTE_OUTPUT ; un
+        # ancien client ne connaît que l'EXECUTE_RESULT final, qui les
+        # contient alors toutes
+        stream_output = bool(message.content.get("stream_output"))
+        outputs = []
 
-        Message("EXECUTE_RESULT", content="File executed successfully.").send(
-            session.socket
+        async def on_output(stream, data):
+            if stream_output:
+                await session.send(Message("EXECUTE_OUTPUT", stream, data))
+            else:
+                outputs.append(data)
+
+        print(f"[FileExecutionProtocol] Executing {file_path} {args}")
+        start = time.monotonic()
+        self.metrics.increment("executions_total")
+        try:
+            exit_code, cached = await self.executions.run(file_path, args, on_output)
+        except ExecutionError as e:
+            print(f"[FileExecutionProtocol] {e}")
+            self.metrics.increment("executions_failed_total")
+            await session.send(Message("EXECUTE_ERROR", content=str(e)))
+            return
+        elapsed = time.monotonic() - start
+        self.metrics.observe("execution_seconds", elapsed)
+        if cached:
+            self.metrics.increment("executions_cached_total")
+        print(
+            f"[FileExecutionProtocol] {file_name} exited with code {exit_code} "
+            f"in {elapsed:.3f}s{' (cached)' if cached else ''}"
         )
+        if stream_output:
+            result = {"exit_code": exit_code, "cached": cached, "duration": elapsed}
+        else:
+            result = (
+                b"".join(outputs).decode("utf-8", errors="replace")
+                + f"Exit code: {exit_code}"
+            )
+        await session.send(Message("EXECUTE_RESULT", content=result))
+
+    # ---------------------------- FileDownloadProtocol ------------------------
+
+    async def _handle_download(self, message, session):
+        session.wire_format = negotiate_wire_format(message.content.get("wire_formats"))
+        try:
+            await self._download(message, session)
+        except OSError as e:
+            # Trame peut-être envoyée en partie : le flux n'est plus lisible
+            print(f"[FileDownloadProtocol] Error: {e}")
+            session.close()
+        finally:
+            session.connection.release(session)
+
+    async def _download(self, message, session):
+        loop = asyncio.get_running_loop()
+        file_name = safe_relative_path(message.content["file_name"])
+        file_path = os.path.join(self.FILES_DIRECTORY, file_name)
+        try:
+            file = open(file_path, "rb")
+        except OSError:
+            print(f"[FileDownloadProtocol] File not found: {file_path}")
+            await session.send(
+                Message("DOWNLOAD_ERROR", content=f"File not found: {file_name}"),
+                WIRE_FORMAT_JSON,
+            )
+            return
+        file_hash = None
+        try:
+            # Plage demandée : reprise d'un download interrompu, ou partie du
+            # fichier. Le fichier ouvert reste le même s'il est remplacé
+            # pendant l'envoi.
+            file_size = os.fstat(file.fileno()).st_size
+            offset = message.content.get("offset", 0)
+            length = message.content.get("length")
+            if (
+                not isinstance(offset, int)
+                or not 0 <= offset <= file_size
+                or (length is not None and (not isinstance(length, int) or length < 0))
+            ):
+                await session.send(
+                    Message("DOWNLOAD_ERROR", content="Invalid range."),
+                    WIRE_FORMAT_JSON,
+                )
+                return
+            length = min(file_size - offset, file_size if length is None else length)
+
+            # Sans proposition de codecs, le contenu est envoyé brut
+            codec = negotiate_codec(message.content.get("codecs"))
+            if codec != CODEC_NONE and await loop.run_in_executor(
+                None, file_looks_incompressible, file_path
+            ):
+                codec = CODEC_NONE
+            await session.send(
+                Message(
+                    "DOWNLOAD_ACK",
+                    content={
+                        "wire_format": session.wire_format,
+                        "file_size": file_size,
+                        "offset": offset,
+                        "length": length,
+                        "codec": codec,
+                    },
+                ),
+                WIRE_FORMAT_JSON,
+            )
+            print(
+                f"[FileDownloadProtocol] Sending {file_name} "
+                f"({length} bytes from offset {offset}, codec {codec})"
+            )
+
+            # Le hash du fichier entier est calculé pendant l'envoi, ou repris
+            # du cache si le fichier a déjà été servi
+            file_hash = loop.run_in_executor(None, self.file_hashes.file_hash, file)
+            start = time.monotonic()
+            if codec == CODEC_NONE and session.wire_format == WIRE_FORMAT_BINARY:
+                frames = await self._send_file_range(session, file, offset, length)
+            else:
+                frames = await self._send_file_copy(session, file, offset, length, codec)
+            # Le hachage continue même si le client part : son thread lit
+            # encore le fichier, fermé seulement à la fin
+            content = {"file_hash": await asyncio.shield(file_hash)}
+            await session.send(Message("EOF", frames, content))
+            elapsed = time.monotonic() - start
+            self.metrics.increment("downloads_completed_total")
+            self.metrics.increment("download_bytes_total", length)
+            self.metrics.observe(
+                "download_throughput_bytes_per_second",
+                length / max(elapsed, 1e-9),
+                THROUGHPUT_BUCKETS,
+            )
+            print(
+                f"[FileDownloadProtocol] {file_name} sent in {elapsed:.3f}s "
+                f"({length / max(elapsed, 1e-9) / 1e6:.1f} MB/s)"
+            )
+        finally:
+            # Le hachage en cours lit encore le fichier : il est fermé après
+            if file_hash is None or file_hash.done():
+                file.close()
+            else:
+                file_hash.add_done_callback(lambda _: file.close())
+
+    async def _send_file_range(self, session, file, offset, length):
+        # Contenu brut en trame binaire : les octets du fichier ne sont jamais
+        # copiés dans Python
+        frames = 0
+        end = offset + length
+        while offset < end:
+            count = min(DOWNLOAD_FRAME_SIZE, end - offset)
+            header = Message(
+                "DATA", frames, channel=session.channel
+            ).binary_header(count)
+            await session.connection.send_file_range(header, file, offset, count)
+            offset += count
+            frames += 1
+        return frames
+
+    async def _send_file_copy(self, session, file, offset, length, codec):
+        # Contenu compressé, ou encodé en base64 dans le format JSON : les
+        # blocs sont lus et compressés hors de la boucle
+        loop = asyncio.get_running_loop()
+
+        def chunks():
+            position, end = offset, offset + length
+            while position < end:
+                chunk = os.pread(
+                    file.fileno(), min(DOWNLOAD_FRAME_SIZE, end - position), position
+                )
+                if not chunk:
+                    raise OSError("File truncated during download")
+                position += len(chunk)
+                yield chunk
+
+        blocks = chunks() if codec == CODEC_NONE else compress_blocks(chunks(), codec, None)
+        frames = 0
+        while True:
+            block = await loop.run_in_executor(None, next, blocks, None)
+            if block is None:
+                return frames
+            await session.send(Message("DATA", frames, block))
+            frames += 1
 
 
 if __name__ == "__main__":
@@ -227,6 +1785,47 @@ if __name__ == "__main__":
         default=0.05,
         help="Probabilité de perte de paquets",
     )
+    parser.add_argument(
+        "--ack-every",
+        type=int,
+        default=4,
+        help="Nombre de segments reçus avant l'envoi d'un ACK cumulatif",
+    )
+    parser.add_argument(
+        "--ack-delay",
+        type=float,
+        default=0.05,
+        help="Délai maximal avant l'envoi d'un ACK cumulatif, en secondes",
+    )
+    parser.add_argument(
+        "--partial-ttl",
+        type=float,
+        default=86400,
+        help="Durée de conservation des uploads interrompus, en secondes",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Nombre de processus serveur partageant le port Wi-Fi",
+    )
+    parser.add_argument(
+        "--execute-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Nombre maximal d'exécutions simultanées par worker",
+    )
+    parser.add_argument(
+        "--execute-timeout",
+        type=float,
+        default=60.0,
+        help="Durée maximale d'une exécution, en secondes",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Port local des métriques Prometheus (GET /metrics), plus le numéro du worker",
+    )
 
     args = parser.parse_args()
 
@@ -237,5 +1836,12 @@ if __name__ == "__main__":
         args.files_directory,
         args.drop_test,
         args.drop_test_probability,
+        args.ack_every,
+        args.ack_delay,
+        args.workers,
+        args.partial_ttl,
+        args.execute_workers,
+        args.execute_timeout,
+        args.metrics_port,
     )
     server.start()
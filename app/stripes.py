@@ -0,0 +1,127 @@
+import hashlib
+import os
+import time
+
+# Nombre maximal de plages d'un upload découpé
+MAX_STRIPES = 64
+# Taille minimale d'une plage : en dessous, l'UPLOAD et l'EOF de chaque
+# connexion coûtent plus que le parallélisme ne rapporte
+STRIPE_MIN_SIZE = 1024 * 1024
+STRIPE_READ_SIZE = 1024 * 1024
+
+
+def valid_stripe(stripe, file_size):
+    # L'identifiant sert de nom de fichier : on n'accepte que de l'hexadécimal
+    if not isinstance(stripe, dict) or not isinstance(file_size, int):
+        return False
+    transfer_id = stripe.get("id")
+    numbers = [stripe.get(key) for key in ("index", "count", "offset", "length")]
+    if not isinstance(transfer_id, str) or not all(
+        isinstance(number, int) for number in numbers
+    ):
+        return False
+    index, count, offset, length = numbers
+    return (
+        16 <= len(transfer_id) <= 64
+        and all(c in "0123456789abcdef" for c in transfer_id)
+        and 0 <= index < count <= MAX_STRIPES
+        and 0 <= offset
+        and 0 <= length
+        and offset + length <= file_size
+    )
+
+
+class StripedUploadStore:
+    # Uploads découpés en plages envoyées en parallèle sur plusieurs
+    # connexions, indexés par leur identifiant de transfert : <id>.part reçoit
+    # chaque plage à son offset, <id>.<n>.done marque la plage n reçue en
+    # entier. L'état est sur le disque parce que les connexions d'un même
+    # upload peuvent arriver dans des workers différents. Les fichiers d'un
+    # upload expirent quand aucun n'a été modifié depuis ttl secondes.
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def part_path(self, transfer_id):
+        return os.path.join(self.directory, f"{transfer_id}.part")
+
+    def _claimed_path(self, transfer_id):
+        return os.path.join(self.directory, f"{transfer_id}.commit")
+
+    def _done_path(self, transfer_id, index):
+        return os.path.join(self.directory, f"{transfer_id}.{index}.done")
+
+    def open(self, transfer_id, file_size):
+        # Descripteur du fichier partagé par les plages, créé et préalloué
+        # par la première qui arrive
+        fd = os.open(self.part_path(transfer_id), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.posix_fallocate(fd, 0, file_size)
+        except (AttributeError, OSError):
+            # Préallocation non supportée : le fichier a quand même sa taille
+            if os.fstat(fd).st_size < file_size:
+                os.ftruncate(fd, file_size)
+        return fd
+
+    def finish(self, transfer_id, index, count):
+        # Marque la plage reçue. Retourne True à l'appel qui trouve toutes les
+        # plages arrivées et prend le fichier : le renommage n'aboutit qu'une
+        # fois, même entre plusieurs workers.
+        open(self._done_path(transfer_id, index), "w").close()
+        if not all(
+            os.path.exists(self._done_path(transfer_id, other)) for other in range(count)
+        ):
+            return False
+        try:
+            os.rename(self.part_path(transfer_id), self._claimed_path(transfer_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def commit(self, transfer_id, expected_hash, file_path):
+        # Vérifie le hash du fichier réassemblé, relu depuis le cache du
+        # système, puis le renomme vers son nom final
+        claimed_path = self._claimed_path(transfer_id)
+        try:
+            file_hash = hashlib.sha256()
+            with open(claimed_path, "rb") as file:
+                for chunk in iter(lambda: file.read(STRIPE_READ_SIZE), b""):
+                    file_hash.update(chunk)
+                if file_hash.hexdigest() != expected_hash:
+                    return False
+                os.fchmod(file.fileno(), 0o644)
+                os.fsync(file.fileno())
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(claimed_path, file_path)
+            return True
+        finally:
+            self.remove(transfer_id)
+
+    def remove(self, transfer_id):
+        for entry in os.listdir(self.directory):
+            if entry.startswith(f"{transfer_id}."):
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except FileNotFoundError:
+                    pass
+
+    def expire(self):
+        # Supprime les uploads dont aucune plage n'a progressé depuis ttl secondes
+        modified = {}
+        for entry in os.listdir(self.directory):
+            try:
+                mtime = os.path.getmtime(os.path.join(self.directory, entry))
+            except OSError:
+                continue
+            transfer_id = entry.split(".")[0]
+            modified[transfer_id] = max(mtime, modified.get(transfer_id, 0))
+        now = time.time()
+        expired = [
+            transfer_id
+            for transfer_id, mtime in modified.items()
+            if now - mtime > self.ttl
+        ]
+        for transfer_id in expired:
+            self.remove(transfer_id)
+        return len(expired)